@@ -0,0 +1,421 @@
+"""
+非同步 (ASGI) 入口，路徑為 /async/...，查詢規則與 api/index.py 相同：
+
+    GET  /async/?id=03730043          單筆統編
+    GET  /async/?name=台灣大學          名稱查詢
+    POST /async/api {"ids": [...]}    批次查詢
+    GET  /async/api/stats
+
+差別在查詢統編時經濟部商業司 API 與自建資料 (Supabase) 同時查詢，而不是先等政府 API 回應才查 Supabase：
+政府 API 查到時以它為準，並立刻取消還沒回來的 Supabase 查詢；政府 API 查無資料、失敗或超過時限時
+(超過時限的呼叫會被取消)，改用已經在路上的 Supabase 結果。公司以外的統編 (學校、機關) 因此只需等兩者中較慢的一個，
+不必兩個延遲相加。所有請求在同一個 event loop 上以 httpx.AsyncClient 處理，不必每個請求佔用一個執行緒。
+
+快取、鏡像、快照、斷路器、限速與請求追蹤都沿用 api/index.py 的實作。
+"""
+import asyncio
+import os
+import sys
+import time
+from urllib.parse import parse_qs
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+if API_DIR not in sys.path:
+    sys.path.insert(0, API_DIR)
+
+import index as core  # noqa: E402
+from postgrest_lite import check_status  # noqa: E402
+
+# 路由前綴 (見 vercel.json)
+PREFIX = "/async"
+
+# 目前 event loop 使用的 httpx.AsyncClient：(loop, client)
+_async_client = None
+
+
+def get_async_client():
+    """取得目前 event loop 共用的 httpx.AsyncClient，httpx 在第一次需要連線時才載入"""
+    global _async_client
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client[0] is not loop:
+        limits = httpx.Limits(max_connections=core.GOVT_CONCURRENCY * 4, max_keepalive_connections=core.GOVT_CONCURRENCY)
+        _async_client = (loop, httpx.AsyncClient(limits=limits))
+    return _async_client[1]
+
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        client = _async_client[1]
+        _async_client = None
+        await client.aclose()
+
+
+async def query_govt_async(tax_id, ceiling, deadline_at, trace):
+    """
+    async 版的 GovtClient.lookup：限速 → 斷路器 → 經濟部商業司 API。
+    回傳 (狀態, 結果)，狀態為 answered / skipped / failed；被取消時歸還斷路器的試探名額。
+    """
+    import httpx
+
+    try:
+        wait = core.govt_client.bucket.reserve(deadline_at)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        timeout, truncated = core.govt_client.begin(ceiling, deadline_at)
+    except core.GovtUnavailable:
+        return "skipped", None
+    started = time.monotonic()
+    try:
+        resp = await get_async_client().get(core.GOVT_API_URL, params=core.govt_params(tax_id), timeout=timeout)
+        resp.raise_for_status()
+        item = core.parse_govt(tax_id, resp.content)
+    except asyncio.CancelledError:
+        core.govt_client.abandoned()
+        raise
+    except httpx.TimeoutException:
+        core.govt_client.failed(timed_out=True, truncated=truncated)
+        return "failed", None
+    except Exception as e:
+        print(f"Govt API Error ({tax_id}): {e}")
+        core.govt_client.failed()
+        return "failed", None
+    finally:
+        trace.add("govt_id", time.monotonic() - started)
+    core.govt_client.succeeded(time.monotonic() - started)
+    return "answered", item
+
+
+async def query_db_async(ids, trace):
+    """以 PostgREST in 篩選查詢自建資料 (分段並行)，回傳 {統編: 結果}"""
+    async def chunk_query(chunk):
+        url, params, headers, timeout = core.get_supabase().table("unified_numbers").select("*").in_("tax_id", chunk).request()
+        started = time.monotonic()
+        try:
+            resp = await get_async_client().get(url, params=params, headers=headers, timeout=timeout)
+        finally:
+            trace.add("db", time.monotonic() - started)
+        check_status(resp.status_code, resp.text)
+        return resp.json()
+
+    chunks = [ids[i:i + core.DB_IN_CHUNK] for i in range(0, len(ids), core.DB_IN_CHUNK)]
+    found = {}
+    for rows in await asyncio.gather(*(chunk_query(chunk) for chunk in chunks)):
+        for row in rows:
+            found[row.get("tax_id")] = core.db_item(row)
+    return found
+
+
+async def fetch_ids_async(ids, skip_govt, deadline_at, govt_timeout, trace):
+    """
+    不經快取，向上游查詢多個統編，回傳值同 core.fetch_ids。
+    政府 API (逐筆) 與自建資料 (快照或一次 Supabase 查詢) 同時進行：
+    政府 API 全部查到時取消 Supabase 查詢；時限到了還沒回來的政府 API 呼叫會被取消。
+    """
+    results = {}
+    govt_answered, routed, live_ids = core.route_govt(ids, trace) if not skip_govt else ({}, set(), [])
+    local_ids = [x for x in ids if x not in govt_answered]
+
+    # 自建資料：有快照直接在本機查，否則立刻送出 Supabase 查詢，與政府 API 同時進行
+    local, db_task = {}, None
+    snapshot = core.get_snapshot() if local_ids else None
+    if snapshot is not None:
+        local = core.lookup_snapshot(snapshot, local_ids, trace)
+    elif local_ids:
+        db_task = asyncio.ensure_future(query_db_async(local_ids, trace))
+
+    try:
+        if skip_govt or not live_ids:
+            pass
+        elif not core.govt_client.available():
+            trace.count("govt_skipped", len(live_ids))
+        else:
+            govt_answered.update(await race_govt(live_ids, deadline_at, govt_timeout, trace))
+
+        for tax_id, item in govt_answered.items():
+            if item:
+                results[tax_id] = item
+        if db_task is not None:
+            if all(tax_id in results for tax_id in local_ids):
+                # 答案都已確定，不必再等 Supabase
+                db_task.cancel()
+                trace.count("db_cancelled")
+            else:
+                local = await db_task
+                trace.count("db_hit", sum(1 for t in local if t not in results))
+    finally:
+        if db_task is not None and not db_task.done():
+            db_task.cancel()
+
+    settled = set()
+    for tax_id in ids:
+        if tax_id not in results:
+            results[tax_id] = local.get(tax_id) or core.not_found(tax_id)
+            if tax_id not in local:
+                trace.count("not_found")
+        if skip_govt or tax_id in govt_answered or tax_id in routed:
+            settled.add(tax_id)
+    return results, settled
+
+
+async def race_govt(ids, deadline_at, govt_timeout, trace):
+    """併發查詢政府 API，回傳 {統編: 結果} (只包含有明確回應的統編)；時限到時取消其餘呼叫"""
+    semaphore = asyncio.Semaphore(core.GOVT_CONCURRENCY)
+
+    async def one(tax_id):
+        async with semaphore:
+            return await query_govt_async(tax_id, govt_timeout, deadline_at, trace)
+
+    started = time.monotonic()
+    tasks = {asyncio.ensure_future(one(tax_id)): tax_id for tax_id in ids}
+    done, pending = await asyncio.wait(tasks, timeout=max(0, deadline_at - time.monotonic()))
+    for task in pending:
+        task.cancel()
+    if pending:
+        # 讓被取消的呼叫完成斷路器的紀錄
+        await asyncio.gather(*pending, return_exceptions=True)
+    trace.add("govt", time.monotonic() - started)
+
+    answered = {}
+    counts = {"answered": 0, "skipped": 0, "failed": 0}
+    for task in done:
+        status, item = task.result()
+        counts[status] += 1
+        if status == "answered":
+            answered[tasks[task]] = item
+    found = sum(1 for item in answered.values() if item)
+    trace.count("govt_hit", found)
+    trace.count("govt_miss", len(answered) - found)
+    trace.count("govt_failed", counts["failed"])
+    trace.count("govt_skipped", counts["skipped"])
+    trace.count("govt_timeout", len(pending))
+    return answered
+
+
+async def lookup_ids_async(ids, skip_govt, deadline_at, govt_timeout, trace):
+    """經過快取查詢多個統編 (與 core.lookup_ids 共用快取與 single-flight)，回傳 {統編: 結果}"""
+    results = {}
+    pending = []
+    with trace.stage("cache"):
+        for tax_id in dict.fromkeys(ids):
+            cached = core.lookup_cache.get((skip_govt, tax_id))
+            if cached is not None:
+                results[tax_id] = cached
+            else:
+                pending.append(tax_id)
+        if pending:
+            owned, waiting = core.lookup_cache.claim([(skip_govt, tax_id) for tax_id in pending])
+    trace.count("cache_hit", len(results))
+    if not pending:
+        return results
+    owned_ids = [tax_id for _, tax_id in owned]
+    fetched, settled = {}, set()
+    try:
+        if owned_ids:
+            fetched, settled = await fetch_ids_async(owned_ids, skip_govt, deadline_at, govt_timeout, trace)
+    finally:
+        for key in owned:
+            core.lookup_cache.release(key, fetched.get(key[1]), cacheable=key[1] in settled)
+    results.update(fetched)
+
+    for (_, tax_id), future in waiting.items():
+        timeout = max(0, deadline_at + core.SUPABASE_TIMEOUT - time.monotonic())
+        try:
+            value = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            value = None
+        if value is not None:
+            trace.count("cache_shared")
+        else:
+            fetched, _ = await fetch_ids_async([tax_id], True, deadline_at, govt_timeout, trace)
+            value = fetched[tax_id]
+        results[tax_id] = value
+    return results
+
+
+async def resolve_ids_async(raw_ids, skip_govt, deadline_at, govt_timeout, trace):
+    """async 版的 core.resolve_ids"""
+    normalized, groups = core.prepare_ids(raw_ids, skip_govt, trace)
+    results = {}
+    for ids, group_skip_govt in groups:
+        results.update(await lookup_ids_async(ids, group_skip_govt, deadline_at, govt_timeout, trace))
+    return core.expand_results(raw_ids, normalized, results)
+
+
+# --- ASGI ---
+async def send_response(send, status, body, headers):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(k.lower().encode("latin-1"), str(v).encode("latin-1")) for k, v in headers.items()],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_json(send, request_headers, status, payload, max_age=None, trace=None, extra=None):
+    """與 core.handler.send_json 相同的壓縮與快取 header"""
+    body, encoding = core.encode_json(payload, request_headers.get("accept-encoding"), trace)
+    headers = {
+        "Content-Type": "application/json",
+        "Content-Length": len(body),
+        "Vary": "Accept-Encoding",
+        "Cache-Control": core.cache_control(max_age),
+    }
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    headers.update(extra or {})
+    if trace is not None:
+        headers["Server-Timing"] = trace.server_timing()
+    await send_response(send, status, body, headers)
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def send_landing_page(send, request_headers):
+    page = core.get_landing_page()
+    encoding = core.choose_encoding(request_headers.get("accept-encoding"), page.encodings())
+    headers = {
+        "ETag": page.etags[encoding],
+        "Vary": "Accept-Encoding",
+        "Cache-Control": "public, max-age=0, must-revalidate, s-maxage=86400",
+    }
+    if page.not_modified(request_headers.get("if-none-match")):
+        await send_response(send, 304, b"", headers)
+        return
+    headers["Content-Type"] = "text/html; charset=utf-8"
+    headers["Content-Length"] = len(page.variants[encoding])
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    await send_response(send, 200, page.variants[encoding], headers)
+
+
+async def handle_get(send, request_headers, path, query, started_at):
+    trace = core.RequestTrace("ASGI GET")
+    if path == "/api/stats":
+        await send_json(send, request_headers, 200, {
+            "cache": core.lookup_cache.stats(), "govt": core.govt_client.stats()
+        })
+        return
+    id_param = query.get("id", [None])[0] or query.get("統一編號", [None])[0]
+    name_param = query.get("name", [None])[0] or query.get("單位名稱", [None])[0]
+    skip_govt = query.get("skip_govt", ["false"])[0].lower() == "true"
+    if not id_param and not name_param:
+        await send_landing_page(send, request_headers)
+        return
+
+    trace.route = "ASGI GET id" if id_param else "ASGI GET name"
+    if core.get_supabase() is None:
+        await send_json(send, request_headers, 500, {"error": "Server Configuration Error"})
+        trace.log(500)
+        return
+
+    data, error, status, max_age = [], None, 200, core.CDN_MAXAGE_DB
+    next_cursor, name_complete = None, True
+    try:
+        if id_param:
+            [item] = await resolve_ids_async(
+                [id_param], skip_govt, started_at + core.GOVT_DEADLINE, core.GOVT_SINGLE_TIMEOUT, trace
+            )
+            max_age = core.max_age_for(item["資料來源"])
+            if item["資料來源"] in (core.INVALID_FORMAT, core.INVALID_CHECKSUM):
+                status, error = 400, item["資料來源"]
+            elif item["資料來源"] != "查無資料":
+                data.append(item)
+        else:
+            try:
+                limit, after = core.parse_name_page(query)
+            except ValueError as e:
+                status, error = 400, str(e)
+            else:
+                # 名稱查詢 (經濟部商業司與自建資料合併) 使用 requests，放到執行緒，不擋住 event loop
+                data, next_cursor, name_complete = await asyncio.get_running_loop().run_in_executor(
+                    None, core.search_names, name_param, limit, after, trace
+                )
+                max_age = min(core.CDN_MAXAGE_GOVT, core.CDN_MAXAGE_DB) if name_complete else None
+    except Exception as e:
+        error, max_age = str(e), None
+
+    result = {"data": data, "error": error}
+    if id_param and status == 200:
+        result["govt_skipped"] = bool(trace.get("govt_skipped"))
+        result["govt_calls_avoided"] = trace.get("govt_avoided")
+        if result["govt_skipped"]:
+            max_age = None
+    elif name_param and status == 200:
+        result["next_cursor"] = next_cursor
+        result["govt_skipped"] = not name_complete
+    await send_json(send, request_headers, status, result, max_age=max_age, trace=trace,
+                    extra={"Access-Control-Allow-Origin": "*"})
+    trace.log(status)
+
+
+async def handle_post(send, request_headers, body, started_at):
+    trace = core.RequestTrace("ASGI POST")
+    if core.get_supabase() is None:
+        await send_json(send, request_headers, 500, {"error": "Configuration error"})
+        trace.log(500)
+        return
+    try:
+        with trace.stage("parse"):
+            payload = core.json.loads(body.decode("utf-8"))
+            ids = payload.get("ids", [])
+            skip_govt = payload.get("skip_govt", False)
+            if not isinstance(ids, list):
+                raise ValueError("Format error: 'ids' must be a list")
+            ids = [str(x).strip() for x in ids if str(x).strip()]
+        if not ids:
+            await send_json(send, request_headers, 400, {"error": "ids is empty"})
+            trace.log(400)
+            return
+        output = await resolve_ids_async(ids, skip_govt, started_at + core.GOVT_DEADLINE, core.GOVT_BULK_TIMEOUT, trace)
+        result = {
+            "data": output,
+            "count": len(output),
+            "govt_skipped": bool(trace.get("govt_skipped")),
+            "govt_calls_avoided": trace.get("govt_avoided"),
+            "error": None,
+        }
+        await send_json(send, request_headers, 200, result, trace=trace)
+        trace.log(200)
+    except Exception as e:
+        await send_json(send, request_headers, 500, {"error": str(e)})
+        trace.log(500)
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await close_async_client()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+
+    # 整個請求的時限從這裡開始算
+    started_at = time.monotonic()
+    path = scope["path"]
+    if path.startswith(PREFIX):
+        path = path[len(PREFIX):]
+    path = path.rstrip("/") or "/"
+    request_headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+    method = scope["method"]
+    if method == "GET":
+        query = parse_qs(scope.get("query_string", b"").decode("utf-8"))
+        await handle_get(send, request_headers, path, query, started_at)
+    elif method == "POST" and path == "/api":
+        await handle_post(send, request_headers, await read_body(receive), started_at)
+    else:
+        await send_json(send, request_headers, 405 if path in ("/", "/api") else 404, {"error": "not found"})
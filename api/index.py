@@ -1,20 +1,1773 @@
 from http.server import BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 import os
+import sys
+import csv
+import base64
+import bisect
+import gzip
+import hashlib
 import json
-import requests
-from supabase import create_client, Client
+import math
+import re
+import unicodedata
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:  # brotli 為選用套件，沒安裝時說明頁面只提供 gzip
+    brotli = None
+
+# 專案根目錄，共用模組 (lookup_snapshot) 與 data/ 資料檔都放在這裡
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from known_ids import KnownIds
+from lookup_snapshot import Snapshot
+from postgrest_lite import PostgrestClient
+from name_index import SOURCE_ORDER, NameIndex, PrefixIndex, normalize_name, rank_key
+
+
+def env_number(name, default, cast=float, maximum=None):
+    """讀取數值型環境變數，格式錯誤、非正數或非有限值時退回預設值，避免整個 function 起不來"""
+    raw = os.environ.get(name)
+    if raw is None or not raw.strip():
+        return default
+    try:
+        value = cast(raw)
+    except ValueError:
+        print(f"環境變數 {name}={raw!r} 格式錯誤，改用預設值 {default}")
+        return default
+    # nan / inf 會讓後面的 timeout 計算失控，一律視為格式錯誤
+    if not math.isfinite(value) or value <= 0:
+        print(f"環境變數 {name}={raw!r} 必須是大於 0 的有限數值，改用預設值 {default}")
+        return default
+    if maximum is not None and value > maximum:
+        print(f"環境變數 {name}={raw!r} 超過上限，改用 {maximum}")
+        return maximum
+    return value
+
+
+# 經濟部商業司 API (測試或壓測時可用 GCIS_API_URL 指向本機的替身)
+GOVT_API_URL = os.environ.get("GCIS_API_URL") or \
+    'https://data.gcis.nat.gov.tw/od/data/api/9D17AE0D-09B5-4732-A8F4-81ADED04B679'
+# 經濟部商業司公司名稱查詢資料集 (測試或壓測時可用 GCIS_NAME_API_URL 指向本機的替身)
+GOVT_NAME_API_URL = os.environ.get("GCIS_NAME_API_URL") or \
+    'https://data.gcis.nat.gov.tw/od/data/api/6BBA2268-1367-4B42-9CCA-BC17499EBE8C'
+# 批次查詢時同時打政府 API 的上限 (有硬上限，避免逾時殘留的執行緒在熱實例上越積越多)
+GOVT_CONCURRENCY = env_number("GOVT_CONCURRENCY", 8, int, maximum=32)
+# 政府 API 步驟必須在「請求開始後」幾秒內結束 (秒)。
+# Vercel 預設 function 時限為 10 秒，剩下的時間留給 Supabase 查詢與回應。
+GOVT_DEADLINE = env_number("GOVT_DEADLINE", 6.0, maximum=9.0)
+# 單筆請求的 timeout 上限 (秒)：單筆 GET 可以等久一點，批次逐筆查詢則要短一些。
+# 實際 timeout 依最近觀察到的延遲動態調整 (見 GovtClient)，不會超過這兩個值
+GOVT_SINGLE_TIMEOUT = 5
+GOVT_BULK_TIMEOUT = 4
+# 動態 timeout = 最近延遲的 p99 × GOVT_TIMEOUT_FACTOR，但至少 GOVT_MIN_TIMEOUT 秒
+GOVT_MIN_TIMEOUT = env_number("GOVT_MIN_TIMEOUT", 1.0, maximum=5.0)
+GOVT_TIMEOUT_FACTOR = 1.5
+GOVT_LATENCY_WINDOW = 200
+GOVT_LATENCY_MIN_SAMPLES = 20
+# 斷路器：連續失敗/逾時幾次後開啟，開啟後冷卻幾秒才放行試探請求
+GOVT_BREAKER_FAILURES = env_number("GOVT_BREAKER_FAILURES", 5, int)
+GOVT_BREAKER_COOLDOWN = env_number("GOVT_BREAKER_COOLDOWN", 30.0)
+GOVT_BREAKER_PROBES = 1
+# 用戶端限速 (token bucket)：每秒平均請求數與瞬間可用的額度
+GOVT_RATE_LIMIT = env_number("GOVT_RATE_LIMIT", 20.0)
+GOVT_RATE_BURST = env_number("GOVT_RATE_BURST", 20, int)
+# Supabase 查詢的 timeout (秒)
+SUPABASE_TIMEOUT = 3
+
+# batch_update.py 產生的唯讀快照，超過 SNAPSHOT_MAX_AGE 秒視為過期，改回查 Supabase
+SNAPSHOT_PATH = os.environ.get("SNAPSHOT_PATH") or os.path.join(ROOT_DIR, "data", "lookup.snap")
+SNAPSHOT_MAX_AGE = env_number("SNAPSHOT_MAX_AGE", 14 * 86400.0)
+# batch_update.py --mirror-gcis 產生的經濟部商業司公司資料鏡像，
+# 鏡像內的公司不再即時呼叫政府 API；超過 GCIS_MIRROR_MAX_AGE 秒視為過期，全部改回即時查詢
+GCIS_MIRROR_PATH = os.environ.get("GCIS_MIRROR_PATH") or os.path.join(ROOT_DIR, "data", "gcis_mirror.snap")
+GCIS_MIRROR_MAX_AGE = env_number("GCIS_MIRROR_MAX_AGE", 30 * 86400.0)
+# batch_update.py 產生的自建資料統編清單，清單中的統編 (學校、機關、非營利事業) 不查政府 API；
+# 單位的統編很少變動，有效期比快照長
+KNOWN_IDS_PATH = os.environ.get("KNOWN_IDS_PATH") or os.path.join(ROOT_DIR, "data", "known_ids.bin")
+KNOWN_IDS_MAX_AGE = env_number("KNOWN_IDS_MAX_AGE", 60 * 86400.0)
+# 快照對應的單位名稱 n-gram 索引
+NAME_INDEX_PATH = os.environ.get("NAME_INDEX_PATH") or os.path.join(ROOT_DIR, "data", "name_index.bin")
+# 名稱查詢每頁預設與最多回傳的筆數
+NAME_SEARCH_LIMIT = 50
+NAME_PAGE_MAX = 500
+# 名稱查詢合併經濟部商業司 (一次最多 1000 筆) 與自建資料的前 NAME_LOCAL_LIMIT 筆，分頁都在合併後的清單上進行
+NAME_GOVT_TOP = 1000
+NAME_LOCAL_LIMIT = env_number("NAME_LOCAL_LIMIT", 2000, int, maximum=20000)
+NAME_GOVT_TIMEOUT = 4
+# 合併後的名稱查詢結果快取，翻頁時不必重新查詢上游
+NAME_CACHE_ENTRIES = env_number("NAME_CACHE_ENTRIES", 256, int)
+NAME_CACHE_TTL = env_number("NAME_CACHE_TTL", 600.0)
+# 名稱自動完成 (/api/suggest) 預設與最多回傳的筆數；
+# 沒有快照時改查 Supabase，多取幾倍的筆數再於本機排序
+SUGGEST_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+SUGGEST_DB_FETCH_FACTOR = 5
+# Supabase in_ 查詢每段的統編數量 (統編太多會讓網址超過長度限制)
+DB_IN_CHUNK = 200
+# 串流批次查詢：每段的統編數量、同時處理的段數，以及每段政府 API 步驟的時限 (秒)
+BULK_CHUNK_SIZE = env_number("BULK_CHUNK_SIZE", 200, int, maximum=1000)
+BULK_PIPELINE_DEPTH = 2
+BULK_GOVT_DEADLINE = env_number("BULK_GOVT_DEADLINE", 3.0, maximum=30.0)
+# 串流批次查詢上傳內容的大小上限 (bytes)
+BULK_MAX_BODY = 8 * 1024 * 1024
+
+# HTTP 快取：CDN (Vercel edge) 快取統編查詢結果的秒數 (s-maxage)，依各資料來源的更新頻率設定。
+# 公司登記資料隨時可能變動；自建資料每週才更新一次；查無資料的統編可能剛完成登記，只快取很短的時間。
+# 格式或檢查碼錯誤的結果永遠不變，可以快取很久
+CDN_MAXAGE_GOVT = env_number("CDN_MAXAGE_GOVT", 3600, int)
+CDN_MAXAGE_DB = env_number("CDN_MAXAGE_DB", 86400, int)
+CDN_MAXAGE_MISS = env_number("CDN_MAXAGE_MISS", 300, int)
+CDN_MAXAGE_INVALID = 7 * 86400
+# 瀏覽器端的快取秒數 (max-age)，不超過 CDN 的秒數
+BROWSER_MAXAGE = 60
+# JSON 回應超過這個大小 (bytes) 且用戶端接受時才壓縮，太小的回應壓縮後反而變大
+COMPRESS_MIN_BYTES = 1024
+
+# 每個請求輸出一行 JSON 紀錄 (各階段耗時、統編數與命中比例)，設為 0 可關閉
+REQUEST_LOG = os.environ.get("REQUEST_LOG", "1") != "0"
+
+
+# --- 請求追蹤：各階段耗時與計數 ---
+class RequestTrace:
+    """
+    記錄單一請求各階段的耗時與計數，輸出成 Server-Timing header 與一行 JSON 紀錄。
+    只用 perf_counter 與 dict 累加，成本低到可以在正式環境一直開著；
+    政府 API 的 worker 會從多個執行緒同時寫入，所以需要鎖。
+    """
+    # 這些階段在多個執行緒中併發，Server-Timing 的 dur 用最慢一筆而不是加總
+    PARALLEL_STAGES = ("govt_id",)
+    # 命中比例的分子，分母為去重後的統編數
+    HIT_COUNTERS = ("cache_hit", "cache_shared", "mirror_hit", "govt_hit", "snapshot_hit", "db_hit", "not_found")
+
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        # {階段: [總秒數, 次數, 最長一次]}
+        self.stages = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - t0)
+
+    def add(self, name, seconds):
+        with self._lock:
+            entry = self.stages.get(name)
+            if entry is None:
+                self.stages[name] = [seconds, 1, seconds]
+            else:
+                entry[0] += seconds
+                entry[1] += 1
+                entry[2] = max(entry[2], seconds)
+
+    def count(self, name, n=1):
+        if n:
+            with self._lock:
+                self.counts[name] = self.counts.get(name, 0) + n
+
+    def get(self, name):
+        return self.counts.get(name, 0)
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        parts = []
+        with self._lock:
+            for name, (total, n, longest) in self.stages.items():
+                dur = longest if name in self.PARALLEL_STAGES else total
+                part = f"{name};dur={dur * 1000:.1f}"
+                if n > 1:
+                    part += f';desc="n={n}"'
+                parts.append(part)
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(parts)
+
+    def log(self, status):
+        if not REQUEST_LOG:
+            return
+        with self._lock:
+            stages = {name: round(total * 1000, 2) for name, (total, _, _) in self.stages.items()}
+            counts = dict(self.counts)
+        record = {
+            "route": self.route,
+            "status": status,
+            "ms": round(self.elapsed() * 1000, 2),
+            "stages_ms": stages,
+            "counts": counts,
+        }
+        unique = counts.get("unique_ids")
+        if unique:
+            record["hit_ratio"] = {
+                name[:-4] if name.endswith("_hit") else name: round(counts.get(name, 0) / unique, 3)
+                for name in self.HIT_COUNTERS
+            }
+        print(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+
+
+class _NullTrace(RequestTrace):
+    """沒有傳入 trace 時使用，所有紀錄都直接丟掉"""
+
+    def __init__(self):
+        super().__init__(None)
+
+    def add(self, name, seconds):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+
+NO_TRACE = _NullTrace()
+
+
+# --- 跨請求共用的連線 ---
+# Vercel 的熱實例會重複使用同一個 process，client 與連線池放在模組層級，
+# 省掉每次請求重建 client 與 TCP/TLS 交握的成本。
+_client_lock = threading.Lock()
+_supabase_client = None
+_supabase_config = None
+_http_session = None
+
+
+def get_supabase():
+    """
+    取得共用的 Supabase (PostgREST) client；環境變數未設定時回傳 None，變更時自動重建。
+    使用 postgrest_lite 而不是 supabase SDK，與政府 API 共用同一個連線池。
+    """
+    global _supabase_client, _supabase_config
+    url = os.environ.get("SUPABASE_URL")
+    key = os.environ.get("SUPABASE_KEY")
+    if not url or not key:
+        return None
+    with _client_lock:
+        if _supabase_client is None or _supabase_config != (url, key):
+            _supabase_client = PostgrestClient(url, key, session=get_http_session, timeout=SUPABASE_TIMEOUT)
+            _supabase_config = (url, key)
+        return _supabase_client
+
+
+def reset_supabase():
+    global _supabase_client, _supabase_config
+    with _client_lock:
+        _supabase_client = None
+        _supabase_config = None
+
+
+def query_supabase(build_query):
+    """
+    用共用 client 執行查詢，build_query 接收 client 並回傳尚未 execute 的查詢。
+    連線層錯誤 (例如閒置連線已被關閉) 時重建連線池再試一次。
+    """
+    import requests
+
+    try:
+        return build_query(get_supabase()).execute()
+    except requests.ConnectionError as e:
+        print(f"Supabase connection error, rebuilding connection pool: {e}")
+        reset_http_session()
+        return build_query(get_supabase()).execute()
+
+
+def get_http_session():
+    """
+    取得共用的 keep-alive requests.Session (政府 API 與 Supabase 共用)，連線池大小配合併發上限。
+    requests 在第一次需要連線時才載入，只回應說明頁面或全部命中快取的冷啟動不必付這個成本。
+    """
+    global _http_session
+    with _client_lock:
+        if _http_session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=GOVT_CONCURRENCY, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session = session
+        return _http_session
+
+
+def reset_http_session():
+    global _http_session
+    with _client_lock:
+        if _http_session is not None:
+            _http_session.close()
+        _http_session = None
+
+
+# 已開啟的快照檔：{路徑: ((mtime, size), Snapshot 或 None)}
+_snapshots = {}
+
+
+def open_snapshot(path, max_age, loader=Snapshot):
+    """
+    回傳已開啟的快照；檔案不存在、格式錯誤或超過 max_age 秒時回傳 None。
+    loader 為開啟檔案的類別 (需有 age 與 close)，預設為 Snapshot。
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    with _client_lock:
+        stat, snapshot = _snapshots.get(path, (None, None))
+        # 檔案被換掉 (重新部署或手動更新) 時重新開啟
+        if stat != (st.st_mtime, st.st_size):
+            if snapshot is not None:
+                snapshot.close()
+            snapshot = None
+            try:
+                snapshot = loader(path)
+            except (OSError, ValueError) as e:
+                print(f"Snapshot load error: {e}")
+            _snapshots[path] = ((st.st_mtime, st.st_size), snapshot)
+    if snapshot is None or snapshot.age() > max_age:
+        return None
+    return snapshot
+
+
+def get_snapshot():
+    """回傳可用的自建資料快照；沒有可用的快照時回傳 None (改查 Supabase)"""
+    return open_snapshot(SNAPSHOT_PATH, SNAPSHOT_MAX_AGE)
+
+
+def get_gcis_mirror():
+    """回傳可用的經濟部商業司鏡像；沒有或已過期時回傳 None (全部即時查詢)"""
+    return open_snapshot(GCIS_MIRROR_PATH, GCIS_MIRROR_MAX_AGE)
+
+
+def get_known_ids():
+    """回傳可用的自建資料統編清單；沒有或已過期時回傳 None (全部照常查政府 API)"""
+    return open_snapshot(KNOWN_IDS_PATH, KNOWN_IDS_MAX_AGE, loader=KnownIds)
+
+
+_name_index = None
+_name_index_key = None
+
+
+def get_name_index():
+    """回傳與目前快照一致的名稱索引；沒有可用的快照或索引時回傳 None (改查 Supabase)"""
+    global _name_index, _name_index_key
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return None
+    try:
+        st = os.stat(NAME_INDEX_PATH)
+    except OSError:
+        return None
+    key = (id(snapshot), st.st_mtime, st.st_size)
+    with _client_lock:
+        if _name_index_key != key:
+            if _name_index is not None:
+                _name_index.close()
+            _name_index = None
+            _name_index_key = key
+            try:
+                _name_index = NameIndex(NAME_INDEX_PATH, snapshot)
+            except (OSError, ValueError) as e:
+                print(f"Name index load error: {e}")
+        return _name_index
+
+
+# 建立前綴索引需要讀過整份快照，使用獨立的鎖，避免擋住其他請求取得連線
+_prefix_lock = threading.Lock()
+_prefix_index = None
+_prefix_index_snapshot = None
+
+
+def get_prefix_index():
+    """
+    回傳目前快照的名稱前綴索引 (自動完成用)，第一次使用或快照更新時在記憶體中建立；
+    沒有可用的快照時回傳 None (改查 Supabase)。
+    """
+    global _prefix_index, _prefix_index_snapshot
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return None
+    with _prefix_lock:
+        if _prefix_index_snapshot is not snapshot:
+            _prefix_index = PrefixIndex(snapshot)
+            _prefix_index_snapshot = snapshot
+        return _prefix_index
+
+
+def suggest_rank(row):
+    """與 PrefixIndex 相同的排序：名稱長度、資料來源順序、統編"""
+    tax_id, name, source = row
+    order = SOURCE_ORDER.index(source) if source in SOURCE_ORDER else len(SOURCE_ORDER)
+    return len(normalize_name(name)), order, source or "", tax_id
+
+
+def suggest_names(prefix, limit=SUGGEST_LIMIT, source=None, trace=None):
+    """名稱前綴自動完成：優先使用記憶體中的前綴索引，沒有快照時改用 Supabase 的前綴 ilike"""
+    trace = trace or NO_TRACE
+    index = get_prefix_index()
+    if index is not None:
+        with trace.stage("prefix_index"):
+            rows = index.complete(prefix, limit=limit, source=source)
+    else:
+        def build_query(client):
+            query = client.table("unified_numbers").select("*").ilike("name", f"{prefix}%")
+            if source:
+                query = query.eq("source", source)
+            return query.limit(limit * SUGGEST_DB_FETCH_FACTOR)
+
+        with trace.stage("db"):
+            response = query_supabase(build_query)
+        rows = [(item.get("tax_id"), item.get("name"), item.get("source")) for item in response.data]
+        rows = sorted(rows, key=suggest_rank)[:limit]
+    trace.count("results", len(rows))
+    return [
+        {
+            "統一編號": tax_id,
+            "單位名稱": name,
+            "資料來源": source
+        }
+        for tax_id, name, source in rows
+    ]
+
+
+def search_local_names(name, limit, trace=None):
+    """自建資料的名稱子字串查詢：優先使用本機 n-gram 索引，無法使用時改用 Supabase ilike，回傳 [(統編, 名稱, 資料來源)]"""
+    trace = trace or NO_TRACE
+    index = get_name_index()
+    rows = None
+    if index is not None:
+        with trace.stage("name_index"):
+            rows = index.search(name, limit=limit)
+    if rows is None:
+        with trace.stage("db"):
+            response = query_supabase(
+                lambda client: client.table("unified_numbers").select("*").ilike("name", f"%{name}%").limit(limit)
+            )
+        rows = [(item.get("tax_id"), item.get("name"), item.get("source")) for item in response.data]
+    return rows
+
+
+def merge_names(name, *sources):
+    """
+    合併多個來源的 [(統編, 名稱, 資料來源)]：依統編去重 (排在前面的來源優先)，
+    再依 rank_key 排序 (完全相同 > 開頭相同 > 包含、名稱長度、統編)。
+    回傳 (排序鍵 list, 結果 list)；排序鍵含統編，不會重複，可以當作翻頁的 cursor。
+    """
+    normalized_query = normalize_name(name)
+    merged = {}
+    for rows in sources:
+        for row in rows:
+            if row[0] and row[0] not in merged:
+                merged[row[0]] = row
+    ranked = sorted((rank_key(normalized_query, normalize_name(row[1]), row[0]), row) for row in merged.values())
+    return [key for key, _ in ranked], [row for _, row in ranked]
+
+
+def gather_names(name, trace=None):
+    """
+    同時查詢經濟部商業司公司名稱與自建資料，回傳 (排序鍵 list, 結果 list, 經濟部商業司是否有回應)。
+    同一統編兩邊都有時以經濟部商業司為準；經濟部商業司失敗、逾時或被斷路器擋下時只回傳自建資料。
+    """
+    trace = trace or NO_TRACE
+    deadline_at = time.monotonic() + NAME_GOVT_TIMEOUT
+
+    def worker():
+        t0 = time.perf_counter()
+        try:
+            rows = govt_client.call(lambda timeout: query_govt_names(name, timeout), NAME_GOVT_TIMEOUT, deadline_at)
+            return "answered", rows
+        except GovtUnavailable:
+            return "skipped", []
+        except Exception as e:
+            print(f"Govt name API Error ({name}): {e}")
+            return "failed", []
+        finally:
+            trace.add("govt", time.perf_counter() - t0)
+
+    future = None
+    if govt_client.available():
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = executor.submit(worker)
+        # 不等待：逾時的呼叫在背景跑完後結果直接丟棄
+        executor.shutdown(wait=False)
+    local_rows = search_local_names(name, NAME_LOCAL_LIMIT, trace)
+
+    status, govt_rows = "skipped", []
+    if future is not None:
+        try:
+            status, govt_rows = future.result(timeout=max(0, deadline_at - time.monotonic()))
+        except FuturesTimeoutError:
+            status = "timeout"
+    trace.count("govt_hit", len(govt_rows))
+    if status != "answered":
+        trace.count("govt_" + status)
+    with trace.stage("merge"):
+        keys, rows = merge_names(name, govt_rows, local_rows)
+    return keys, rows, status == "answered"
+
+
+class NameSearchCache:
+    """名稱查詢合併結果的行程內快取 (LRU + TTL)，翻頁時直接從合併好的清單取下一頁，不必再查上游"""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+name_cache = NameSearchCache(NAME_CACHE_ENTRIES, NAME_CACHE_TTL)
+
+
+def encode_cursor(key):
+    """排序鍵 (相符程度, 名稱長度, 統編) 編成網址可用的 cursor"""
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """cursor 轉回排序鍵，格式錯誤時拋出 ValueError"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        match, length, tax_id = key
+    except Exception:
+        raise ValueError("cursor 格式錯誤")
+    if not (isinstance(match, int) and isinstance(length, int) and isinstance(tax_id, str)):
+        raise ValueError("cursor 格式錯誤")
+    return match, length, tax_id
+
+
+def parse_name_page(query_components):
+    """從查詢參數取出 (每頁筆數, cursor 對應的排序鍵或 None)；cursor 格式錯誤時拋出 ValueError"""
+    try:
+        limit = int(query_components.get('limit', [NAME_SEARCH_LIMIT])[0])
+    except ValueError:
+        limit = NAME_SEARCH_LIMIT
+    cursor = query_components.get('cursor', [None])[0]
+    return max(1, min(limit, NAME_PAGE_MAX)), decode_cursor(cursor) if cursor else None
+
+
+def search_names(name, limit=NAME_SEARCH_LIMIT, after=None, trace=None):
+    """
+    名稱查詢：經濟部商業司與自建資料合併、依統編去重並排序後，以 keyset 分頁。
+    after 為上一頁最後一筆的排序鍵 (由 cursor 解出)，
+    回傳 (這一頁的結果, 下一頁的 cursor 或 None, 是否包含經濟部商業司的結果)。
+    合併結果放在行程內快取，翻頁只需二分搜尋；快取過期或換了實例時重新查詢，
+    排序鍵只由名稱與統編決定，翻頁不會重複或遺漏。
+    """
+    trace = trace or NO_TRACE
+    cache_key = name.strip()
+    cached = name_cache.get(cache_key)
+    complete = True
+    if cached is not None:
+        trace.count("cache_hit")
+        keys, rows = cached
+    else:
+        keys, rows, complete = gather_names(name, trace)
+        # 經濟部商業司沒有回應時結果不完整，不放進快取
+        if complete:
+            name_cache.put(cache_key, (keys, rows))
+    start = bisect.bisect_right(keys, tuple(after)) if after else 0
+    page = rows[start:start + limit]
+    next_cursor = encode_cursor(keys[start + limit - 1]) if start + limit < len(rows) else None
+    trace.count("results", len(page))
+    # 格式轉換
+    return [
+        {
+            "統一編號": tax_id,
+            "單位名稱": name,
+            "資料來源": source
+        }
+        for tax_id, name, source in page
+    ], next_cursor, complete
+
+
+def govt_params(tax_id):
+    return {
+        '$format': 'json',
+        '$filter': f'Business_Accounting_NO eq {tax_id}',
+        '$skip': 0,
+        '$top': 1
+    }
+
+
+def parse_govt(tax_id, content):
+    """解析經濟部商業司 API 的回應內容，查到回傳結果 dict，查無資料回傳 None"""
+    # 查無資料時 API 會回傳空白內容
+    if not content.strip():
+        return None
+    j_data = json.loads(content)
+    if isinstance(j_data, list) and len(j_data) > 0:
+        item = j_data[0]
+        comp_name = item.get('Company_Name') or item.get('Business_Name')
+        # 確保有拿到名稱
+        if comp_name:
+            return {
+                "統一編號": tax_id,
+                "單位名稱": comp_name,
+                "資料來源": "經濟部商業司"
+            }
+    return None
+
+
+def query_govt(tax_id, timeout):
+    """
+    查詢經濟部商業司 API，查到回傳結果 dict，確定查無資料回傳 None。
+    連線失敗、逾時或非 200 回應則拋出例外，由呼叫端決定如何處理。
+    """
+    import requests
+
+    params = govt_params(tax_id)
+    try:
+        resp = get_http_session().get(GOVT_API_URL, params=params, timeout=timeout)
+    except requests.ConnectionError:
+        # 熱實例上閒置太久的 keep-alive 連線可能已被對方關閉，重建連線池後再試一次
+        reset_http_session()
+        resp = get_http_session().get(GOVT_API_URL, params=params, timeout=timeout)
+    resp.raise_for_status()
+    return parse_govt(tax_id, resp.content)
+
+
+def govt_name_params(name):
+    return {
+        '$format': 'json',
+        '$filter': f'Company_Name like {name} and Company_Status eq 01',
+        '$skip': 0,
+        '$top': NAME_GOVT_TOP
+    }
+
+
+def query_govt_names(name, timeout):
+    """
+    以公司名稱 (部分吻合) 查詢經濟部商業司，只包含核准設立的公司，回傳 [(統編, 名稱, "經濟部商業司")]。
+    連線失敗、逾時或非 200 回應則拋出例外。
+    """
+    import requests
+
+    params = govt_name_params(name)
+    try:
+        resp = get_http_session().get(GOVT_NAME_API_URL, params=params, timeout=timeout)
+    except requests.ConnectionError:
+        reset_http_session()
+        resp = get_http_session().get(GOVT_NAME_API_URL, params=params, timeout=timeout)
+    resp.raise_for_status()
+    # 查無資料時 API 會回傳空白內容
+    if not resp.content.strip():
+        return []
+    rows = []
+    for item in json.loads(resp.content):
+        tax_id = item.get('Business_Accounting_NO')
+        comp_name = item.get('Company_Name')
+        if tax_id and comp_name:
+            rows.append((tax_id, comp_name, "經濟部商業司"))
+    return rows
+
+
+class GovtUnavailable(Exception):
+    """斷路器開啟或超過限速，這次不呼叫政府 API"""
+
+
+class CircuitBreaker:
+    """
+    連續失敗 failure_threshold 次後開啟 (open)，冷卻 cooldown 秒內的呼叫一律拒絕；
+    冷卻後進入半開 (half_open)，只放行 probes 個試探請求，成功就關閉，失敗則重新開啟。
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold, cooldown, probes=1, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.probes = probes
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = 0
+        self.times_opened = 0
+        self.rejected = 0
+
+    def _refresh(self):
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.cooldown:
+            self._state = self.HALF_OPEN
+            self._probing = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    def allows(self):
+        """目前是否可能放行 (不佔用試探名額)，用來決定整個請求要不要跳過政府 API"""
+        return self.state != self.OPEN
+
+    def acquire(self):
+        """每次呼叫前取得許可，不放行時拋出 GovtUnavailable"""
+        with self._lock:
+            self._refresh()
+            if self._state == self.HALF_OPEN and self._probing < self.probes:
+                self._probing += 1
+            elif self._state != self.CLOSED:
+                self.rejected += 1
+                raise GovtUnavailable(f"circuit {self._state}")
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._state = self.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or (
+                self._state == self.CLOSED and self._failures >= self.failure_threshold
+            ):
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+                self.times_opened += 1
+
+    def record_abandoned(self):
+        """呼叫被我們自己的時限截斷，不算成功也不算失敗，只歸還試探名額"""
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._probing:
+                self._probing -= 1
+
+    def stats(self):
+        with self._lock:
+            self._refresh()
+            return {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+            }
+
+
+class TokenBucket:
+    """用戶端限速：每秒補充 rate 個 token，最多累積 burst 個"""
+
+    def __init__(self, rate, burst, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = clock()
+        self.rejected = 0
+
+    def acquire(self, deadline_at):
+        """取得一個 token，需要等待時會 sleep；等到 deadline_at 都拿不到則拋出 GovtUnavailable"""
+        wait = self.reserve(deadline_at)
+        if wait > 0:
+            self._sleep(wait)
+
+    def reserve(self, deadline_at):
+        """預扣一個 token 但不 sleep，回傳需要等待的秒數 (給 async 呼叫端自行等待)"""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            if now + wait > deadline_at:
+                self.rejected += 1
+                raise GovtUnavailable("rate limited")
+            # 先預扣 (可能變負數)，後面排隊的人會算出更長的等待時間
+            self._tokens -= 1
+        return wait
+
+    def stats(self):
+        with self._lock:
+            return {"rate": self.rate, "burst": self.burst, "rejected": self.rejected}
+
+
+class GovtClient:
+    """
+    政府 API 的呼叫入口：限速 → 斷路器 → 依最近延遲決定 timeout → query_govt。
+    外部 API 出狀況時不必每個請求都等滿 timeout，斷路器開啟期間直接改查自建資料。
+    """
+
+    def __init__(self, breaker, bucket, min_timeout=GOVT_MIN_TIMEOUT, factor=GOVT_TIMEOUT_FACTOR,
+                 window=GOVT_LATENCY_WINDOW, min_samples=GOVT_LATENCY_MIN_SAMPLES):
+        self.breaker = breaker
+        self.bucket = bucket
+        self.min_timeout = min_timeout
+        self.factor = factor
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+
+    def percentile(self, p):
+        """最近成功呼叫的延遲百分位數 (秒)，樣本不足時回傳 None"""
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+    def timeout_for(self, ceiling):
+        p99 = self.percentile(0.99)
+        if p99 is None:
+            return ceiling
+        return min(ceiling, max(self.min_timeout, p99 * self.factor))
+
+    def available(self):
+        return self.breaker.allows()
+
+    def lookup(self, tax_id, ceiling, deadline_at):
+        """
+        查詢單一統編，回傳值同 query_govt。
+        不放行時拋出 GovtUnavailable；呼叫失敗時拋出原本的例外並計入斷路器。
+        """
+        return self.call(lambda timeout: query_govt(tax_id, timeout), ceiling, deadline_at)
+
+    def call(self, fn, ceiling, deadline_at):
+        """經過限速與斷路器呼叫 fn(timeout)，回傳 fn 的結果；例外的處理同 lookup"""
+        import requests
+
+        self.bucket.acquire(deadline_at)
+        timeout, truncated = self.begin(ceiling, deadline_at)
+        started = time.monotonic()
+        try:
+            item = fn(timeout)
+        except requests.Timeout:
+            self.failed(timed_out=True, truncated=truncated)
+            raise
+        except Exception:
+            self.failed()
+            raise
+        self.succeeded(time.monotonic() - started)
+        return item
+
+    def begin(self, ceiling, deadline_at):
+        """
+        取得斷路器許可 (不放行時拋出 GovtUnavailable) 並決定這次呼叫的 timeout。
+        回傳 (timeout, 是否被請求的時限截斷)；呼叫結束後必須回報 succeeded / failed / abandoned。
+        """
+        self.breaker.acquire()
+        timeout = self.timeout_for(ceiling)
+        remaining = deadline_at - time.monotonic()
+        with self._lock:
+            self.calls += 1
+        return max(0.01, min(timeout, remaining)), remaining < timeout
+
+    def succeeded(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+        self.breaker.record_success()
+
+    def failed(self, timed_out=False, truncated=False):
+        # 被請求本身的時限截斷的逾時不代表對方有問題，不計入斷路器
+        if timed_out and truncated:
+            self.abandoned()
+            return
+        with self._lock:
+            self.failures += 1
+        self.breaker.record_failure()
+
+    def abandoned(self):
+        """呼叫被我們自己取消 (時限已到或答案已確定)，不計入斷路器"""
+        self.breaker.record_abandoned()
+
+    def stats(self):
+        latency = {f"p{int(p * 100)}": self.percentile(p) for p in (0.5, 0.95, 0.99)}
+        with self._lock:
+            samples = len(self._latencies)
+            calls, failures = self.calls, self.failures
+        return {
+            "calls": calls,
+            "failures": failures,
+            "breaker": self.breaker.stats(),
+            "rate_limit": self.bucket.stats(),
+            "latency": dict(latency, samples=samples),
+            "timeout": {
+                "single": self.timeout_for(GOVT_SINGLE_TIMEOUT),
+                "bulk": self.timeout_for(GOVT_BULK_TIMEOUT),
+            },
+        }
+
+
+govt_client = GovtClient(
+    CircuitBreaker(GOVT_BREAKER_FAILURES, GOVT_BREAKER_COOLDOWN, GOVT_BREAKER_PROBES),
+    TokenBucket(GOVT_RATE_LIMIT, GOVT_RATE_BURST),
+)
+
+
+def query_govt_bulk(ids, deadline_at, concurrency=GOVT_CONCURRENCY, timeout=GOVT_BULK_TIMEOUT, trace=None):
+    """
+    併發查詢多個統編，回傳 {統編: 結果}，只包含政府 API 有明確回應的統編，查無資料的值為 None。
+    deadline_at 為 time.monotonic() 的絕對時間點，時間到還沒回來或查詢失敗的統編不會出現在結果中，
+    留給 Supabase 查詢。timeout 是單筆請求 timeout 的上限。
+    trace 會記錄每筆的耗時 (govt_id) 與整個步驟的耗時 (govt)，以及命中、失敗、被斷路器或限速擋下的筆數。
+    """
+    trace = trace or NO_TRACE
+    results = {}
+    unique_ids = list(dict.fromkeys(ids))
+    if not unique_ids:
+        return results
+
+    def worker(tax_id):
+        # 排隊時已經過了時限的就不用再發請求了。
+        # 注意 requests 的 timeout 是針對連線/每次讀取，不是整個請求的上限，
+        # 所以這裡只是縮短等待，真正的時限由下面的 as_completed 控制。
+        if deadline_at - time.monotonic() <= 0:
+            return "failed", None
+        t0 = time.perf_counter()
+        try:
+            return "answered", govt_client.lookup(tax_id, timeout, deadline_at)
+        except GovtUnavailable:
+            return "skipped", None
+        except Exception as e:
+            # 若外部 API 失敗，則忽略，交給後面的本地 DB
+            print(f"Govt API Error ({tax_id}): {e}")
+            return "failed", None
+        finally:
+            trace.add("govt_id", time.perf_counter() - t0)
+
+    counts = {"answered": 0, "skipped": 0, "failed": 0}
+    with trace.stage("govt"):
+        executor = ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(unique_ids))))
+        futures = {executor.submit(worker, tax_id): tax_id for tax_id in unique_ids}
+        try:
+            for future in as_completed(futures, timeout=max(0, deadline_at - time.monotonic())):
+                status, item = future.result()
+                counts[status] += 1
+                if status == "answered":
+                    results[futures[future]] = item
+        except FuturesTimeoutError:
+            running = sum(1 for f in futures if f.running())
+            print(f"Govt API deadline exceeded: {len(results)}/{len(unique_ids)} answered, {running} still running")
+        finally:
+            # 刻意不等待：排隊中的直接取消，已在執行的請求會在背景跑完
+            # (最多 GOVT_BULK_TIMEOUT 秒、最多 GOVT_CONCURRENCY 條執行緒)，結果直接丟棄。
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    found = sum(1 for item in results.values() if item)
+    trace.count("govt_hit", found)
+    trace.count("govt_miss", len(results) - found)
+    trace.count("govt_failed", counts["failed"])
+    trace.count("govt_skipped", counts["skipped"])
+    trace.count("govt_timeout", len(unique_ids) - sum(counts.values()))
+    return results
+
+
+class LookupCache:
+    """
+    以統編為 key 的行程內快取：依筆數做 LRU 淘汰，依資料來源給不同 TTL。
+    同一個實例裡同時查詢同一個統編時，只有第一個請求會真的打上游 (single-flight)，
+    其他請求等待它的結果。
+    """
+
+    def __init__(self, max_entries, ttl_govt, ttl_db, ttl_miss):
+        self.max_entries = max_entries
+        self.ttl_govt = ttl_govt
+        self.ttl_db = ttl_db
+        self.ttl_miss = ttl_miss
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.shared_loads = 0
+
+    def ttl_for(self, value):
+        source = value.get("資料來源")
+        if source == "經濟部商業司":
+            return self.ttl_govt
+        if source == "查無資料":
+            return self.ttl_miss
+        return self.ttl_db
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._put_locked(key, value)
+
+    def _put_locked(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl_for(value), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def claim(self, keys):
+        """
+        登記要向上游查詢的 key，回傳 (由自己負責查詢的 keys, {別人正在查詢的 key: Future})。
+        由自己負責的 keys 查完後必須呼叫 release，否則等待者會一直等到逾時。
+        """
+        owned = []
+        waiting = {}
+        with self._lock:
+            for key in keys:
+                future = self._inflight.get(key)
+                if future is None:
+                    self._inflight[key] = Future()
+                    owned.append(key)
+                else:
+                    waiting[key] = future
+                    self.shared_loads += 1
+        return owned, waiting
+
+    def release(self, key, value=None, cacheable=False):
+        """完成一個 claim 的 key；value 為 None 代表查詢失敗，等待者需自行處理"""
+        with self._lock:
+            future = self._inflight.pop(key, None)
+            if value is not None and cacheable:
+                self._put_locked(key, value)
+        if future is not None:
+            future.set_result(value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "shared_loads": self.shared_loads,
+                "inflight": len(self._inflight),
+                "ttl": {"govt": self.ttl_govt, "db": self.ttl_db, "miss": self.ttl_miss},
+            }
+
+
+lookup_cache = LookupCache(
+    max_entries=env_number("CACHE_MAX_ENTRIES", 10000, int),
+    ttl_govt=env_number("CACHE_TTL_GOVT", 6 * 3600.0),
+    ttl_db=env_number("CACHE_TTL_DB", 3600.0),
+    ttl_miss=env_number("CACHE_TTL_MISS", 600.0),
+)
+
+
+def not_found(tax_id):
+    return {
+        "統一編號": tax_id,
+        "單位名稱": None,
+        "資料來源": "查無資料"
+    }
+
+
+def lookup_mirror(ids, trace=None):
+    """查經濟部商業司鏡像，回傳 {統編: 結果}，只包含鏡像中有的公司；沒有可用的鏡像時回傳空 dict"""
+    trace = trace or NO_TRACE
+    found = {}
+    mirror = get_gcis_mirror()
+    if mirror is not None:
+        with trace.stage("mirror"):
+            for tax_id in ids:
+                row = mirror.get(tax_id)
+                if row:
+                    found[tax_id] = {
+                        "統一編號": tax_id,
+                        "單位名稱": row[0],
+                        "資料來源": row[1]
+                    }
+        trace.count("mirror_hit", len(found))
+    return found
+
+
+def route_govt(ids, trace=None):
+    """
+    決定哪些統編要即時查政府 API：鏡像中有的公司直接回覆，自建資料統編清單中的單位不必查。
+    回傳 (鏡像結果 {統編: 結果}, 略過政府 API 的統編集合, 要即時查詢的統編 list)。
+    """
+    trace = trace or NO_TRACE
+    mirrored = lookup_mirror(ids, trace)
+    live_ids = [x for x in ids if x not in mirrored]
+    known = get_known_ids() if live_ids else None
+    routed = set()
+    if known is not None:
+        routed = {x for x in live_ids if x in known}
+        live_ids = [x for x in live_ids if x not in routed]
+        trace.count("govt_avoided", len(routed))
+    return mirrored, routed, live_ids
+
+
+def lookup_snapshot(snapshot, ids, trace=None):
+    """在自建資料快照中查詢，回傳 {統編: 結果}，只包含快照中有的統編"""
+    trace = trace or NO_TRACE
+    found = {}
+    with trace.stage("snapshot"):
+        for t_id in ids:
+            row = snapshot.get(t_id)
+            if row:
+                found[t_id] = {
+                    "統一編號": t_id,
+                    "單位名稱": row[0],
+                    "資料來源": row[1]
+                }
+    trace.count("snapshot_hit", len(found))
+    return found
+
+
+def db_item(row):
+    """unified_numbers 的一列轉成回應格式"""
+    return {
+        "統一編號": row.get("tax_id"),
+        "單位名稱": row.get("name"),
+        "資料來源": row.get("source")
+    }
+
+
+def fetch_ids(ids, skip_govt, deadline_at, govt_timeout, trace=None):
+    """
+    不經快取，直接向上游查詢：先查政府 API，沒有的再一次查 Supabase。
+    回傳 ({統編: 結果}, 可以放進快取的統編集合)。
+    政府 API 沒有明確回應 (失敗、逾時或斷路器開啟) 的統編，結果只用在這次請求，不會寫入快取。
+    """
+    trace = trace or NO_TRACE
+    final_results = {}
+    settled = set()
+
+    # --- 步驟 1: 查詢政府 API (逐筆併發查詢) ---
+    # 由於此 API 不支援 Business_Accounting_NO 的 OR 查詢，必須逐筆請求；
+    # 先查離線鏡像，鏡像中有的公司不必再呼叫；自建資料統編清單中的單位政府 API 不會有，直接交給步驟 2
+    govt_answered, routed, live_ids = route_govt(ids, trace) if not skip_govt else ({}, set(), [])
+    if skip_govt or not live_ids:
+        pass
+    elif not govt_client.available():
+        # 斷路器開啟中，不等政府 API，直接查自建資料
+        trace.count("govt_skipped", len(live_ids))
+    else:
+        # 併發查詢，且整個步驟有總時限，逾時的統編交給步驟 2
+        govt_answered.update(query_govt_bulk(live_ids, deadline_at, timeout=govt_timeout, trace=trace))
+    for tax_id, item in govt_answered.items():
+        if item:
+            final_results[tax_id] = item
+
+    # --- 步驟 2: 查詢自建資料 ---
+    # 有可用的快照時直接在本機查，快照就是整份自建資料，沒有的統編即為查無資料；
+    # 快照不存在或過期才查 Supabase (一次性優化)
+    missing_ids = [x for x in ids if x not in final_results]
+    snapshot = get_snapshot() if missing_ids else None
+    if snapshot is not None:
+        final_results.update(lookup_snapshot(snapshot, missing_ids, trace))
+    elif missing_ids:
+        found_before = len(final_results)
+        # 分段查詢，避免統編太多時 in_ 條件讓網址超過長度限制
+        for i in range(0, len(missing_ids), DB_IN_CHUNK):
+            chunk = missing_ids[i:i + DB_IN_CHUNK]
+            with trace.stage("db"):
+                response = query_supabase(
+                    lambda client: client.table("unified_numbers").select("*").in_("tax_id", chunk)
+                )
+            for item in response.data:
+                final_results[item.get("tax_id")] = db_item(item)
+        trace.count("db_hit", len(final_results) - found_before)
+
+    for tax_id in ids:
+        if tax_id not in final_results:
+            final_results[tax_id] = not_found(tax_id)
+            trace.count("not_found")
+        if skip_govt or tax_id in govt_answered or tax_id in routed:
+            settled.add(tax_id)
+
+    return final_results, settled
+
+
+# --- 統編前置處理：正規化、檢查碼驗證、去重 ---
+INVALID_FORMAT = "統一編號格式錯誤"
+INVALID_CHECKSUM = "統一編號檢查碼錯誤"
+UBN_WEIGHTS = (1, 2, 1, 2, 1, 2, 4, 1)
+# 全形轉半形後要移除的分隔符號
+_ID_SEPARATORS = re.compile(r"[\s\-_./]")
+_ID_DIGITS = re.compile(r"[0-9]{1,8}")
+
+
+def valid_checksum(tax_id):
+    """
+    統一編號檢查碼：各位數乘上權重 1,2,1,2,1,2,4,1 後，將乘積的十位數與個位數相加，總和須為 5 的倍數。
+    第七碼為 7 時乘積 28 的位數和 10 可視為 1 或 0，兩者之一符合即可。
+    """
+    total = 0
+    for digit, weight in zip(tax_id, UBN_WEIGHTS):
+        product = int(digit) * weight
+        total += product // 10 + product % 10
+    if total % 5 == 0:
+        return True
+    return tax_id[6] == '7' and (total + 1) % 5 == 0
+
+
+def normalize_tax_id(raw):
+    """
+    全形轉半形、移除空白與分隔符號、不足 8 碼補 0。
+    回傳 (統編, 錯誤)：格式錯誤時統編為 None；檢查碼錯誤時仍回傳統編，錯誤為 INVALID_CHECKSUM。
+    """
+    text = _ID_SEPARATORS.sub("", unicodedata.normalize("NFKC", str(raw)))
+    if not _ID_DIGITS.fullmatch(text):
+        return None, INVALID_FORMAT
+    tax_id = text.zfill(8)
+    if not valid_checksum(tax_id):
+        return tax_id, INVALID_CHECKSUM
+    return tax_id, None
+
+
+def resolve_ids(raw_ids, skip_govt, deadline_at, govt_timeout=GOVT_BULK_TIMEOUT, trace=None):
+    """
+    GET 與 POST 共用的查詢流程，回傳與 raw_ids 同順序、同長度的結果 list。
+    1. 正規化並去重，格式錯誤的直接回覆，不打任何上游。
+    2. 檢查碼錯誤的統編不查政府 API，只查自建資料 (部分機關、學校的統編不符檢查碼規則)，
+       自建資料也沒有才回覆檢查碼錯誤。
+    3. 其餘統編照一般流程查詢，最後依原本的位置展開。
+    trace 為選填的 RequestTrace，記錄各階段耗時與命中筆數。
+    """
+    trace = trace or NO_TRACE
+    normalized, groups = prepare_ids(raw_ids, skip_govt, trace)
+    results = {}
+    for ids, group_skip_govt in groups:
+        results.update(lookup_ids(ids, group_skip_govt, deadline_at, govt_timeout, trace))
+    return expand_results(raw_ids, normalized, results)
+
+
+def prepare_ids(raw_ids, skip_govt, trace=None):
+    """
+    正規化並去重，回傳 (每個輸入的 (統編, 錯誤), [(要查詢的統編, 是否略過政府 API)])。
+    檢查碼錯誤的統編一律略過政府 API。
+    """
+    trace = trace or NO_TRACE
+    with trace.stage("normalize"):
+        normalized = [normalize_tax_id(raw) for raw in raw_ids]
+        valid = list(dict.fromkeys(t for t, err in normalized if t and not err))
+        suspect = list(dict.fromkeys(t for t, err in normalized if err == INVALID_CHECKSUM))
+    trace.count("ids", len(raw_ids))
+    trace.count("unique_ids", len(valid) + len(suspect))
+    trace.count("invalid_format", sum(1 for _, err in normalized if err == INVALID_FORMAT))
+    trace.count("invalid_checksum", len(suspect))
+
+    if skip_govt:
+        groups = [(valid + suspect, True)]
+    else:
+        groups = [(valid, False), (suspect, True)]
+    return normalized, [(ids, group_skip_govt) for ids, group_skip_govt in groups if ids]
+
+
+def expand_results(raw_ids, normalized, results):
+    """依原本的位置展開查詢結果，格式錯誤與檢查碼錯誤 (且查無資料) 的統編回覆錯誤"""
+    output = []
+    for raw, (tax_id, err) in zip(raw_ids, normalized):
+        if err == INVALID_FORMAT:
+            output.append({"統一編號": str(raw), "單位名稱": None, "資料來源": INVALID_FORMAT})
+            continue
+        item = results[tax_id]
+        if err == INVALID_CHECKSUM and item["資料來源"] == "查無資料":
+            item = {"統一編號": tax_id, "單位名稱": None, "資料來源": INVALID_CHECKSUM}
+        output.append(item)
+    return output
+
+
+def lookup_ids(ids, skip_govt, deadline_at, govt_timeout=GOVT_BULK_TIMEOUT, trace=None):
+    """經過快取查詢多個統編，回傳 {統編: 結果}，每個統編都會有結果 (查無資料也是)"""
+    trace = trace or NO_TRACE
+    results = {}
+    pending = []
+    with trace.stage("cache"):
+        for tax_id in dict.fromkeys(ids):
+            cached = lookup_cache.get((skip_govt, tax_id))
+            if cached is not None:
+                results[tax_id] = cached
+            else:
+                pending.append(tax_id)
+        if pending:
+            owned, waiting = lookup_cache.claim([(skip_govt, tax_id) for tax_id in pending])
+    trace.count("cache_hit", len(results))
+    if not pending:
+        return results
+    owned_ids = [tax_id for _, tax_id in owned]
+    fetched, settled = {}, set()
+    try:
+        if owned_ids:
+            fetched, settled = fetch_ids(owned_ids, skip_govt, deadline_at, govt_timeout, trace)
+    finally:
+        # 不論成功失敗都要 release，否則等待同一個統編的其他請求會卡住
+        for key in owned:
+            lookup_cache.release(key, fetched.get(key[1]), cacheable=key[1] in settled)
+    results.update(fetched)
+
+    for (_, tax_id), future in waiting.items():
+        with trace.stage("cache_wait"):
+            try:
+                value = future.result(timeout=max(0, deadline_at + SUPABASE_TIMEOUT - time.monotonic()))
+            except FuturesTimeoutError:
+                value = None
+        if value is not None:
+            trace.count("cache_shared")
+        else:
+            # 另一個請求查詢失敗或太慢，這裡直接查一次本地 DB 作為保底
+            value = fetch_ids([tax_id], True, deadline_at, govt_timeout, trace)[0][tax_id]
+        results[tax_id] = value
+
+    return results
+
+
+def iter_upload_ids(rfile, length):
+    """
+    逐行讀取上傳內容 (每行一個統編，或 CSV/TSV 取第一欄)，不把整個內容讀進記憶體。
+    第一行若不含數字視為標題列略過。
+    """
+    remaining = length
+    first = True
+    while remaining > 0:
+        line = rfile.readline(min(remaining, 65536))
+        if not line:
+            break
+        remaining -= len(line)
+        text = line.decode('utf-8-sig' if first else 'utf-8', errors='replace')
+        field = next(csv.reader([text.replace('\t', ',')]), [''])
+        value = field[0].strip() if field else ''
+        if first:
+            first = False
+            if not any(ch.isdigit() for ch in value):
+                continue
+        if value:
+            yield value
+
+
+def iter_chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stream_lookup(ids, skip_govt, chunk_size=BULK_CHUNK_SIZE, depth=BULK_PIPELINE_DEPTH, trace=None):
+    """
+    分段查詢並依輸入順序逐段產出結果 (list)。
+    同時最多 depth 段在處理中：前一段在輸出時，下一段已經在查詢，記憶體用量固定。
+    """
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=depth) as executor:
+        def submit(chunk):
+            return executor.submit(
+                resolve_ids, chunk, skip_govt, time.monotonic() + BULK_GOVT_DEADLINE, trace=trace
+            )
+
+        for chunk in iter_chunks(ids, chunk_size):
+            pending.append(submit(chunk))
+            if len(pending) >= depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# --- 說明頁面 ---
+LANDING_HTML = """<!DOCTYPE html>
+<html lang="zh-TW">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>統一編號查詢服務</title>
+    <style>
+        body { font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif; max-width: 800px; margin: 40px auto; padding: 0 20px; line-height: 1.6; color: #333; }
+        h1 { border-bottom: 2px solid #eaeaea; padding-bottom: 10px; }
+        code { background: #f4f4f4; padding: 2px 5px; border-radius: 3px; font-family: monospace; }
+        .endpoint { background: #f0f7ff; padding: 15px; border-radius: 8px; border-left: 5px solid #0070f3; margin: 20px 0; }
+        .example { background: #fafafa; padding: 15px; border-radius: 8px; border: 1px solid #eaeaea; }
+        a { color: #0070f3; text-decoration: none; }
+        a:hover { text-decoration: underline; }
+    </style>
+</head>
+<body>
+    <h1>統一編號查詢 API</h1>
+    <p>這是一個公開的統一編號查詢服務。您可以使用統一編號或單位名稱進行查詢。</p>
+    <p><strong>查詢順序：</strong> 優先查詢經濟部商業司資料，若無則查詢自建資料庫 (學校、機關等)；名稱查詢同時查詢兩者並合併結果。</p>
+
+    <div class="endpoint">
+        <h3>單筆查詢</h3>
+        <p>GET <code>/?統一編號={8碼統編}</code></p>
+        <p>GET <code>/?單位名稱={關鍵字}&amp;limit=50&amp;cursor={上一頁的 next_cursor}</code></p>
+        <p>GET <code>/api/suggest?q={名稱開頭}&amp;limit=10</code> (自動完成)</p>
+    </div>
+
+    <div class="endpoint">
+        <h3>單位名稱反查 (Name Lookup)</h3>
+        <p>輸入單位名稱關鍵字 (部分吻合)：</p>
+        <input type="text" id="nameInput" list="nameSuggestions" autocomplete="off" oninput="suggestNames()" placeholder="例如: 台積電" style="width: 100%; padding: 10px; margin-bottom: 10px; border: 1px solid #ccc; border-radius: 5px;">
+        <datalist id="nameSuggestions"></datalist>
+        <button onclick="doNameSearch()" style="background: #0070f3; color: white; border: none; padding: 10px 20px; border-radius: 5px; cursor: pointer;">查詢名稱</button>
+        <div id="nameLoading" style="display:none; margin-top: 10px; color: #666;">查詢中...</div>
+        <div id="nameResultArea" style="margin-top: 10px; display:none;"></div>
+        <button id="nameMore" onclick="loadMoreNames()" style="display:none; margin-top: 10px; background: #333; color: white; border: none; padding: 10px 20px; border-radius: 5px; cursor: pointer;">載入更多</button>
+    </div>
+
+    <div class="endpoint">
+        <h3>多筆查詢 (GUI)</h3>
+        <p>輸入多個統一編號 (每行一個)，一次查詢：</p>
+        <textarea id="bulkInput" rows="10" style="width: 100%; padding: 10px; margin-bottom: 10px;" placeholder="03730043&#10;04199019"></textarea>
+        <button onclick="doBulkQuery(false)" style="background: #0070f3; color: white; border: none; padding: 10px 20px; border-radius: 5px; cursor: pointer; margin-right: 10px;">查詢全部</button>
+        <button onclick="doBulkQuery(true)" style="background: #333; color: white; border: none; padding: 10px 20px; border-radius: 5px; cursor: pointer;">僅查詢資料庫</button>
+        <div id="loading" style="display:none; margin-top: 10px; color: #666;">查詢中...</div>
+        <textarea id="resultArea" rows="10" style="width: 100%; padding: 10px; margin-top: 10px; border: 1px solid #eaeaea; display:none;" readonly></textarea>
+    </div>
+
+    <h3>範例連結</h3>
+    <div class="example">
+        <p><strong>查詢統編：</strong> <a href="/?統一編號=03730043">/?統一編號=03730043</a></p>
+        <p><strong>查詢名稱：</strong> <a href="/?單位名稱=台灣大學">/?單位名稱=台灣大學</a></p>
+    </div>
+
+    <script>
+        let suggestTimer = null;
+        function suggestNames() {
+            // 停止輸入 150 毫秒後才查詢，避免每個按鍵都送出請求
+            clearTimeout(suggestTimer);
+            suggestTimer = setTimeout(async () => {
+                const q = document.getElementById('nameInput').value.trim();
+                const list = document.getElementById('nameSuggestions');
+                if (!q) {
+                    list.innerHTML = '';
+                    return;
+                }
+                try {
+                    const res = await fetch('/api/suggest?limit=10&q=' + encodeURIComponent(q));
+                    const result = await res.json();
+                    list.innerHTML = '';
+                    (result.data || []).forEach(item => {
+                        const option = document.createElement('option');
+                        option.value = item['單位名稱'];
+                        list.appendChild(option);
+                    });
+                } catch (e) {
+                    // 自動完成失敗不影響查詢
+                }
+            }, 150);
+        }
+
+        // 目前的名稱查詢與下一頁的 cursor，「載入更多」時接著查
+        let nameQuery = '';
+        let nameCursor = null;
+
+        async function doNameSearch() {
+            const name = document.getElementById('nameInput').value.trim();
+            if (!name) {
+                alert("請輸入單位名稱關鍵字");
+                return;
+            }
+            nameQuery = name;
+            nameCursor = null;
+            document.getElementById('nameResultArea').style.display = 'none';
+            document.getElementById('nameResultArea').innerHTML = '';
+            await fetchNamePage();
+        }
+
+        async function loadMoreNames() {
+            if (nameCursor) {
+                await fetchNamePage();
+            }
+        }
+
+        async function fetchNamePage() {
+            document.getElementById('nameLoading').style.display = 'block';
+            document.getElementById('nameMore').style.display = 'none';
+
+            try {
+                let url = '/?name=' + encodeURIComponent(nameQuery);
+                if (nameCursor) {
+                    url += '&cursor=' + encodeURIComponent(nameCursor);
+                }
+                const res = await fetch(url);
+                const result = await res.json();
+                const list = result.data || [];
+                const area = document.getElementById('nameResultArea');
+                let table = document.getElementById('nameTable');
+
+                if (!table && list.length === 0) {
+                    area.innerHTML = '<p>查無資料。</p>';
+                } else {
+                    if (!table) {
+                        area.innerHTML = '<table id="nameTable" style="width:100%; border-collapse: collapse; margin-top: 10px;">'
+                            + '<tr style="background:#f4f4f4; text-align:left;"><th style="padding:8px; border:1px solid #ddd;">統一編號</th><th style="padding:8px; border:1px solid #ddd;">單位名稱</th><th style="padding:8px; border:1px solid #ddd;">資料來源</th></tr>'
+                            + '</table>';
+                        table = document.getElementById('nameTable');
+                    }
+                    let html = '';
+                    list.forEach(item => {
+                        html += `<tr>
+                            <td style="padding:8px; border:1px solid #ddd;">${item['統一編號'] || ''}</td>
+                            <td style="padding:8px; border:1px solid #ddd;">${item['單位名稱'] || ''}</td>
+                            <td style="padding:8px; border:1px solid #ddd;">${item['資料來源'] || ''}</td>
+                        </tr>`;
+                    });
+                    table.insertAdjacentHTML('beforeend', html);
+                }
+
+                nameCursor = result.next_cursor || null;
+                document.getElementById('nameMore').style.display = nameCursor ? 'inline-block' : 'none';
+                area.style.display = 'block';
+            } catch (e) {
+                alert("查詢發生錯誤: " + e);
+            } finally {
+                document.getElementById('nameLoading').style.display = 'none';
+            }
+        }
+
+        async function doBulkQuery(skipGovt) {
+            const input = document.getElementById('bulkInput').value;
+            const ids = input.replace(/[\\n\\r]+/g, ",").split(",").map(x => x.trim()).filter(x => x);
+
+            if (ids.length === 0) {
+                alert("請輸入至少一個統一編號");
+                return;
+            }
+
+            document.getElementById('loading').style.display = 'block';
+            document.getElementById('resultArea').style.display = 'none';
+            document.getElementById('resultArea').value = '';
+
+            try {
+                const res = await fetch('/api', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ ids: ids, skip_govt: skipGovt })
+                });
+                const result = await res.json();
+                const list = result.data || [];
+                // Format: 統一編號 [TAB] 單位名稱 [TAB] 資料來源
+                const text = list.map(item => 
+                    (item["統一編號"]||"") + "\\t" + (item["單位名稱"]||"") + "\\t" + (item["資料來源"]||"")
+                ).join("\\n");
+
+                document.getElementById('resultArea').style.display = 'block';
+                document.getElementById('resultArea').value = text;
+            } catch (e) {
+                alert("查詢發生錯誤: " + e);
+            } finally {
+                document.getElementById('loading').style.display = 'none';
+            }
+        }
+    </script>
+</body>
+</html>
+"""
+
+
+class StaticPage:
+    """
+    常駐在 process 內的靜態頁面：第一次使用時編碼並預先壓縮成 gzip (有安裝 brotli 時另外壓縮成 br)，
+    之後的請求直接回傳壓縮好的內容。每種編碼各有一個依內容雜湊產生的強 ETag。
+    """
+
+    def __init__(self, html):
+        body = html.encode('utf-8')
+        digest = hashlib.sha256(body).hexdigest()[:20]
+        self.variants = {None: body, "gzip": gzip.compress(body, 9)}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body, quality=11)
+        self.etags = {
+            encoding: '"%s%s"' % (digest, "-" + encoding if encoding else "") for encoding in self.variants
+        }
+
+    def encodings(self):
+        # 優先使用壓縮率較好的 br
+        return [e for e in ("br", "gzip") if e in self.variants]
+
+    def not_modified(self, if_none_match):
+        """If-None-Match 符合任一編碼的 ETag (內容相同，只是編碼不同) 時回傳 True"""
+        if not if_none_match:
+            return False
+        tags = {tag.strip() for tag in if_none_match.split(",")}
+        if "*" in tags:
+            return True
+        # 比對時忽略弱驗證的 W/ 前綴
+        tags = {tag[2:] if tag.startswith("W/") else tag for tag in tags}
+        return not tags.isdisjoint(self.etags.values())
+
+
+_landing_page = None
+
+
+def get_landing_page():
+    global _landing_page
+    if _landing_page is None:
+        _landing_page = StaticPage(LANDING_HTML)
+    return _landing_page
+
+
+def choose_encoding(accept_encoding, available):
+    """
+    依 Accept-Encoding (含 q 值) 從 available (依偏好排序) 中挑一種壓縮方式，
+    都不被接受時回傳 None，表示不壓縮。
+    """
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.strip().lower()] = q
+    best = None
+    for encoding in available:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > 0 and (best is None or q > best[1]):
+            best = (encoding, q)
+    return best[0] if best else None
+
+
+def encode_json(payload, accept_encoding, trace=None):
+    """
+    把 payload (dict 或已序列化的 bytes) 編成回應內容，回傳 (內容, Content-Encoding 或 None)。
+    內容超過 COMPRESS_MIN_BYTES 且用戶端接受 gzip 時壓縮，耗時記為 compress 階段。
+    """
+    trace = trace or NO_TRACE
+    body = payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode()
+    encoding = None
+    if len(body) >= COMPRESS_MIN_BYTES:
+        encoding = choose_encoding(accept_encoding, ("gzip",))
+        if encoding:
+            with trace.stage("compress"):
+                body = gzip.compress(body, 6)
+    return body, encoding
+
+
+def cache_control(max_age):
+    """CDN 快取 max_age 秒、瀏覽器最多快取 BROWSER_MAXAGE 秒；max_age 為 None 表示不可快取"""
+    if not max_age:
+        return "no-store"
+    return f"public, max-age={min(BROWSER_MAXAGE, max_age)}, s-maxage={max_age}"
+
+
+def max_age_for(source):
+    """依統編查詢結果的資料來源決定 CDN 快取秒數"""
+    if source == "經濟部商業司":
+        return CDN_MAXAGE_GOVT
+    if source == "查無資料":
+        return CDN_MAXAGE_MISS
+    if source in (INVALID_FORMAT, INVALID_CHECKSUM):
+        return CDN_MAXAGE_INVALID
+    return CDN_MAXAGE_DB
+
 
 class handler(BaseHTTPRequestHandler):
+    def send_json(self, status, payload, max_age=None, trace=None, headers=None):
+        """
+        送出 JSON 回應：用戶端接受 gzip 且內容夠大時壓縮，並依 max_age 加上 Cache-Control。
+        有 trace 時壓縮耗時記為 compress 階段，並加上 Server-Timing header。
+        """
+        trace = trace or NO_TRACE
+        body, encoding = encode_json(payload, self.headers.get('Accept-Encoding'), trace)
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        # 可壓縮的回應依 Accept-Encoding 而不同，CDN 必須分開快取
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Cache-Control', cache_control(max_age))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if trace is not NO_TRACE:
+            self.send_header('Server-Timing', trace.server_timing())
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_landing_page(self):
+        """說明頁面：預先壓縮好的內容與 ETag，If-None-Match 相符時回覆 304"""
+        page = get_landing_page()
+        encoding = choose_encoding(self.headers.get('Accept-Encoding'), page.encodings())
+        not_modified = page.not_modified(self.headers.get('If-None-Match'))
+        if not_modified:
+            self.send_response(304)
+        else:
+            self.send_response(200)
+            self.send_header('Content-type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(page.variants[encoding])))
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
+        self.send_header('ETag', page.etags[encoding])
+        self.send_header('Vary', 'Accept-Encoding')
+        # 頁面只在重新部署時改變 (部署時 CDN 快取會被清除)，瀏覽器則每次以 ETag 重新驗證
+        self.send_header('Cache-Control', 'public, max-age=0, must-revalidate, s-maxage=86400')
+        self.end_headers()
+        if not not_modified:
+            self.wfile.write(page.variants[encoding])
+
     def do_GET(self):
-        # 初始化 Supabase
-        url = os.environ.get("SUPABASE_URL")
-        key = os.environ.get("SUPABASE_KEY")
-        
+        started_at = time.monotonic()
+        trace = RequestTrace("GET")
         # 解析 URL 與參數
-        parsed_path = urlparse(self.path)
-        query_components = parse_qs(parsed_path.query)
+        with trace.stage("parse"):
+            parsed_path = urlparse(self.path)
+            query_components = parse_qs(parsed_path.query)
+
+        # 快取與政府 API (斷路器、延遲) 統計，用來調整 TTL 與 timeout
+        if parsed_path.path.rstrip('/') == '/api/stats':
+            self.send_json(200, {"cache": lookup_cache.stats(), "govt": govt_client.stats()})
+            return
         
+        if parsed_path.path.rstrip('/') == '/api/suggest':
+            self.handle_suggest(query_components, trace)
+            return
+
         # 支援參數: id / 統一編號, name / 單位名稱
         id_param = query_components.get('id', [None])[0] or query_components.get('統一編號', [None])[0]
         name_param = query_components.get('name', [None])[0] or query_components.get('單位名稱', [None])[0]
@@ -22,334 +1775,228 @@ class handler(BaseHTTPRequestHandler):
 
         # 如果沒有提供參數，回傳 HTML 說明頁面
         if not id_param and not name_param:
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            
-            html_content = """
-            <!DOCTYPE html>
-            <html lang="zh-TW">
-            <head>
-                <meta charset="UTF-8">
-                <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                <title>統一編號查詢服務</title>
-                <style>
-                    body { font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif; max-width: 800px; margin: 40px auto; padding: 0 20px; line-height: 1.6; color: #333; }
-                    h1 { border-bottom: 2px solid #eaeaea; padding-bottom: 10px; }
-                    code { background: #f4f4f4; padding: 2px 5px; border-radius: 3px; font-family: monospace; }
-                    .endpoint { background: #f0f7ff; padding: 15px; border-radius: 8px; border-left: 5px solid #0070f3; margin: 20px 0; }
-                    .example { background: #fafafa; padding: 15px; border-radius: 8px; border: 1px solid #eaeaea; }
-                    a { color: #0070f3; text-decoration: none; }
-                    a:hover { text-decoration: underline; }
-                </style>
-            </head>
-            <body>
-                <h1>統一編號查詢 API</h1>
-                <p>這是一個公開的統一編號查詢服務。您可以使用統一編號或單位名稱進行查詢。</p>
-                <p><strong>查詢順序：</strong> 優先查詢經濟部商業司資料，若無則查詢自建資料庫 (學校、機關等)。</p>
-                
-                <div class="endpoint">
-                    <h3>單筆查詢</h3>
-                    <p>GET <code>/?統一編號={8碼統編}</code></p>
-                    <p>GET <code>/?單位名稱={關鍵字}</code></p>
-                </div>
-
-                <div class="endpoint">
-                    <h3>單位名稱反查 (Name Lookup)</h3>
-                    <p>輸入單位名稱關鍵字 (部分吻合)：</p>
-                    <input type="text" id="nameInput" placeholder="例如: 台積電" style="width: 100%; padding: 10px; margin-bottom: 10px; border: 1px solid #ccc; border-radius: 5px;">
-                    <button onclick="doNameSearch()" style="background: #0070f3; color: white; border: none; padding: 10px 20px; border-radius: 5px; cursor: pointer;">查詢名稱</button>
-                    <div id="nameLoading" style="display:none; margin-top: 10px; color: #666;">查詢中...</div>
-                    <div id="nameResultArea" style="margin-top: 10px; display:none;"></div>
-                </div>
-
-                <div class="endpoint">
-                    <h3>多筆查詢 (GUI)</h3>
-                    <p>輸入多個統一編號 (每行一個)，一次查詢：</p>
-                    <textarea id="bulkInput" rows="10" style="width: 100%; padding: 10px; margin-bottom: 10px;" placeholder="03730043&#10;04199019"></textarea>
-                    <button onclick="doBulkQuery(false)" style="background: #0070f3; color: white; border: none; padding: 10px 20px; border-radius: 5px; cursor: pointer; margin-right: 10px;">查詢全部</button>
-                    <button onclick="doBulkQuery(true)" style="background: #333; color: white; border: none; padding: 10px 20px; border-radius: 5px; cursor: pointer;">僅查詢資料庫</button>
-                    <div id="loading" style="display:none; margin-top: 10px; color: #666;">查詢中...</div>
-                    <textarea id="resultArea" rows="10" style="width: 100%; padding: 10px; margin-top: 10px; border: 1px solid #eaeaea; display:none;" readonly></textarea>
-                </div>
-
-                <h3>範例連結</h3>
-                <div class="example">
-                    <p><strong>查詢統編：</strong> <a href="/?統一編號=03730043">/?統一編號=03730043</a></p>
-                    <p><strong>查詢名稱：</strong> <a href="/?單位名稱=台灣大學">/?單位名稱=台灣大學</a></p>
-                </div>
-
-                <script>
-                    async function doNameSearch() {
-                        const name = document.getElementById('nameInput').value.trim();
-                        if (!name) {
-                            alert("請輸入單位名稱關鍵字");
-                            return;
-                        }
-
-                        document.getElementById('nameLoading').style.display = 'block';
-                        document.getElementById('nameResultArea').style.display = 'none';
-                        document.getElementById('nameResultArea').innerHTML = '';
-
-                        try {
-                            const res = await fetch('/?name=' + encodeURIComponent(name));
-                            const result = await res.json();
-                            const list = result.data || [];
-                            
-                            if (list.length === 0) {
-                                document.getElementById('nameResultArea').innerHTML = '<p>查無資料。</p>';
-                            } else {
-                                let html = '<table style="width:100%; border-collapse: collapse; margin-top: 10px;">';
-                                html += '<tr style="background:#f4f4f4; text-align:left;"><th style="padding:8px; border:1px solid #ddd;">統一編號</th><th style="padding:8px; border:1px solid #ddd;">單位名稱</th><th style="padding:8px; border:1px solid #ddd;">資料來源</th></tr>';
-                                list.forEach(item => {
-                                    html += `<tr>
-                                        <td style="padding:8px; border:1px solid #ddd;">${item['統一編號'] || ''}</td>
-                                        <td style="padding:8px; border:1px solid #ddd;">${item['單位名稱'] || ''}</td>
-                                        <td style="padding:8px; border:1px solid #ddd;">${item['資料來源'] || ''}</td>
-                                    </tr>`;
-                                });
-                                html += '</table>';
-                                document.getElementById('nameResultArea').innerHTML = html;
-                            }
-                            
-                            document.getElementById('nameResultArea').style.display = 'block';
-                        } catch (e) {
-                            alert("查詢發生錯誤: " + e);
-                        } finally {
-                            document.getElementById('nameLoading').style.display = 'none';
-                        }
-                    }
-
-                    async function doBulkQuery(skipGovt) {
-                        const input = document.getElementById('bulkInput').value;
-                        const ids = input.replace(/[\\n\\r]+/g, ",").split(",").map(x => x.trim()).filter(x => x);
-                        
-                        if (ids.length === 0) {
-                            alert("請輸入至少一個統一編號");
-                            return;
-                        }
-
-                        document.getElementById('loading').style.display = 'block';
-                        document.getElementById('resultArea').style.display = 'none';
-                        document.getElementById('resultArea').value = '';
-
-                        try {
-                            const res = await fetch('/api', {
-                                method: 'POST',
-                                headers: { 'Content-Type': 'application/json' },
-                                body: JSON.stringify({ ids: ids, skip_govt: skipGovt })
-                            });
-                            const result = await res.json();
-                            const list = result.data || [];
-                            // Format: 統一編號 [TAB] 單位名稱 [TAB] 資料來源
-                            const text = list.map(item => 
-                                (item["統一編號"]||"") + "\\t" + (item["單位名稱"]||"") + "\\t" + (item["資料來源"]||"")
-                            ).join("\\n");
-                            
-                            document.getElementById('resultArea').style.display = 'block';
-                            document.getElementById('resultArea').value = text;
-                        } catch (e) {
-                            alert("查詢發生錯誤: " + e);
-                        } finally {
-                            document.getElementById('loading').style.display = 'none';
-                        }
-                    }
-                </script>
-            </body>
-            </html>
-            """
-            self.wfile.write(html_content.encode('utf-8'))
+            self.send_landing_page()
             return
 
-        # --- 優先查詢政府開放資料 (僅限統編查詢) ---
-        found_in_govt = False
-        govt_data = []
-        
-        if id_param and not skip_govt_param:
-            try:
-                # 經濟部商業司 API
-                govt_url = 'https://data.gcis.nat.gov.tw/od/data/api/9D17AE0D-09B5-4732-A8F4-81ADED04B679'
-                params = {
-                    '$format': 'json',
-                    '$filter': f'Business_Accounting_NO eq {id_param}',
-                    '$skip': 0,
-                    '$top': 1
-                }
-                # 增加 timeout 避免卡住
-                gov_response = requests.get(govt_url, params=params, timeout=5)
-                
-                if gov_response.status_code == 200:
-                    json_data = gov_response.json()
-                    if isinstance(json_data, list) and len(json_data) > 0:
-                        item = json_data[0]
-                        comp_name = item.get('Company_Name') or item.get('Business_Name')
-                        if comp_name:
-                            govt_data.append({
-                                "統一編號": id_param,
-                                "單位名稱": comp_name,
-                                "資料來源": "經濟部商業司"
-                            })
-                            found_in_govt = True
-            except Exception as e:
-                # 若外部 API 失敗，則忽略，繼續查本地 DB
-                print(f"Govt API Error: {e}")
-                pass
-
-        if found_in_govt:
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            result = { "data": govt_data, "error": None }
-            self.wfile.write(json.dumps(result, ensure_ascii=False).encode())
+        trace.route = "GET id" if id_param else "GET name"
+        # 冷啟動時 Supabase client 在這裡建立
+        with trace.stage("db_client"):
+            configured = get_supabase() is not None
+        if not configured:
+            self.send_json(500, {"error": "Server Configuration Error"})
+            trace.log(500)
             return
 
-
-        # --- 若政府資料查不到，查詢 Supabase ---
-        if not url or not key:
-            self.send_response(500)
-            self.end_headers()
-            self.wfile.write(json.dumps({"error": "Server Configuration Error"}).encode())
-            return
-
-        supabase: Client = create_client(url, key)
-        
         data = []
         error = None
-        
+        status = 200
+        # CDN 快取秒數，預設依自建資料的更新頻率
+        max_age = CDN_MAXAGE_DB
+        next_cursor = None
+        name_complete = True
+
         try:
-            query = supabase.table("unified_numbers").select("*")
-            
             if id_param:
-                query = query.eq("tax_id", id_param)
-            elif name_param:
-                query = query.ilike("name", f"%{name_param}%")
+                # --- 統編查詢：優先查詢政府開放資料，查不到再查 Supabase (經過快取) ---
+                [item] = resolve_ids(
+                    [id_param], skip_govt_param, started_at + GOVT_DEADLINE,
+                    govt_timeout=GOVT_SINGLE_TIMEOUT, trace=trace
+                )
+                max_age = max_age_for(item["資料來源"])
+                if item["資料來源"] in (INVALID_FORMAT, INVALID_CHECKSUM):
+                    # 格式錯誤直接回覆，不必打上游
+                    status = 400
+                    error = item["資料來源"]
+                elif item["資料來源"] != "查無資料":
+                    data.append(item)
+            else:
+                # --- 名稱查詢：經濟部商業司與自建資料合併，以 cursor 分頁 ---
+                try:
+                    limit, after = parse_name_page(query_components)
+                except ValueError as e:
+                    status = 400
+                    error = str(e)
+                else:
+                    data, next_cursor, name_complete = search_names(name_param, limit, after, trace)
+                    # 結果包含經濟部商業司的資料，依兩者中較短的快取秒數
+                    max_age = min(CDN_MAXAGE_GOVT, CDN_MAXAGE_DB) if name_complete else None
 
-            response = query.limit(50).execute()
-            raw_data = response.data
-            
-            # 格式轉換
-            for item in raw_data:
-                data.append({
-                    "統一編號": item.get("tax_id"),
-                    "單位名稱": item.get("name"),
-                    "資料來源": item.get("source")
-                })
-            
         except Exception as e:
             error = str(e)
+            max_age = None
 
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-        
         result = {
             "data": data,
             "error": error
         }
-        self.wfile.write(json.dumps(result, ensure_ascii=False).encode())
+        if id_param and status == 200:
+            # 政府 API 因斷路器或限速被略過時，結果只來自自建資料
+            result["govt_skipped"] = bool(trace.get("govt_skipped"))
+            result["govt_calls_avoided"] = trace.get("govt_avoided")
+            if result["govt_skipped"]:
+                # 不完整的結果不能讓 CDN 快取，否則政府 API 恢復後仍會回覆舊結果
+                max_age = None
+        elif name_param and status == 200:
+            result["next_cursor"] = next_cursor
+            result["govt_skipped"] = not name_complete
+        with trace.stage("serialize"):
+            body = json.dumps(result, ensure_ascii=False).encode()
+
+        self.send_json(status, body, max_age=max_age, trace=trace,
+                       headers={'Access-Control-Allow-Origin': '*'})
+        trace.log(status)
+
+    def handle_suggest(self, query_components, trace):
+        """GET /api/suggest?q=&limit=&source=：輸入時即時提示的名稱前綴自動完成"""
+        trace.route = "GET suggest"
+        prefix = query_components.get('q', [''])[0].strip()
+        source = query_components.get('source', [None])[0] or None
+        try:
+            limit = int(query_components.get('limit', [SUGGEST_LIMIT])[0])
+        except ValueError:
+            limit = SUGGEST_LIMIT
+        limit = max(1, min(limit, SUGGEST_MAX_LIMIT))
+
+        if not prefix:
+            self.send_json(200, {"data": [], "error": None}, max_age=CDN_MAXAGE_DB, trace=trace,
+                           headers={'Access-Control-Allow-Origin': '*'})
+            trace.log(200)
+            return
+        try:
+            # 有前綴索引時不需要 Supabase client
+            if get_prefix_index() is None:
+                with trace.stage("db_client"):
+                    configured = get_supabase() is not None
+                if not configured:
+                    self.send_json(500, {"error": "Server Configuration Error"})
+                    trace.log(500)
+                    return
+            data = suggest_names(prefix, limit, source, trace)
+            result, max_age = {"data": data, "error": None}, CDN_MAXAGE_DB
+        except Exception as e:
+            result, max_age = {"data": [], "error": str(e)}, None
+        with trace.stage("serialize"):
+            body = json.dumps(result, ensure_ascii=False).encode()
+        self.send_json(200, body, max_age=max_age, trace=trace, headers={'Access-Control-Allow-Origin': '*'})
+        trace.log(200)
 
     def do_POST(self):
-        url = os.environ.get("SUPABASE_URL")
-        key = os.environ.get("SUPABASE_KEY")
+        if urlparse(self.path).path.rstrip('/') == '/api/bulk':
+            self.handle_bulk_stream()
+            return
 
-        if not url or not key:
-            self.send_response(500)
-            self.end_headers()
-            self.wfile.write(json.dumps({"error": "Configuration error"}).encode())
+        # 整個請求的時限從這裡開始算
+        started_at = time.monotonic()
+        trace = RequestTrace("POST")
+
+        with trace.stage("db_client"):
+            configured = get_supabase() is not None
+        if not configured:
+            self.send_json(500, {"error": "Configuration error"})
+            trace.log(500)
             return
             
-        content_length = int(self.headers.get('Content-Length', 0))
-        post_data = self.rfile.read(content_length)
-        
         try:
-            body = json.loads(post_data.decode('utf-8'))
-            ids = body.get('ids', [])
-            skip_govt = body.get('skip_govt', False)
-            if not isinstance(ids, list):
-                raise ValueError("Format error: 'ids' must be a list")
-            
-            ids = [str(x).strip() for x in ids if str(x).strip()]
+            with trace.stage("parse"):
+                content_length = int(self.headers.get('Content-Length', 0))
+                post_data = self.rfile.read(content_length)
+                body = json.loads(post_data.decode('utf-8'))
+                ids = body.get('ids', [])
+                skip_govt = body.get('skip_govt', False)
+                if not isinstance(ids, list):
+                    raise ValueError("Format error: 'ids' must be a list")
+                
+                ids = [str(x).strip() for x in ids if str(x).strip()]
             
             if not ids:
                  self.send_response(400)
                  self.end_headers()
+                 trace.log(400)
                  return
             
-            final_results = {}
-            
-            # --- 步驟 1: 查詢政府 API (逐筆查詢) ---
-            # 由於此 API 不支援 Business_Accounting_NO 的 OR 查詢，必須逐筆請求
-            if not skip_govt:
-                for tax_id in ids:
-                    try:
-                        govt_url = 'https://data.gcis.nat.gov.tw/od/data/api/9D17AE0D-09B5-4732-A8F4-81ADED04B679'
-                        params = {
-                            '$format': 'json',
-                            '$filter': f"Business_Accounting_NO eq {tax_id}",
-                            '$skip': 0,
-                            '$top': 1
-                        }
-                        # 逐筆查詢，timeout 不宜過長
-                        resp = requests.get(govt_url, params=params, timeout=4)
-                        
-                        if resp.status_code == 200:
-                            j_data = resp.json()
-                            if isinstance(j_data, list) and len(j_data) > 0:
-                                item = j_data[0]
-                                comp_name = item.get('Company_Name') or item.get('Business_Name')
-                                
-                                # 確保有拿到名稱
-                                if comp_name:
-                                    final_results[tax_id] = {
-                                        "統一編號": tax_id,
-                                        "單位名稱": comp_name,
-                                        "資料來源": "經濟部商業司"
-                                    }
-                    except Exception as e:
-                        print(f"Govt API Error ({tax_id}): {e}")
-                        pass
-            
-            # --- 步驟 2: 查詢 Supabase (一次性優化) ---
-            missing_ids = [x for x in ids if x not in final_results]
-            
-            if missing_ids:
-                supabase_client: Client = create_client(url, key)
-                response = supabase_client.table("unified_numbers").select("*").in_("tax_id", missing_ids).execute()
-                
-                for item in response.data:
-                    t_id = item.get("tax_id")
-                    final_results[t_id] = {
-                        "統一編號": t_id,
-                        "單位名稱": item.get("name"),
-                        "資料來源": item.get("source")
-                    }
-            
-            output_list = []
-            for q_id in ids:
-                if q_id in final_results:
-                    output_list.append(final_results[q_id])
-                else:
-                    output_list.append({
-                        "統一編號": q_id,
-                        "單位名稱": None,
-                        "資料來源": "查無資料"
-                    })
-            
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
+            # 正規化、驗證、去重後查詢，結果依原本的位置展開
+            output_list = resolve_ids(ids, skip_govt, started_at + GOVT_DEADLINE, trace=trace)
             
             result = {
                 "data": output_list,
                 "count": len(output_list),
+                "govt_skipped": bool(trace.get("govt_skipped")),
+                "govt_calls_avoided": trace.get("govt_avoided"),
                 "error": None
             }
-            self.wfile.write(json.dumps(result, ensure_ascii=False).encode())
+            with trace.stage("serialize"):
+                payload = json.dumps(result, ensure_ascii=False).encode()
+
+            self.send_json(200, payload, trace=trace)
+            trace.log(200)
 
         except Exception as e:
-            self.send_response(500)
+            self.send_json(500, {"error": str(e)})
+            trace.log(500)
+
+    def handle_bulk_stream(self):
+        """
+        串流批次查詢：POST /api/bulk?format=ndjson|tsv&skip_govt=true
+        上傳內容為每行一個統編 (或 CSV 第一欄)，結果依輸入順序邊查邊回傳。
+        標頭在查詢前就送出，無法附上 Server-Timing，各階段耗時只寫在請求紀錄中。
+        """
+        trace = RequestTrace("POST bulk")
+        query_components = parse_qs(urlparse(self.path).query)
+        output_format = query_components.get('format', ['ndjson'])[0].lower()
+        skip_govt = query_components.get('skip_govt', ['false'])[0].lower() == 'true'
+
+        if output_format not in ('ndjson', 'tsv'):
+            self.send_response(400)
             self.send_header('Content-type', 'application/json')
             self.end_headers()
-            self.wfile.write(json.dumps({"error": str(e)}).encode())
+            self.wfile.write(json.dumps({"error": "format must be ndjson or tsv"}).encode())
+            trace.log(400)
+            return
+        with trace.stage("db_client"):
+            configured = get_supabase() is not None
+        if not configured:
+            self.send_response(500)
+            self.end_headers()
+            self.wfile.write(json.dumps({"error": "Configuration error"}).encode())
+            trace.log(500)
+            return
+        content_length = int(self.headers.get('Content-Length', 0))
+        if content_length > BULK_MAX_BODY:
+            self.send_response(413)
+            self.end_headers()
+            trace.log(413)
+            return
+
+        # 不設定 Content-Length，以關閉連線作為結束，第一段查完就開始回傳
+        self.send_response(200)
+        if output_format == 'ndjson':
+            self.send_header('Content-type', 'application/x-ndjson; charset=utf-8')
+        else:
+            self.send_header('Content-type', 'text/tab-separated-values; charset=utf-8')
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.close_connection = True
+
+        if output_format == 'tsv':
+            self.wfile.write("統一編號\t單位名稱\t資料來源\n".encode('utf-8'))
+        try:
+            ids = iter_upload_ids(self.rfile, content_length)
+            for rows in stream_lookup(ids, skip_govt, trace=trace):
+                with trace.stage("serialize"):
+                    if output_format == 'ndjson':
+                        out = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+                    else:
+                        out = "".join(
+                            f"{row['統一編號']}\t{row['單位名稱'] or ''}\t{row['資料來源']}\n" for row in rows
+                        )
+                with trace.stage("write"):
+                    self.wfile.write(out.encode('utf-8'))
+                    self.wfile.flush()
+        except Exception as e:
+            trace.count("errors")
+            # 標頭已送出，只能在內容最後附上錯誤
+            if output_format == 'ndjson':
+                self.wfile.write((json.dumps({"error": str(e)}) + "\n").encode())
+            else:
+                self.wfile.write(f"#error\t{e}\n".encode('utf-8'))
+        trace.log(200)
@@ -1,97 +1,430 @@
 import os
-import io
-import pandas as pd
-import requests
-import urllib3
+import json
+import math
+import time
+import hashlib
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
 from supabase import create_client, Client
+from ingest import SOURCES, CsvSink, ParquetSink, SnapshotSink, XlsxSink, run_pipeline
+from gcis_mirror import run_mirror
 
-# 忽略不安全的 SSL 警告
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+# 資料表名稱
+TABLE_NAME = "unified_numbers"
+# 跟著 API 一起部署的唯讀查詢快照
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+SNAPSHOT_PATH = os.path.join(DATA_DIR, "lookup.snap")
+NAME_INDEX_PATH = os.path.join(DATA_DIR, "name_index.bin")
+KNOWN_IDS_PATH = os.path.join(DATA_DIR, "known_ids.bin")
+# 增量同步：上次成功同步的每筆資料雜湊，以及本次執行摘要
+MANIFEST_PATH = os.path.join(DATA_DIR, "sync_manifest.json")
+SUMMARY_PATH = os.path.join(DATA_DIR, "sync_summary.json")
+# 經濟部商業司公司資料的離線鏡像 (--mirror-gcis)
+GCIS_MIRROR_PATH = os.path.join(DATA_DIR, "gcis_mirror.snap")
+GCIS_MIRROR_SUMMARY_PATH = os.path.join(DATA_DIR, "gcis_mirror_summary.json")
+# 一次刪除超過上次資料量的這個比例時視為異常 (例如來源檔案格式改變)，不執行刪除
+MAX_DELETE_RATIO = 0.2
+BATCH_SIZE = 1000
+# upsert：同時上傳的批次數，以及依觀察到的內容大小與延遲調整批次筆數時的範圍與目標
+UPSERT_WORKERS = 4
+MIN_BATCH_SIZE = 100
+MAX_BATCH_SIZE = 5000
+TARGET_BATCH_BYTES = 512 * 1024
+TARGET_BATCH_SECONDS = 2.0
+# 每批失敗時的重試次數與第一次重試前等待的秒數 (之後每次加倍)
+UPSERT_RETRIES = 4
+UPSERT_BACKOFF = 1.0
+# upsert 進度的檢查點，中斷後重新執行同一份計畫時從這裡繼續
+CHECKPOINT_PATH = os.environ.get("UPSERT_CHECKPOINT_PATH") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".cache", "upsert_checkpoint.json"
+)
 
-# Supabase 設定
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("請確認環境變數 SUPABASE_URL 與 SUPABASE_KEY 是否已設定")
+def create_supabase() -> Client:
+    # Supabase 設定
+    url = os.environ.get("SUPABASE_URL")
+    key = os.environ.get("SUPABASE_KEY")
+    if not url or not key:
+        raise ValueError("請確認環境變數 SUPABASE_URL 與 SUPABASE_KEY 是否已設定")
+    return create_client(url, key)
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-# 資料表名稱
-TABLE_NAME = "unified_numbers"
 
-def fetch_and_extract(url, source_name):
-    print(f"正在處理: {source_name}")
+def row_hash(tax_id, name, source):
+    """每筆資料的內容雜湊，用來判斷資料是否有變動"""
+    raw = "\x1f".join("" if v is None or isinstance(v, float) else str(v) for v in (tax_id, name, source))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def load_manifest(path=MANIFEST_PATH):
     try:
-        response = requests.get(url, verify=False)
-        response.raise_for_status()
-        
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)["rows"]
+    except FileNotFoundError:
+        return None
+    except (ValueError, KeyError) as e:
+        print(f"同步紀錄格式錯誤，改為完整同步: {e}")
+        return None
+
+
+def save_manifest(hashes, path=MANIFEST_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "rows": hashes}, f, separators=(",", ":"), sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def fetch_remote_ids(client):
+    """沒有同步紀錄時，從資料表分頁取出現有的統編，用來找出已下架的資料"""
+    ids = set()
+    start = 0
+    while True:
+        rows = (
+            client.table(TABLE_NAME).select("tax_id").order("tax_id")
+            .range(start, start + BATCH_SIZE - 1).execute().data
+        )
+        ids.update(row["tax_id"] for row in rows)
+        if len(rows) < BATCH_SIZE:
+            return ids
+        start += BATCH_SIZE
+
+
+def plan_delta(df, previous):
+    """
+    比對本次資料與上次同步紀錄。
+    回傳 (本次所有雜湊, 需要 upsert 的 DataFrame, 需要刪除的統編, 新增筆數, 變更筆數)。
+    previous 為 None 時 (第一次執行或強制完整同步) 全部 upsert。
+    """
+    hashes = {
+        row.tax_id: row_hash(row.tax_id, row.name, row.source)
+        for row in df[['tax_id', 'name', 'source']].itertuples(index=False)
+    }
+    if previous is None:
+        return hashes, df, [], len(df), 0
+
+    new_ids = {t for t in hashes if t not in previous}
+    changed_ids = {t for t, h in hashes.items() if t in previous and previous[t] != h}
+    removed = sorted(t for t in previous if t not in hashes)
+    upserts = df[df['tax_id'].isin(new_ids | changed_ids)]
+    return hashes, upserts, removed, len(new_ids), len(changed_ids)
+
+
+def iter_records(df, start=0):
+    """逐筆產生 upsert 用的 dict，不一次建立整份 list；start 之前的資料略過 (從檢查點繼續)"""
+    columns = list(df.columns)
+    for values in df.iloc[start:].itertuples(index=False, name=None):
+        yield {c: None if isinstance(v, float) and math.isnan(v) else v for c, v in zip(columns, values)}
+
+
+class BatchSizer:
+    """
+    依最近完成批次的內容大小與延遲調整下一批的筆數，往 TARGET_BATCH_BYTES 與 TARGET_BATCH_SECONDS 靠攏；
+    每次最多放大或縮小一倍，避免單一批次的延遲讓大小劇烈波動。
+    """
+
+    def __init__(self, size=BATCH_SIZE, minimum=MIN_BATCH_SIZE, maximum=MAX_BATCH_SIZE,
+                 target_bytes=TARGET_BATCH_BYTES, target_seconds=TARGET_BATCH_SECONDS):
+        self.size = size
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_bytes = target_bytes
+        self.target_seconds = target_seconds
+
+    def observe(self, rows, nbytes, seconds):
+        if not rows:
+            return
+        ratio = min(self.target_bytes / max(nbytes, 1), self.target_seconds / max(seconds, 1e-3))
+        ratio = max(0.5, min(2.0, ratio))
+        self.size = max(self.minimum, min(self.maximum, int(rows * ratio)))
+
+
+class UploadCheckpoint:
+    """
+    記錄一份 upsert 計畫已經由前往後連續處理到第幾筆，以及確定失敗的統編。
+    批次並行完成、順序不定，只有前面的批次全部處理完 (成功或重試後仍失敗) 時位置才往前推進；
+    path 為 None 時只記在記憶體中。
+    """
+
+    def __init__(self, path, plan_key):
+        self.path = path
+        self.plan_key = plan_key
+        self.offset = 0
+        self.failed = []
+        self._finished = {}
+        state = self._load()
+        if state and state.get("plan") == plan_key:
+            self.offset = state["offset"]
+            self.failed = state["failed"]
+
+    def _load(self):
+        if not self.path:
+            return None
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def done(self, start, end, failed_ids):
+        """登記 [start, end) 已處理完"""
+        self._finished[start] = (end, failed_ids)
+        advanced = False
+        while self.offset in self._finished:
+            end, failed_ids = self._finished.pop(self.offset)
+            self.offset = end
+            self.failed.extend(failed_ids)
+            advanced = True
+        if advanced and self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"plan": self.plan_key, "offset": self.offset, "failed": self.failed}, f)
+            os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def upsert_batch(client, batch):
+    """
+    上傳一批，失敗時以指數退避重試 UPSERT_RETRIES 次。
+    回傳 (是否成功, 內容大小 bytes, 最後一次上傳的秒數, 最後的錯誤)。
+    """
+    nbytes = len(json.dumps(batch, ensure_ascii=False).encode("utf-8"))
+    error = None
+    for attempt in range(UPSERT_RETRIES + 1):
+        if attempt:
+            time.sleep(UPSERT_BACKOFF * 2 ** (attempt - 1))
+        started = time.monotonic()
         try:
-            content = response.content.decode('utf-8')
-        except UnicodeDecodeError:
-            content = response.content.decode('cp950')
-            
-        df = pd.read_csv(io.StringIO(content), dtype=str)
-        df.columns = [c.strip() for c in df.columns]
-        
-        name_col = None
-        possible_names = ['單位名稱', '機關單位名稱', '機關名稱']
-        for col in df.columns:
-            if col in possible_names:
-                name_col = col
+            # Upsert on tax_id
+            client.table(TABLE_NAME).upsert(batch, on_conflict='tax_id').execute()
+            return True, nbytes, time.monotonic() - started, None
+        except Exception as e:
+            error = e
+            print(f"  批次上傳失敗 ({attempt + 1}/{UPSERT_RETRIES + 1}): {e}")
+    return False, nbytes, time.monotonic() - started, error
+
+
+def upload(client, df, workers=UPSERT_WORKERS, checkpoint=None):
+    """
+    以最多 workers 個平行 worker 分批 upsert，回傳重試後仍上傳失敗的統編。
+    資料從 DataFrame 逐筆產生，同時在途的批次不超過 workers × 2，記憶體用量與總筆數無關；
+    有 checkpoint 時從上次處理到的位置繼續，每批處理完都會記錄進度。
+    """
+    checkpoint = checkpoint or UploadCheckpoint(None, None)
+    if checkpoint.offset:
+        print(f"  從檢查點繼續，略過前 {checkpoint.offset} 筆")
+    records = iter_records(df, checkpoint.offset)
+    sizer = BatchSizer()
+    position = checkpoint.offset
+    pending = {}
+    exhausted = False
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            while not exhausted and len(pending) < workers * 2:
+                batch = list(islice(records, sizer.size))
+                if not batch:
+                    exhausted = True
+                    break
+                pending[executor.submit(upsert_batch, client, batch)] = (position, batch)
+                position += len(batch)
+            if not pending:
                 break
-        
-        if '統一編號' in df.columns and name_col:
-            # 選取需要的欄位
-            sub_df = df[['統一編號', name_col]].copy()
-            # 重新命名為資料庫欄位: tax_id (統一編號), name (單位名稱)
-            sub_df.columns = ['tax_id', 'name'] 
-            sub_df['tax_id'] = sub_df['tax_id'].str.strip()
-            sub_df['name'] = sub_df['name'].str.strip()
-            # 加入 source (資料來源)
-            sub_df['source'] = source_name 
-            return sub_df
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                start, batch = pending.pop(future)
+                ok, nbytes, seconds, error = future.result()
+                end = start + len(batch)
+                if ok:
+                    sizer.observe(len(batch), nbytes, seconds)
+                    print(f"  已處理批次 {start} - {end} ({nbytes // 1024} KB, {seconds:.2f}s)")
+                    checkpoint.done(start, end, [])
+                else:
+                    print(f"  批次 {start} - {end} 重試後仍上傳失敗: {error}")
+                    checkpoint.done(start, end, [r['tax_id'] for r in batch])
+    return set(checkpoint.failed)
+
+
+def upsert_plan_key(upserts, hashes):
+    """upsert 計畫的識別碼：要上傳的統編與內容雜湊 (依順序)，計畫相同時才沿用檢查點"""
+    digest = hashlib.sha1()
+    for tax_id in upserts['tax_id']:
+        digest.update(f"{tax_id}:{hashes[tax_id]}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def delete_ids(client, ids):
+    """分批刪除來源已不存在的統編，回傳刪除失敗的統編"""
+    failed = set()
+    for i in range(0, len(ids), BATCH_SIZE):
+        batch = ids[i:i + BATCH_SIZE]
+        try:
+            client.table(TABLE_NAME).delete().in_('tax_id', batch).execute()
+            print(f"  已刪除批次 {i} - {i + len(batch)}")
+        except Exception as e:
+            print(f"  批次 {i} 刪除失敗: {e}")
+            failed.update(batch)
+    return failed
+
+
+def sync(client, df, full=False, complete=True, allow_mass_delete=False, manifest_path=MANIFEST_PATH,
+         workers=UPSERT_WORKERS, checkpoint_path=None):
+    """
+    增量同步到 Supabase：只 upsert 新增或變動的資料，並刪除來源已不存在的統編。
+    complete 為 False 代表有來源下載失敗，此時不做刪除，避免把該來源整批刪掉。
+    upsert 進度記錄在 checkpoint_path (預設 CHECKPOINT_PATH)，同步紀錄寫入後才清除。
+    回傳執行摘要 dict。
+    """
+    durations = {}
+    t0 = time.monotonic()
+    previous = None if full else load_manifest(manifest_path)
+    hashes, upserts, removed, new_count, changed_count = plan_delta(df, previous)
+    mode = "delta"
+    if previous is None:
+        mode = "full"
+        # 沒有同步紀錄可比對，改從資料表取出現有統編找出已下架的資料
+        removed = sorted(fetch_remote_ids(client) - set(hashes)) if complete else []
+    durations["diff"] = time.monotonic() - t0
+
+    base_count = len(previous) if previous is not None else len(hashes) + len(removed)
+    skipped_delete = None
+    if removed and not complete:
+        skipped_delete = "部分來源下載失敗"
+    elif removed and not allow_mass_delete and len(removed) > base_count * MAX_DELETE_RATIO:
+        skipped_delete = f"刪除筆數 {len(removed)} 超過上次資料量的 {MAX_DELETE_RATIO:.0%}"
+    if skipped_delete:
+        print(f"略過刪除: {skipped_delete}")
+
+    print(f"同步模式: {mode}，新增 {new_count}、變更 {changed_count}、刪除 {len(removed)} 筆")
+
+    t0 = time.monotonic()
+    checkpoint = UploadCheckpoint(checkpoint_path or CHECKPOINT_PATH, upsert_plan_key(upserts, hashes))
+    failed_upserts = upload(client, upserts, workers, checkpoint) if len(upserts) else set()
+    durations["upsert"] = time.monotonic() - t0
+
+    t0 = time.monotonic()
+    failed_deletes = set()
+    if removed and not skipped_delete:
+        failed_deletes = delete_ids(client, removed)
+    durations["delete"] = time.monotonic() - t0
+
+    # 同步紀錄只記錄確定已寫入資料庫的狀態，失敗的部分下次會再同步一次
+    manifest = dict(hashes)
+    for tax_id in failed_upserts:
+        if previous is not None and tax_id in previous:
+            manifest[tax_id] = previous[tax_id]
         else:
-            return None
-    except Exception as e:
-        print(f"  -> 發生錯誤: {e}")
-        return None
+            manifest.pop(tax_id, None)
+    for tax_id in removed:
+        if skipped_delete or tax_id in failed_deletes:
+            # 沒刪掉的保留在紀錄中，下次比對時會再嘗試刪除
+            manifest[tax_id] = previous[tax_id] if previous is not None else ""
+    save_manifest(manifest, manifest_path)
+    checkpoint.clear()
+
+    return {
+        "mode": mode,
+        "total": len(hashes),
+        "new": new_count,
+        "changed": changed_count,
+        "unchanged": len(hashes) - len(upserts),
+        "removed": 0 if skipped_delete else len(removed) - len(failed_deletes),
+        "failed_upserts": len(failed_upserts),
+        "failed_deletes": len(failed_deletes),
+        "skipped_delete": skipped_delete,
+        "durations": durations,
+    }
+
+
+class SupabaseSink:
+    """共用流程的 Supabase 輸出：增量同步到 unified_numbers 表"""
+    name = "supabase"
 
-def main():
-    sources = [
-        ("https://eip.fia.gov.tw/data/BGMOPEN99X.csv", "全國各級學校"),
-        ("https://www.fia.gov.tw/download/9bc4de1485014443b518beb37d8f35fe", "行政院所屬機關"),
-        ("https://www.fia.gov.tw/download/2d35e0525c484964a84798baf39c72d2", "地方政府機關"),
-        ("https://eip.fia.gov.tw/data/BGMOPEN99.csv", "非營利事業")
-    ]
-    
-    all_dfs = []
-    for url, name in sources:
-        df = fetch_and_extract(url, name)
-        if df is not None:
-            all_dfs.append(df)
-            
-    if all_dfs:
-        final_df = pd.concat(all_dfs, ignore_index=True)
-        # 以 'tax_id' 去重
-        final_df.drop_duplicates(subset=['tax_id'], keep='first', inplace=True)
-        
-        print(f"準備上傳 {len(final_df)} 筆資料到 Supabase (Table: {TABLE_NAME})...")
-        
-        records = final_df.to_dict(orient='records')
-        
-        batch_size = 1000
-        for i in range(0, len(records), batch_size):
-            batch = records[i:i+batch_size]
-            try:
-                # Upsert on tax_id
-                supabase.table(TABLE_NAME).upsert(batch, on_conflict='tax_id').execute()
-                print(f"  已處理批次 {i} - {i + len(batch)}")
-            except Exception as e:
-                print(f"  批次 {i} 上傳失敗: {e}")
-                
+    def __init__(self, client, full=False, allow_mass_delete=False, manifest_path=MANIFEST_PATH,
+                 workers=UPSERT_WORKERS):
+        self.client = client
+        self.full = full
+        self.allow_mass_delete = allow_mass_delete
+        self.manifest_path = manifest_path
+        self.workers = workers
+        self.summary = None
+
+    def write(self, df, run):
+        print(f"共 {len(df)} 筆資料，開始同步到 Supabase (Table: {TABLE_NAME})...")
+        self.summary = sync(
+            self.client, df, full=self.full, complete=run.complete,
+            allow_mass_delete=self.allow_mass_delete, manifest_path=self.manifest_path, workers=self.workers,
+        )
         print("所有資料已更新完成。")
-    else:
+        return {k: self.summary[k] for k in ("mode", "new", "changed", "removed", "failed_upserts", "failed_deletes")}
+
+
+def write_summary(summary, path=SUMMARY_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="下載公開資料並同步到 Supabase")
+    parser.add_argument("--full", action="store_true", help="忽略同步紀錄，全部重新 upsert")
+    parser.add_argument("--allow-mass-delete", action="store_true", help=f"允許一次刪除超過 {MAX_DELETE_RATIO:.0%} 的資料")
+    parser.add_argument("--workers", type=int, default=UPSERT_WORKERS, help="同時上傳的批次數")
+    parser.add_argument("--mirror-gcis", action="store_true", help="只更新經濟部商業司公司資料鏡像，不同步自建資料")
+    parser.add_argument("--mirror-budget", type=float, default=None, help="鏡像掃描最多執行幾秒，沒掃完下次從游標繼續")
+    parser.add_argument("--csv", help="同時匯出 CSV 到指定路徑")
+    parser.add_argument("--xlsx", help="同時匯出 Excel 到指定路徑 (需要 openpyxl)")
+    parser.add_argument("--parquet", help="同時匯出 Parquet 到指定路徑 (需要 pyarrow)")
+    parser.add_argument("--duplicate-report", help="重複資料清單的存檔路徑")
+    args = parser.parse_args(argv)
+
+    if args.mirror_gcis:
+        summary = run_mirror(GCIS_MIRROR_PATH, time_budget=args.mirror_budget)
+        summary["finished_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        write_summary(summary, GCIS_MIRROR_SUMMARY_PATH)
+        print("執行摘要: " + json.dumps(summary, ensure_ascii=False))
+        return summary
+
+    started = time.monotonic()
+    supabase_sink = SupabaseSink(
+        create_supabase(), full=args.full, allow_mass_delete=args.allow_mass_delete, workers=max(1, args.workers)
+    )
+    # 同步產生查詢快照、名稱索引與統編清單，API 查詢自建資料與名稱時就不必再打 Supabase，
+    # 自建資料的統編也不必先問經濟部商業司
+    sinks = [supabase_sink, SnapshotSink(SNAPSHOT_PATH, NAME_INDEX_PATH, KNOWN_IDS_PATH)]
+    if args.csv:
+        sinks.append(CsvSink(args.csv))
+    if args.xlsx:
+        sinks.append(XlsxSink(args.xlsx))
+    if args.parquet:
+        sinks.append(ParquetSink(args.parquet))
+
+    # 下載、解析、去重只做一次，結果同時交給所有輸出
+    result = run_pipeline(sinks, SOURCES, duplicate_report=args.duplicate_report)
+    if result.df is None:
         print("未獲取到任何資料。")
+        return None
+
+    summary = dict(supabase_sink.summary or {"durations": {}})
+    summary["durations"]["fetch"] = result.stages["fetch"]["seconds"]
+    summary["durations"]["snapshot"] = result.sinks["snapshot"]["seconds"]
+    summary["durations"] = {k: round(v, 3) for k, v in summary["durations"].items()}
+    summary["durations"]["total"] = round(time.monotonic() - started, 3)
+    summary["sources"] = {r.source_name: r.status for r in result.fetched}
+    summary["stages"] = result.stages
+    summary["sinks"] = result.sinks
+    summary["finished_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    write_summary(summary)
+    print("執行摘要: " + json.dumps(summary, ensure_ascii=False))
+    failed = [name for name, info in result.sinks.items() if info["status"] == "failed"]
+    if failed:
+        # 讓排程看得出失敗，摘要與其他輸出仍已寫入
+        raise SystemExit(f"輸出失敗: {', '.join(failed)}")
+    return summary
+
 
 if __name__ == "__main__":
     main()
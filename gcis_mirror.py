@@ -0,0 +1,146 @@
+"""
+經濟部商業司 (GCIS) 公司登記資料的離線鏡像。
+
+GCIS API 不支援以 Business_Accounting_NO 做 OR 查詢，批次查詢只能逐筆呼叫；
+這裡改為以 $skip/$top 分頁把整份公司資料掃一遍，寫成與 lookup_snapshot 相同格式的快照，
+API 查詢公司統編時先查鏡像，只有鏡像沒有或鏡像過期時才即時呼叫 GCIS。
+
+一次完整掃描的頁數很多，可以分多次執行：每抓完一頁就把資料附加到暫存檔並記錄游標，
+下次從游標繼續；掃完最後一頁才換掉鏡像檔，鏡像的產生時間記為該輪掃描的開始時間
+(資料最舊就是那個時間點)。
+"""
+import json
+import os
+import time
+
+import requests
+
+from lookup_snapshot import write_snapshot
+
+GCIS_API_URL = os.environ.get("GCIS_API_URL") or \
+    'https://data.gcis.nat.gov.tw/od/data/api/9D17AE0D-09B5-4732-A8F4-81ADED04B679'
+MIRROR_SOURCE = "經濟部商業司"
+# GCIS 單頁上限為 1000 筆
+PAGE_SIZE = 1000
+# 掃描進度 (游標與已抓到的資料) 的存放位置
+STATE_DIR = os.environ.get("GCIS_MIRROR_STATE_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".cache", "gcis_mirror"
+)
+# (連線, 讀取) timeout 秒數，以及每頁失敗時的重試次數
+TIMEOUT = (10, 60)
+RETRIES = 3
+
+
+def fetch_page(session, url, skip, top, timeout=TIMEOUT):
+    """抓取一頁，回傳 [(統編, 公司名稱)]；GCIS 沒有資料時回傳空白內容"""
+    params = {'$format': 'json', '$skip': skip, '$top': top}
+    resp = session.get(url, params=params, timeout=timeout)
+    resp.raise_for_status()
+    if not resp.content.strip():
+        return [], 0
+    items = resp.json()
+    rows = []
+    for item in items:
+        tax_id = str(item.get('Business_Accounting_NO') or '').strip()
+        name = item.get('Company_Name') or item.get('Business_Name')
+        if tax_id and name:
+            rows.append((tax_id, name.strip()))
+    # 回傳原始筆數，用來判斷是否已到最後一頁 (有些資料可能缺名稱而被略過)
+    return rows, len(items)
+
+
+def _state_paths(state_dir):
+    return os.path.join(state_dir, "state.json"), os.path.join(state_dir, "rows.tsv")
+
+
+def load_state(state_dir=STATE_DIR):
+    state_path, _ = _state_paths(state_dir)
+    try:
+        with open(state_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_state(state, state_dir):
+    state_path, _ = _state_paths(state_dir)
+    with open(state_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(state_path + ".tmp", state_path)
+
+
+def _staged_rows(rows_path):
+    with open(rows_path, encoding="utf-8") as f:
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            # 中斷時可能留下寫一半的行，略過即可 (該頁會重抓)
+            if len(parts) == 2:
+                yield parts[0], parts[1], MIRROR_SOURCE
+
+
+def run_mirror(mirror_path, url=GCIS_API_URL, state_dir=STATE_DIR, page_size=PAGE_SIZE,
+               time_budget=None, session=None, sleep=time.sleep):
+    """
+    從上次的游標繼續掃描，直到掃完或用完 time_budget 秒。
+    回傳執行摘要 dict，status 為 completed (已換上新的鏡像) / partial (下次繼續) / failed。
+    """
+    started = time.monotonic()
+    os.makedirs(state_dir, exist_ok=True)
+    _, rows_path = _state_paths(state_dir)
+    state = load_state(state_dir)
+    if not state or state.get("url") != url or not os.path.exists(rows_path):
+        state = {"url": url, "skip": 0, "sweep_started_at": int(time.time()), "rows": 0}
+        open(rows_path, "w").close()
+        _save_state(state, state_dir)
+
+    own_session = session is None
+    session = session or requests.Session()
+    pages = 0
+    status = "partial"
+    error = None
+    try:
+        while time_budget is None or time.monotonic() - started < time_budget:
+            for attempt in range(RETRIES):
+                try:
+                    rows, raw_count = fetch_page(session, url, state["skip"], page_size)
+                    break
+                except (requests.RequestException, ValueError) as e:
+                    error = str(e)
+                    print(f"  GCIS 第 {state['skip']} 筆起的分頁失敗 ({attempt + 1}/{RETRIES}): {e}")
+                    sleep(2 ** attempt)
+            else:
+                status = "failed"
+                break
+            error = None
+            if rows:
+                with open(rows_path, "a", encoding="utf-8") as f:
+                    f.write("".join(f"{t}\t{' '.join(n.split())}\n" for t, n in rows))
+            state["skip"] += raw_count
+            state["rows"] += len(rows)
+            _save_state(state, state_dir)
+            pages += 1
+            if raw_count < page_size:
+                status = "completed"
+                break
+    finally:
+        if own_session:
+            session.close()
+
+    summary = {
+        "status": status,
+        "pages": pages,
+        "cursor": state["skip"],
+        "sweep_started_at": state["sweep_started_at"],
+        "seconds": round(time.monotonic() - started, 3),
+        "error": error,
+    }
+    if status == "completed":
+        count = write_snapshot(mirror_path, _staged_rows(rows_path), created_at=state["sweep_started_at"])
+        summary["count"] = count
+        # 下一輪從頭開始
+        os.remove(rows_path)
+        os.remove(_state_paths(state_dir)[0])
+        print(f"已產生 GCIS 鏡像 {mirror_path} (共 {count} 筆)")
+    else:
+        print(f"GCIS 鏡像掃描未完成，已抓取 {state['skip']} 筆，下次從此處繼續")
+    return summary
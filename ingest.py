@@ -0,0 +1,384 @@
+"""
+公開資料來源的下載、解析與輸出，batch_update.py 與 DownloadMergeCSV.py 共用同一條流程：
+
+    來源 → 下載/解析 (fetch) → 正規化 (normalize) → 去重 (dedup，含重複清單) → 各種輸出 (sink)
+
+- 各來源併發下載。
+- 以上次回應的 ETag / Last-Modified 發送條件式請求，檔案沒變 (304) 時直接使用上次解析的結果。
+- 邊下載邊解析：先偵測編碼 (UTF-8 / CP950)，再以 chunk 方式只讀取統一編號與名稱欄位，
+  記憶體用量不會隨檔案大小成長。
+- 資料只下載、解析一次，同時交給所有 sink (Supabase、CSV、XLSX、Parquet、查詢快照)，
+  每個階段的筆數與每秒處理筆數都會印出並記錄在 PipelineResult.stages。
+"""
+import codecs
+import hashlib
+import io
+import json
+import os
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from known_ids import write_known_ids
+from lookup_snapshot import Snapshot, write_snapshot
+from name_index import write_name_index
+
+# 忽略不安全的 SSL 警告
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+SOURCES = [
+    ("https://eip.fia.gov.tw/data/BGMOPEN99X.csv", "全國各級學校"),
+    ("https://www.fia.gov.tw/download/9bc4de1485014443b518beb37d8f35fe", "行政院所屬機關"),
+    ("https://www.fia.gov.tw/download/2d35e0525c484964a84798baf39c72d2", "地方政府機關"),
+    ("https://eip.fia.gov.tw/data/BGMOPEN99.csv", "非營利事業")
+]
+
+ID_COLUMN = '統一編號'
+NAME_COLUMNS = ['單位名稱', '機關單位名稱', '機關名稱']
+
+# 條件式請求的狀態 (ETag / Last-Modified) 與上次解析結果的存放位置
+CACHE_DIR = os.environ.get("SOURCE_CACHE_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".cache", "sources"
+)
+# 偵測編碼時讀取的位元組數，以及每次解析的筆數
+SNIFF_BYTES = 64 * 1024
+CHUNK_ROWS = 20000
+# (連線, 讀取) timeout 秒數
+TIMEOUT = (10, 120)
+
+
+class IterStream(io.RawIOBase):
+    """把 bytes 的 iterator (例如 response.iter_content) 包成可讀的 binary stream"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            try:
+                self._pending = next(self._chunks)
+            except StopIteration:
+                return 0
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+class FetchResult:
+    def __init__(self, source_name, df, status, seconds, error=None):
+        self.source_name = source_name
+        self.df = df
+        # downloaded / unchanged / failed
+        self.status = status
+        self.seconds = seconds
+        self.error = error
+
+
+def detect_encoding(head):
+    """以檔案開頭判斷編碼；開頭可能剛好切在多位元組字元中間，所以用 incremental decoder"""
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        return 'cp950'
+
+
+def parse_csv_stream(stream, source_name, encoding=None):
+    """
+    從 binary stream 邊讀邊解析，回傳 tax_id / name / source 三欄的 DataFrame；
+    找不到統一編號或名稱欄位時回傳 None。
+    """
+    buffered = io.BufferedReader(stream, buffer_size=SNIFF_BYTES)
+    if encoding is None:
+        encoding = detect_encoding(buffered.peek(SNIFF_BYTES)[:SNIFF_BYTES])
+    text = io.TextIOWrapper(buffered, encoding=encoding, newline='')
+
+    wanted = {ID_COLUMN, *NAME_COLUMNS}
+    # 使用 dtype=str 強制保留 0，只讀需要的欄位
+    reader = pd.read_csv(text, dtype=str, usecols=lambda c: c.strip() in wanted, chunksize=CHUNK_ROWS)
+    pieces = []
+    for chunk in reader:
+        chunk.columns = [c.strip() for c in chunk.columns]
+        name_col = next((c for c in chunk.columns if c in NAME_COLUMNS), None)
+        if ID_COLUMN not in chunk.columns or not name_col:
+            return None
+        sub_df = chunk[[ID_COLUMN, name_col]].copy()
+        sub_df.columns = ['tax_id', 'name']
+        sub_df['tax_id'] = sub_df['tax_id'].str.strip()
+        sub_df['name'] = sub_df['name'].str.strip()
+        pieces.append(sub_df)
+    if not pieces:
+        return None
+    df = pd.concat(pieces, ignore_index=True)
+    df['source'] = source_name
+    return df
+
+
+def _cache_paths(url):
+    key = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, key + '.json'), os.path.join(CACHE_DIR, key + '.csv')
+
+
+def _load_cached(url):
+    state_path, data_path = _cache_paths(url)
+    try:
+        with open(state_path, encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None, None
+    if not os.path.exists(data_path):
+        return None, None
+    return state, data_path
+
+
+def _save_cached(url, response, df):
+    state_path, data_path = _cache_paths(url)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    df.to_csv(data_path + '.tmp', index=False, encoding='utf-8')
+    os.replace(data_path + '.tmp', data_path)
+    state = {
+        'url': url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'fetched_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+    with open(state_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+
+
+def fetch_source(session, url, source_name, use_cache=True):
+    """下載並解析單一來源，回傳 FetchResult；任何錯誤都不會拋出，而是回傳 status=failed"""
+    print(f"正在處理: {source_name}")
+    started = time.monotonic()
+    try:
+        headers = {}
+        state, data_path = _load_cached(url) if use_cache else (None, None)
+        if state:
+            if state.get('etag'):
+                headers['If-None-Match'] = state['etag']
+            if state.get('last_modified'):
+                headers['If-Modified-Since'] = state['last_modified']
+
+        encoding = None
+        for attempt in range(2):
+            with session.get(url, headers=headers, stream=True, verify=False, timeout=TIMEOUT) as response:
+                if response.status_code == 304 and data_path:
+                    df = pd.read_csv(data_path, dtype=str, keep_default_na=False)
+                    print(f"  -> {source_name} 未變更，使用上次的資料 ({len(df)} 筆)")
+                    return FetchResult(source_name, df, 'unchanged', time.monotonic() - started)
+                response.raise_for_status()
+                try:
+                    df = parse_csv_stream(IterStream(response.iter_content(SNIFF_BYTES)), source_name, encoding)
+                    break
+                except UnicodeDecodeError:
+                    # 開頭看起來像 UTF-8 但後面不是，改用 CP950 重新下載一次
+                    if attempt or encoding:
+                        raise
+                    encoding = 'cp950'
+
+        if df is None:
+            print(f"  -> {source_name} 找不到統一編號或名稱欄位")
+            return FetchResult(source_name, None, 'failed', time.monotonic() - started, "missing columns")
+        if use_cache:
+            _save_cached(url, response, df)
+        print(f"  -> {source_name} 下載完成 ({len(df)} 筆)")
+        return FetchResult(source_name, df, 'downloaded', time.monotonic() - started)
+    except Exception as e:
+        print(f"  -> 發生錯誤: {e}")
+        return FetchResult(source_name, None, 'failed', time.monotonic() - started, str(e))
+
+
+def fetch_all(sources=SOURCES, use_cache=True, max_workers=4):
+    """併發下載所有來源，回傳與 sources 相同順序的 FetchResult 清單"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=max_workers)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    with session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(fetch_source, session, url, name, use_cache) for url, name in sources]
+        return [f.result() for f in futures]
+
+
+# --- 共用流程：正規化、去重與輸出 ---
+# 匯出檔案使用的中文欄位名稱
+EXPORT_COLUMNS = {'tax_id': '統一編號', 'name': '單位名稱'}
+REPORT_COLUMNS = {'tax_id': '統一編號', 'name': '單位名稱', 'source': '來源'}
+
+
+def normalize_rows(df):
+    """統編全形轉半形並去除空白，名稱空值轉成空字串；沒有統編的資料直接丟掉"""
+    df = df.copy()
+    df['tax_id'] = df['tax_id'].map(
+        lambda v: "".join(unicodedata.normalize('NFKC', v).split()) if isinstance(v, str) else ""
+    )
+    df['name'] = df['name'].fillna("").astype(str).str.strip()
+    return df[df['tax_id'] != ""].reset_index(drop=True)
+
+
+def dedup_rows(df):
+    """以統編去重，保留第一筆；回傳 (去重後資料, 所有重複的資料 (依統編排序))"""
+    duplicated = df.duplicated(subset=['tax_id'], keep=False)
+    duplicates = df[duplicated].sort_values(by='tax_id', kind='stable')
+    unique = df.drop_duplicates(subset=['tax_id'], keep='first').reset_index(drop=True)
+    return unique, duplicates
+
+
+def report_duplicates(duplicates, path=None, preview=20):
+    """印出重複資料的前幾筆，有指定 path 時另存完整清單"""
+    if duplicates.empty:
+        print("\n太棒了，沒有發現重複資料。")
+        return
+    report = duplicates.rename(columns=REPORT_COLUMNS)[list(REPORT_COLUMNS.values())]
+    print(f"\n發現 {len(duplicates)} 筆重複資料 (相同統一編號)：")
+    print(report.head(preview).to_string(index=False))
+    if path:
+        report.to_csv(path, index=False, encoding='utf-8-sig')
+        print(f"... (完整重複清單已儲存為 {path})")
+
+
+class CsvSink:
+    """匯出 CSV (預設 UTF-8 BOM，Excel 直接開啟不會亂碼)"""
+
+    def __init__(self, path, columns=EXPORT_COLUMNS, encoding='utf-8-sig'):
+        self.name = f"csv:{os.path.basename(path)}"
+        self.path = path
+        self.columns = columns
+        self.encoding = encoding
+
+    def write(self, df, run):
+        df[list(self.columns)].rename(columns=self.columns).to_csv(self.path, index=False, encoding=self.encoding)
+        return {"path": self.path}
+
+
+class XlsxSink:
+    """匯出 Excel，需要 openpyxl"""
+
+    def __init__(self, path, columns=EXPORT_COLUMNS):
+        self.name = f"xlsx:{os.path.basename(path)}"
+        self.path = path
+        self.columns = columns
+
+    def write(self, df, run):
+        df[list(self.columns)].rename(columns=self.columns).to_excel(self.path, index=False)
+        return {"path": self.path}
+
+
+class ParquetSink:
+    """匯出欄式儲存的 Parquet (tax_id / name / source)，需要 pyarrow 或 fastparquet"""
+
+    def __init__(self, path):
+        self.name = f"parquet:{os.path.basename(path)}"
+        self.path = path
+
+    def write(self, df, run):
+        df[['tax_id', 'name', 'source']].to_parquet(self.path, index=False)
+        return {"path": self.path}
+
+
+class SnapshotSink:
+    """產生 API 用的唯讀查詢快照、名稱 n-gram 索引與自建資料的統編清單"""
+    name = "snapshot"
+
+    def __init__(self, snapshot_path, index_path=None, known_ids_path=None):
+        self.snapshot_path = snapshot_path
+        self.index_path = index_path
+        self.known_ids_path = known_ids_path
+
+    def write(self, df, run):
+        count = write_snapshot(self.snapshot_path, df[['tax_id', 'name', 'source']].itertuples(index=False))
+        print(f"已產生查詢快照 {self.snapshot_path} (共 {count} 筆)")
+        info = {"path": self.snapshot_path, "count": count}
+        if self.index_path:
+            snapshot = Snapshot(self.snapshot_path)
+            try:
+                info["grams"] = write_name_index(self.index_path, snapshot)
+            finally:
+                snapshot.close()
+            print(f"已產生名稱索引 {self.index_path} (共 {info['grams']} 個 n-gram)")
+        if self.known_ids_path:
+            info["known_ids"] = write_known_ids(self.known_ids_path, df['tax_id'])
+            print(f"已產生統編清單 {self.known_ids_path} (共 {info['known_ids']} 筆)")
+        return info
+
+
+class PipelineResult:
+    def __init__(self, fetched):
+        self.fetched = fetched
+        # 所有來源都下載成功，sink 可以據此決定要不要做刪除之類的動作
+        self.complete = all(r.df is not None for r in fetched)
+        self.df = None
+        self.duplicates = None
+        # {階段: {"rows": 筆數, "seconds": 秒數, "rows_per_sec": 每秒筆數}}
+        self.stages = {}
+        # {sink 名稱: {"status": ok / skipped / failed, "seconds": 秒數, ...}}
+        self.sinks = {}
+
+    def record(self, stage, rows, seconds):
+        rate = rows / seconds if seconds > 0 else None
+        self.stages[stage] = {
+            "rows": rows,
+            "seconds": round(seconds, 3),
+            "rows_per_sec": round(rate) if rate is not None else None,
+        }
+        print(f"[{stage}] {rows} 筆，{seconds:.2f} 秒" + (f"，每秒 {rate:,.0f} 筆" if rate else ""))
+
+
+def _run_sink(sink, df, run):
+    started = time.monotonic()
+    try:
+        info = sink.write(df, run) or {}
+        status = "ok"
+    except ImportError as e:
+        # 選用套件 (openpyxl / pyarrow) 沒有安裝時略過該輸出，不影響其他 sink
+        info = {"error": str(e)}
+        status = "skipped"
+    except Exception as e:
+        info = {"error": str(e)}
+        status = "failed"
+    seconds = time.monotonic() - started
+    if status != "ok":
+        print(f"  -> 輸出 {sink.name} {'略過' if status == 'skipped' else '失敗'}: {info['error']}")
+    return dict(info, status=status, seconds=round(seconds, 3))
+
+
+def run_pipeline(sinks, sources=SOURCES, use_cache=True, duplicate_report=None):
+    """
+    下載並解析所有來源，正規化、去重後同時交給所有 sink。
+    sink 為有 name 屬性與 write(df, result) 方法的物件，write 回傳的 dict 會記錄在 result.sinks；
+    單一 sink 失敗不影響其他 sink。沒有任何來源成功時 result.df 為 None，不會執行 sink。
+    """
+    started = time.monotonic()
+    fetched = fetch_all(sources, use_cache=use_cache)
+    result = PipelineResult(fetched)
+    frames = [r.df for r in fetched if r.df is not None]
+    result.record("fetch", sum(len(df) for df in frames), time.monotonic() - started)
+    if not frames:
+        return result
+
+    t0 = time.monotonic()
+    df = normalize_rows(pd.concat(frames, ignore_index=True))
+    result.record("normalize", len(df), time.monotonic() - t0)
+
+    t0 = time.monotonic()
+    result.df, result.duplicates = dedup_rows(df)
+    result.record("dedup", len(result.df), time.monotonic() - t0)
+    report_duplicates(result.duplicates, duplicate_report)
+
+    # 各 sink 互不相依，併發執行 (Supabase 上傳等網路的時間可以與寫檔重疊)
+    with ThreadPoolExecutor(max_workers=max(1, len(sinks))) as executor:
+        futures = [(sink, executor.submit(_run_sink, sink, result.df, result)) for sink in sinks]
+        for sink, future in futures:
+            result.sinks[sink.name] = info = future.result()
+            if info["status"] == "ok":
+                result.record(f"sink:{sink.name}", len(result.df), info["seconds"])
+    return result
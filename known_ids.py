@@ -0,0 +1,79 @@
+"""
+自建資料來源 (學校、機關、非營利事業) 的統編清單，用來決定哪些統編不必查經濟部商業司。
+
+這些單位不在經濟部商業司的公司資料中，打 GCIS 只會白等一次查無資料。
+batch_update.py 每次更新資料時與快照一起產生，跟著 function 一起部署；
+API 載入後以二分搜尋判斷統編是否在清單中，在清單中的統編直接查自建資料。
+
+每個統編以 uint32 儲存 (8 碼數字最大 99999999)，15 萬筆約 600 KB，
+比快照小得多，快照過期後仍可以用來分流 (單位的統編很少變動)。
+
+檔案格式 (little-endian)：
+    header : magic(8s) version(I) count(I) created_at(Q)
+    ids    : count 個 uint32，已排序且不重複
+"""
+import bisect
+import os
+import re
+import struct
+import time
+from array import array
+
+from name_index import _le
+
+MAGIC = b"UBNKNID1"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQ")
+
+_TAX_ID_RE = re.compile(r"^\d{8}$")
+
+
+def write_known_ids(path, tax_ids, created_at=None):
+    """將統編寫成清單檔，回傳實際寫入的筆數；不是 8 碼數字的統編會被略過"""
+    ids = sorted({int(t) for t in (str(t).strip() for t in tax_ids if t is not None) if _TAX_ID_RE.match(t)})
+    header = HEADER.pack(MAGIC, VERSION, len(ids), int(created_at if created_at is not None else time.time()))
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(_le(array("I", ids)).tobytes())
+    os.replace(tmp_path, path)
+    return len(ids)
+
+
+class KnownIds:
+    """整份讀進記憶體的統編清單，查詢為 O(log n)"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < HEADER.size:
+            raise ValueError(f"統編清單檔過短: {path}")
+        magic, version, count, created_at = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"無法辨識的統編清單格式: {path}")
+        if len(data) != HEADER.size + count * 4:
+            raise ValueError(f"統編清單檔不完整: {path}")
+        ids = array("I")
+        ids.frombytes(data[HEADER.size:])
+        self._ids = _le(ids)
+        self.created_at = created_at
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, tax_id):
+        if not _TAX_ID_RE.match(tax_id):
+            return False
+        value = int(tax_id)
+        i = bisect.bisect_left(self._ids, value)
+        return i < len(self._ids) and self._ids[i] == value
+
+    def age(self):
+        return time.time() - self.created_at
+
+    def close(self):
+        # 與 Snapshot 介面一致，資料已在記憶體中，不需要釋放
+        pass
@@ -0,0 +1,171 @@
+"""
+唯讀查詢快照 (lookup snapshot) 的二進位格式。
+
+batch_update.py 每週更新資料時順便產生，跟著 function 一起部署；
+api/index.py 以 mmap 開啟後直接二分搜尋，查詢自建資料 (學校、機關、非營利事業) 不必再打 Supabase。
+
+檔案格式 (little-endian)：
+    header  : magic(8s) version(I) count(I) created_at(Q) sources_len(I)
+    sources : 資料來源名稱清單，UTF-8 JSON 陣列，長度為 sources_len
+    ids     : count 個 8 bytes ASCII 統編，已排序
+    offsets : count + 1 個 uint32，為每筆名稱在 names 區段內的起點
+    source  : count 個 uint8，為資料來源在 sources 清單中的索引
+    names   : 所有名稱的 UTF-8 串接
+"""
+import json
+import mmap
+import os
+import re
+import struct
+import time
+
+MAGIC = b"UBNSNAP1"
+VERSION = 1
+ID_WIDTH = 8
+HEADER = struct.Struct("<8sIIQI")
+OFFSET = struct.Struct("<I")
+
+_TAX_ID_RE = re.compile(r"^\d{8}$")
+
+
+def write_snapshot(path, rows, created_at=None):
+    """
+    將 (統編, 名稱, 資料來源) 寫成快照檔，回傳實際寫入的筆數。
+    統編不是 8 碼數字的資料會被略過；同一統編重複時保留第一筆。
+    先寫到暫存檔再換名，避免讀取端讀到寫一半的檔案。
+    """
+    records = {}
+    for tax_id, name, source in rows:
+        tax_id = str(tax_id).strip() if tax_id is not None else ""
+        if not _TAX_ID_RE.match(tax_id) or tax_id in records:
+            continue
+        records[tax_id] = (_clean(name), _clean(source))
+
+    sources = []
+    source_index = {}
+    ids = bytearray()
+    offsets = bytearray()
+    source_col = bytearray()
+    names = bytearray()
+    for tax_id in sorted(records):
+        name, source = records[tax_id]
+        if source not in source_index:
+            if len(sources) >= 256:
+                raise ValueError("資料來源種類超過 256 種，無法寫入快照")
+            source_index[source] = len(sources)
+            sources.append(source)
+        ids += tax_id.encode("ascii")
+        offsets += OFFSET.pack(len(names))
+        source_col.append(source_index[source])
+        names += name.encode("utf-8")
+    offsets += OFFSET.pack(len(names))
+
+    sources_blob = json.dumps(sources, ensure_ascii=False).encode("utf-8")
+    header = HEADER.pack(
+        MAGIC, VERSION, len(records), int(created_at if created_at is not None else time.time()), len(sources_blob)
+    )
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        for part in (header, sources_blob, ids, offsets, source_col, names):
+            f.write(part)
+    os.replace(tmp_path, path)
+    return len(records)
+
+
+def _clean(value):
+    # pandas 的空值是 NaN (float)，統一轉成空字串
+    if value is None or isinstance(value, float):
+        return ""
+    return str(value).strip()
+
+
+class Snapshot:
+    """以 mmap 開啟的快照檔，查詢為 O(log n) 且不需要把整個檔案讀進記憶體"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._parse()
+        except Exception:
+            self._mm.close()
+            raise
+
+    def _parse(self):
+        mm = self._mm
+        if len(mm) < HEADER.size:
+            raise ValueError(f"快照檔過短: {self.path}")
+        magic, version, count, created_at, sources_len = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"無法辨識的快照格式: {self.path}")
+        self.count = count
+        self.created_at = created_at
+
+        pos = HEADER.size
+        self.sources = json.loads(mm[pos:pos + sources_len].decode("utf-8"))
+        pos += sources_len
+        self._ids_at = pos
+        pos += count * ID_WIDTH
+        self._offsets_at = pos
+        pos += (count + 1) * OFFSET.size
+        self._source_at = pos
+        pos += count
+        self._names_at = pos
+        if len(mm) < pos + OFFSET.unpack_from(mm, self._offsets_at + count * OFFSET.size)[0]:
+            raise ValueError(f"快照檔不完整: {self.path}")
+
+    def __len__(self):
+        return self.count
+
+    def age(self):
+        return time.time() - self.created_at
+
+    def tax_id_at(self, index):
+        start = self._ids_at + index * ID_WIDTH
+        return self._mm[start:start + ID_WIDTH].decode("ascii")
+
+    def find(self, tax_id):
+        """二分搜尋統編，找到回傳列索引，找不到回傳 -1"""
+        key = tax_id.encode("ascii", "replace")
+        if len(key) != ID_WIDTH:
+            return -1
+        mm = self._mm
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self._ids_at + mid * ID_WIDTH
+            if mm[start:start + ID_WIDTH] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        start = self._ids_at + lo * ID_WIDTH
+        if lo < self.count and mm[start:start + ID_WIDTH] == key:
+            return lo
+        return -1
+
+    def name_at(self, index):
+        start, end = struct.unpack_from("<II", self._mm, self._offsets_at + index * OFFSET.size)
+        return self._mm[self._names_at + start:self._names_at + end].decode("utf-8")
+
+    def source_at(self, index):
+        return self.sources[self._mm[self._source_at + index]]
+
+    def row(self, index):
+        return self.tax_id_at(index), self.name_at(index), self.source_at(index)
+
+    def get(self, tax_id):
+        """回傳 (名稱, 資料來源)，找不到回傳 None"""
+        index = self.find(tax_id)
+        if index < 0:
+            return None
+        return self.name_at(index), self.source_at(index)
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self.row(index)
+
+    def close(self):
+        self._mm.close()
@@ -0,0 +1,246 @@
+"""
+單位名稱的 n-gram 反向索引，提供中文名稱的子字串搜尋。
+
+名稱先經過 normalize_name 正規化 (全形轉半形、臺轉台、忽略大小寫與空白)，
+再切成 2-gram 與 3-gram，每個 gram 對應到快照 (lookup_snapshot) 的列索引。
+查詢時取各 gram 的 posting list 求交集，再以正規化後的名稱驗證子字串並排序：
+完全相同 > 開頭相同 > 包含，同一級中名稱越短越前面。
+
+索引檔由 batch_update.py 在產生快照後建立，header 記錄對應快照的產生時間與筆數，
+兩者不一致時 API 不使用索引。
+
+另有自動完成用的 PrefixIndex：在記憶體中依正規化名稱排序，前綴查詢以二分搜尋取得範圍。
+
+檔案格式 (little-endian)：
+    header          : magic(8s) version(I) snapshot_created_at(Q) snapshot_count(I) gram_count(I) grams_len(I)
+    gram_offsets    : gram_count + 1 個 uint32，gram 在 grams 區段內的起點 (gram 依 UTF-8 bytes 排序)
+    posting_offsets : gram_count + 1 個 uint32，gram 的 posting list 在 postings 區段內的起點 (以筆計)
+    grams           : 所有 gram 的 UTF-8 串接
+    postings        : uint32 列索引，每個 gram 內遞增排序
+"""
+import bisect
+import heapq
+import mmap
+import os
+import struct
+import sys
+import unicodedata
+from array import array
+
+MAGIC = b"UBNNGRM1"
+VERSION = 1
+HEADER = struct.Struct("<8sIQIII")
+GRAM_SIZES = (2, 3)
+
+# 自動完成結果同長度時的資料來源順序 (與 ingest.SOURCES 相同)，未列出的來源排在最後
+SOURCE_ORDER = ("全國各級學校", "行政院所屬機關", "地方政府機關", "非營利事業")
+# 前綴範圍上界：接在前綴後面、比任何字元都大的字元
+_PREFIX_END = "\U0010ffff"
+
+# 異體字對照，查詢與建索引時都會套用
+_VARIANTS = str.maketrans({"臺": "台"})
+
+
+def normalize_name(text):
+    """正規化名稱：全形轉半形 (NFKC)、臺轉台、轉小寫並去除所有空白"""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text).translate(_VARIANTS).lower()
+    return "".join(text.split())
+
+
+def name_grams(normalized, size):
+    return {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+
+
+def rank_key(normalized_query, normalized_name, tax_id):
+    """排序鍵：完全相同 (0) > 開頭相同 (1) > 包含 (2)，再依名稱長度與統編"""
+    if normalized_name == normalized_query:
+        match = 0
+    elif normalized_name.startswith(normalized_query):
+        match = 1
+    else:
+        match = 2
+    return match, len(normalized_name), tax_id
+
+
+def write_name_index(path, snapshot):
+    """從已開啟的 Snapshot 建立索引檔，回傳 gram 數量"""
+    postings = {}
+    for index, (_, name, _) in enumerate(snapshot):
+        normalized = normalize_name(name)
+        grams = set()
+        for size in GRAM_SIZES:
+            grams |= name_grams(normalized, size)
+        for gram in grams:
+            postings.setdefault(gram, []).append(index)
+
+    encoded = sorted((gram.encode("utf-8"), rows) for gram, rows in postings.items())
+    gram_offsets = array("I", [0])
+    posting_offsets = array("I", [0])
+    grams_blob = bytearray()
+    posting_blob = array("I")
+    for gram, rows in encoded:
+        grams_blob += gram
+        gram_offsets.append(len(grams_blob))
+        posting_blob.extend(rows)
+        posting_offsets.append(len(posting_blob))
+
+    header = HEADER.pack(MAGIC, VERSION, snapshot.created_at, len(snapshot), len(encoded), len(grams_blob))
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        for arr in (gram_offsets, posting_offsets):
+            f.write(_le(arr).tobytes())
+        f.write(grams_blob)
+        f.write(_le(posting_blob).tobytes())
+    os.replace(tmp_path, path)
+    return len(encoded)
+
+
+def _le(arr):
+    # 檔案一律使用 little-endian
+    if sys.byteorder != "little":
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr
+
+
+class NameIndex:
+    """以 mmap 開啟的名稱索引，搭配對應的 Snapshot 使用"""
+
+    def __init__(self, path, snapshot):
+        self.path = path
+        self.snapshot = snapshot
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._parse()
+        except Exception:
+            self._mm.close()
+            raise
+
+    def _parse(self):
+        mm = self._mm
+        if len(mm) < HEADER.size:
+            raise ValueError(f"索引檔過短: {self.path}")
+        magic, version, snapshot_created_at, snapshot_count, gram_count, grams_len = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"無法辨識的索引格式: {self.path}")
+        if (snapshot_created_at, snapshot_count) != (self.snapshot.created_at, len(self.snapshot)):
+            raise ValueError(f"索引與快照版本不一致: {self.path}")
+        self.gram_count = gram_count
+        pos = HEADER.size
+        self._gram_offsets = self._u32_array(pos, gram_count + 1)
+        pos += (gram_count + 1) * 4
+        self._posting_offsets = self._u32_array(pos, gram_count + 1)
+        pos += (gram_count + 1) * 4
+        self._grams_at = pos
+        self._postings_at = pos + grams_len
+        if len(mm) < self._postings_at + self._posting_offsets[-1] * 4:
+            raise ValueError(f"索引檔不完整: {self.path}")
+
+    def _u32_array(self, start, count):
+        arr = array("I")
+        arr.frombytes(self._mm[start:start + count * 4])
+        return _le(arr)
+
+    def _gram_at(self, i):
+        start = self._grams_at + self._gram_offsets[i]
+        return self._mm[start:self._grams_at + self._gram_offsets[i + 1]]
+
+    def postings(self, gram):
+        """二分搜尋 gram，回傳其列索引陣列 (找不到為空陣列)"""
+        key = gram.encode("utf-8")
+        lo, hi = 0, self.gram_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._gram_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.gram_count and self._gram_at(lo) == key:
+            return self._u32_array(
+                self._postings_at + self._posting_offsets[lo] * 4,
+                self._posting_offsets[lo + 1] - self._posting_offsets[lo],
+            )
+        return array("I")
+
+    def candidates(self, normalized_query):
+        """
+        回傳可能包含查詢字串的列索引集合；查詢短於 2 個字時無法使用索引，回傳 None。
+        """
+        if len(normalized_query) < min(GRAM_SIZES):
+            return None
+        size = max(s for s in GRAM_SIZES if s <= len(normalized_query))
+        lists = sorted((self.postings(g) for g in name_grams(normalized_query, size)), key=len)
+        result = set(lists[0])
+        for rows in lists[1:]:
+            if not result:
+                break
+            result.intersection_update(rows)
+        return result
+
+    def search(self, query, limit=50):
+        """
+        搜尋名稱包含 query 的資料，回傳依相關度排序的 [(統編, 名稱, 資料來源)]；
+        查詢太短無法使用索引時回傳 None，由呼叫端改用其他方式查詢。
+        """
+        normalized_query = normalize_name(query)
+        rows = self.candidates(normalized_query)
+        if rows is None:
+            return None
+        matches = []
+        for index in rows:
+            tax_id, name, source = self.snapshot.row(index)
+            normalized = normalize_name(name)
+            # n-gram 交集只是候選，順序不對的仍要排除
+            if normalized_query in normalized:
+                matches.append((rank_key(normalized_query, normalized, tax_id), (tax_id, name, source)))
+        return [row for _, row in heapq.nsmallest(limit, matches, key=lambda m: m[0])]
+
+    def close(self):
+        self._mm.close()
+
+
+class PrefixIndex:
+    """
+    自動完成用的名稱前綴索引，從已開啟的 Snapshot 在記憶體中建立。
+    正規化名稱排序後以二分搜尋取得前綴範圍，範圍內依 (名稱長度, 資料來源順序, 統編) 取前 k 筆。
+    排序鍵預先編成一個整數 (長度 << 40 | 來源順序 << 32 | 列索引；快照依統編排序，列索引即統編順序)，
+    取前 k 筆時只需比較整數。
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        # 每個來源一個代碼 (快照最多 256 種來源)，代碼越小排越前面
+        ordered = sorted(snapshot.sources, key=lambda s: (
+            SOURCE_ORDER.index(s) if s in SOURCE_ORDER else len(SOURCE_ORDER), s
+        ))
+        self._source_codes = {source: code for code, source in enumerate(ordered)}
+        entries = []
+        for index, (_, name, source) in enumerate(snapshot):
+            normalized = normalize_name(name)
+            entries.append((normalized, len(normalized) << 40 | self._source_codes[source] << 32 | index))
+        entries.sort()
+        self.keys = [key for key, _ in entries]
+        self.ranks = array("Q", (order for _, order in entries))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def complete(self, prefix, limit=10, source=None):
+        """回傳正規化名稱以 prefix 開頭的 [(統編, 名稱, 資料來源)]，依名稱長度與資料來源排序"""
+        normalized = normalize_name(prefix)
+        if not normalized:
+            return []
+        lo = bisect.bisect_left(self.keys, normalized)
+        hi = bisect.bisect_left(self.keys, normalized + _PREFIX_END, lo)
+        ranks = self.ranks[lo:hi]
+        if source is not None:
+            if source not in self._source_codes:
+                return []
+            code = self._source_codes[source]
+            ranks = (r for r in ranks if (r >> 32) & 0xFF == code)
+        return [self.snapshot.row(order & 0xFFFFFFFF) for order in heapq.nsmallest(limit, ranks)]
@@ -0,0 +1,97 @@
+"""
+直接以 HTTP 呼叫 Supabase PostgREST 的精簡 client，只實作 API 讀取 unified_numbers 用到的部分：
+
+    client.table("unified_numbers").select("*").in_("tax_id", ids).limit(50).execute().data
+
+介面與 supabase SDK 相同，但不載入 SDK (以及它的 realtime / storage / auth 相依套件)，
+並與政府 API 共用同一個 keep-alive requests.Session，縮短 Vercel 冷啟動的時間與記憶體用量。
+寫入 (upsert / delete) 仍由 batch_update.py 使用完整的 SDK。
+"""
+
+
+class APIError(Exception):
+    """PostgREST 回傳非 2xx 狀態碼"""
+
+    def __init__(self, status, message):
+        super().__init__(f"PostgREST {status}: {message}")
+        self.status = status
+
+
+class Response:
+    def __init__(self, data):
+        self.data = data
+
+
+def _quote(value):
+    # in 篩選的值以雙引號包起來，值裡面的逗號與括號才不會被當成語法
+    value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{value}"'
+
+
+class Query:
+    """一次查詢的條件，呼叫 execute 時才送出"""
+
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.params = [("select", "*")]
+
+    def select(self, columns="*"):
+        self.params[0] = ("select", columns)
+        return self
+
+    def _filter(self, column, op, value):
+        self.params.append((column, f"{op}.{value}"))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, "eq", value)
+
+    def gt(self, column, value):
+        return self._filter(column, "gt", value)
+
+    def ilike(self, column, pattern):
+        return self._filter(column, "ilike", pattern)
+
+    def in_(self, column, values):
+        return self._filter(column, "in", "(" + ",".join(_quote(v) for v in values) + ")")
+
+    def order(self, column, desc=False):
+        self.params.append(("order", f"{column}.{'desc' if desc else 'asc'}"))
+        return self
+
+    def limit(self, count):
+        self.params.append(("limit", str(int(count))))
+        return self
+
+    def request(self):
+        """回傳 (url, params, headers, timeout)，給其他 HTTP client (例如 async) 自行送出"""
+        client = self.client
+        return client.rest_url + self.table, list(self.params), client.headers, client.timeout
+
+    def execute(self):
+        url, params, headers, timeout = self.request()
+        resp = self.client.session().get(url, params=params, headers=headers, timeout=timeout)
+        check_status(resp.status_code, resp.text)
+        return Response(resp.json())
+
+
+def check_status(status, text):
+    if not 200 <= status < 300:
+        raise APIError(status, text[:200])
+
+
+class PostgrestClient:
+    """
+    url 與 key 同 supabase.create_client；session 為回傳 requests.Session 的函式，
+    每次查詢時才取得，連線池重建後會自動使用新的 session。
+    """
+
+    def __init__(self, url, key, session, timeout=3):
+        self.rest_url = url.rstrip("/") + "/rest/v1/"
+        self.headers = {"apikey": key, "Authorization": f"Bearer {key}", "Accept": "application/json"}
+        self.session = session
+        self.timeout = timeout
+
+    def table(self, name):
+        return Query(self, name)
@@ -0,0 +1,121 @@
+import importlib.util
+import json
+import os
+import sys
+import threading
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def api(monkeypatch, tmp_path):
+    """每個測試載入一份全新的 api/index.py，避免模組層級狀態互相影響"""
+    monkeypatch.setenv("SUPABASE_URL", "http://supabase.invalid")
+    monkeypatch.setenv("SUPABASE_KEY", "test-key")
+    # 預設不使用 repo 內的快照，需要的測試自行產生
+    monkeypatch.setenv("SNAPSHOT_PATH", str(tmp_path / "missing.snap"))
+    monkeypatch.setenv("NAME_INDEX_PATH", str(tmp_path / "missing.bin"))
+    monkeypatch.setenv("GCIS_MIRROR_PATH", str(tmp_path / "missing_mirror.snap"))
+    monkeypatch.setenv("KNOWN_IDS_PATH", str(tmp_path / "missing_known_ids.bin"))
+    spec = importlib.util.spec_from_file_location("api_index", os.path.join(ROOT, "api", "index.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeQuery:
+    def __init__(self, rows, calls):
+        self.rows = rows
+        self.calls = calls
+        self.filters = []
+
+    def select(self, *args):
+        return self
+
+    def in_(self, column, values):
+        self.calls.append(("in_", column, list(values)))
+        self.filters.append(lambda r: r[column] in values)
+        return self
+
+    def eq(self, column, value):
+        self.calls.append(("eq", column, value))
+        self.filters.append(lambda r: r[column] == value)
+        return self
+
+    def ilike(self, column, pattern):
+        self.calls.append(("ilike", column, pattern))
+        needle = pattern.strip("%")
+        self.filters.append(lambda r: needle in r[column])
+        return self
+
+    def limit(self, n):
+        return self
+
+    def execute(self):
+        rows = [r for r in self.rows if all(f(r) for f in self.filters)]
+        return type("Response", (), {"data": rows})()
+
+
+class FakeSupabase:
+    """只實作 handler 用到的 postgrest 查詢方法"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+
+    def table(self, name):
+        return FakeQuery(self.rows, self.calls)
+
+
+@pytest.fixture
+def fake_db(api, monkeypatch):
+    db = FakeSupabase([
+        {"tax_id": "03730043", "name": "國立臺灣大學", "source": "全國各級學校"},
+        {"tax_id": "04199019", "name": "臺北市政府", "source": "地方政府機關"},
+    ])
+    monkeypatch.setattr(api, "PostgrestClient", lambda *args, **kwargs: db)
+    return db
+
+
+SNAPSHOT_ROWS = [
+    ("03730043", "國立臺灣大學", "全國各級學校"),
+    ("04199019", "臺北市政府", "地方政府機關"),
+    ("77777777", "財團法人測試基金會", "非營利事業"),
+]
+
+
+@pytest.fixture
+def snapshot_file(api, monkeypatch, tmp_path):
+    from lookup_snapshot import write_snapshot
+
+    path = str(tmp_path / "lookup.snap")
+    write_snapshot(path, SNAPSHOT_ROWS)
+    monkeypatch.setattr(api, "SNAPSHOT_PATH", path)
+    return path
+
+
+@pytest.fixture
+def server(api):
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), api.handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:%d" % httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def post_json(base, path, payload):
+    req = urllib.request.Request(
+        base + path,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(req) as resp:
+        return json.loads(resp.read().decode("utf-8"))
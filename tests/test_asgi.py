@@ -0,0 +1,164 @@
+import asyncio
+import importlib
+import json
+import sys
+import time
+
+import pytest
+
+from tools.stub_servers import GcisStub, PostgrestStub
+
+COMPANY = "22099131"
+SCHOOL = "04199019"
+
+
+@pytest.fixture
+def stubs():
+    gcis = GcisStub({COMPANY: "台灣積體電路製造股份有限公司"}).start()
+    db = PostgrestStub({"unified_numbers": [
+        {"tax_id": SCHOOL, "name": "臺北市政府", "source": "地方政府機關"},
+        {"tax_id": COMPANY, "name": "台積電 (舊資料)", "source": "非營利事業"},
+    ]}).start()
+    yield gcis, db
+    gcis.stop()
+    db.stop()
+
+
+@pytest.fixture
+def asgi(stubs, monkeypatch, tmp_path):
+    """指向替身伺服器並重新載入 api/asgi.py (連同它使用的 index 模組)"""
+    gcis, db = stubs
+    monkeypatch.setenv("GCIS_API_URL", gcis.url)
+    monkeypatch.setenv("GCIS_NAME_API_URL", gcis.url)
+    monkeypatch.setenv("SUPABASE_URL", db.url)
+    monkeypatch.setenv("SUPABASE_KEY", "test-key")
+    monkeypatch.setenv("SNAPSHOT_PATH", str(tmp_path / "missing.snap"))
+    monkeypatch.setenv("NAME_INDEX_PATH", str(tmp_path / "missing.bin"))
+    monkeypatch.setenv("GCIS_MIRROR_PATH", str(tmp_path / "missing_mirror.snap"))
+    monkeypatch.setenv("KNOWN_IDS_PATH", str(tmp_path / "missing_known_ids.bin"))
+    monkeypatch.setenv("REQUEST_LOG", "0")
+    monkeypatch.setenv("GOVT_DEADLINE", "2")
+    for name in ("index", "api.asgi"):
+        sys.modules.pop(name, None)
+    module = importlib.import_module("api.asgi")
+    yield module
+    sys.modules.pop("index", None)
+
+
+async def call(app, method, path, query="", body=b"", headers=()):
+    """送出一個 ASGI 請求，回傳 (status, headers, body)"""
+    messages = []
+    received = False
+
+    async def receive():
+        nonlocal received
+        if received:
+            return {"type": "http.disconnect"}
+        received = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http", "method": method, "path": path, "query_string": query.encode(),
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers],
+    }
+    await app(scope, receive, send)
+    start = messages[0]
+    return start["status"], {k.decode(): v.decode() for k, v in start["headers"]}, messages[1]["body"]
+
+
+def run(asgi, *requests):
+    """在同一個 event loop 上同時送出多個請求，回傳 (結果 list, 總秒數)"""
+    async def main():
+        try:
+            return await asyncio.gather(*(call(asgi.app, *r) for r in requests))
+        finally:
+            await asgi.close_async_client()
+
+    started = time.monotonic()
+    results = asyncio.run(main())
+    return results, time.monotonic() - started
+
+
+def test_govt_miss_waits_for_slower_call_not_both(asgi, stubs):
+    gcis, db = stubs
+    gcis.latency = db.latency = 0.4
+    [(status, headers, body)], elapsed = run(asgi, ("GET", "/async/", "id=" + SCHOOL))
+    assert status == 200
+    assert json.loads(body)["data"][0]["資料來源"] == "地方政府機關"
+    # 兩個上游同時查詢，只需等較慢的一個 (依序查詢需要 0.8 秒)
+    assert elapsed < 0.75
+    assert "govt" in headers["server-timing"] and "db" in headers["server-timing"]
+
+
+def test_govt_hit_cancels_db_query(asgi, stubs):
+    gcis, db = stubs
+    gcis.latency, db.latency = 0.05, 1.5
+    [(status, _, body)], elapsed = run(asgi, ("GET", "/async/", "id=" + COMPANY))
+    item = json.loads(body)["data"][0]
+    # 政府 API 有資料時以它為準，不等 Supabase
+    assert item["資料來源"] == "經濟部商業司"
+    assert elapsed < 1.0
+    assert asgi.core.lookup_cache.get((False, COMPANY)) == item
+
+
+def test_concurrent_requests_share_one_loop(asgi, stubs):
+    gcis, db = stubs
+    gcis.latency = db.latency = 0.3
+    requests = [("GET", "/async/", "id=" + SCHOOL)] * 8 + [
+        ("POST", "/async/api", "", json.dumps({"ids": [COMPANY, SCHOOL, "12a"]}).encode()),
+    ]
+    results, elapsed = run(asgi, *requests)
+    assert all(status == 200 for status, _, _ in results)
+    # 同一個統編的 GET 共用一次上游查詢
+    assert gcis.requests <= 2
+    assert elapsed < 1.2
+    data = json.loads(results[-1][2])["data"]
+    assert [d["資料來源"] for d in data] == ["經濟部商業司", "地方政府機關", "統一編號格式錯誤"]
+
+
+def test_deadline_cancels_govt_without_tripping_breaker(asgi, stubs, monkeypatch):
+    gcis, db = stubs
+    gcis.latency = 1.5
+    monkeypatch.setattr(asgi.core, "GOVT_DEADLINE", 0.3)
+    [(status, headers, body)], elapsed = run(asgi, ("GET", "/async/", "id=" + SCHOOL))
+    assert status == 200
+    assert json.loads(body)["data"][0]["資料來源"] == "地方政府機關"
+    assert elapsed < 1.0
+    # 被我們取消的呼叫不算政府 API 的失敗，結果也不寫入快取
+    assert asgi.core.govt_client.failures == 0
+    assert asgi.core.govt_client.breaker.state == asgi.core.CircuitBreaker.CLOSED
+    assert asgi.core.lookup_cache.get((False, SCHOOL)) is None
+    assert headers["cache-control"].startswith("public")
+
+
+def test_landing_page_and_stats(asgi):
+    (page, stats), _ = run(
+        asgi, ("GET", "/async", "", b"", [("Accept-Encoding", "gzip")]), ("GET", "/async/api/stats"),
+    )
+    assert page[0] == 200 and page[1]["content-encoding"] == "gzip"
+    assert "cache" in json.loads(stats[2])
+
+
+def test_known_ids_skip_govt(asgi, stubs, tmp_path, monkeypatch):
+    from known_ids import write_known_ids
+
+    gcis, db = stubs
+    path = str(tmp_path / "known_ids.bin")
+    write_known_ids(path, [SCHOOL])
+    monkeypatch.setattr(asgi.core, "KNOWN_IDS_PATH", path)
+    [(status, _, body)], _ = run(asgi, ("GET", "/async/", "id=" + SCHOOL))
+    assert json.loads(body)["govt_calls_avoided"] == 1
+    assert gcis.requests == 0 and db.requests == 1
+
+
+def test_name_search_merges_govt_and_db(asgi, stubs):
+    gcis, db = stubs
+    [(status, _, body)], _ = run(asgi, ("GET", "/async/", "name=%E5%8F%B0&limit=5"))
+    result = json.loads(body)
+    # 兩邊都有的統編只出現一次，以經濟部商業司為準
+    assert status == 200 and result["next_cursor"] is None and result["govt_skipped"] is False
+    assert [(d["統一編號"], d["資料來源"]) for d in result["data"]] == [(COMPANY, "經濟部商業司")]
+    assert gcis.requests == 1 and db.requests == 1
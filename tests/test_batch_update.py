@@ -0,0 +1,241 @@
+import json
+
+import pandas as pd
+import pytest
+
+import batch_update
+
+
+class FakeTable:
+    def __init__(self, db, fail_upsert=False):
+        self.db = db
+        self.fail_upsert = fail_upsert
+        self.op = None
+
+    def upsert(self, rows, on_conflict=None):
+        self.op = ("upsert", rows)
+        return self
+
+    def delete(self):
+        self.op = ("delete", None)
+        return self
+
+    def in_(self, column, values):
+        self.op = (self.op[0], values)
+        return self
+
+    def select(self, *args):
+        self.op = ("select", None)
+        return self
+
+    def order(self, column):
+        return self
+
+    def range(self, start, end):
+        self.op = ("select", (start, end))
+        return self
+
+    def execute(self):
+        kind, arg = self.op
+        self.db.calls.append((kind, len(arg) if isinstance(arg, list) else arg))
+        if kind == "upsert":
+            if self.fail_upsert:
+                raise RuntimeError("boom")
+            for row in arg:
+                self.db.rows[row["tax_id"]] = row
+            return self
+        if kind == "delete":
+            for tax_id in arg:
+                self.db.rows.pop(tax_id, None)
+            return self
+        start, end = arg
+        ids = sorted(self.db.rows)[start:end + 1]
+        return type("Response", (), {"data": [{"tax_id": t} for t in ids]})()
+
+
+class FakeClient:
+    def __init__(self, rows=None):
+        self.rows = dict(rows or {})
+        self.calls = []
+        self.fail_upsert = False
+
+    def table(self, name):
+        return FakeTable(self, self.fail_upsert)
+
+
+def frame(rows):
+    return pd.DataFrame(rows, columns=["tax_id", "name", "source"])
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    return str(tmp_path / "manifest.json")
+
+
+@pytest.fixture(autouse=True)
+def upload_settings(tmp_path, monkeypatch):
+    # 檢查點寫到暫存目錄，重試不等待
+    monkeypatch.setattr(batch_update, "CHECKPOINT_PATH", str(tmp_path / "checkpoint.json"))
+    monkeypatch.setattr(batch_update, "UPSERT_BACKOFF", 0)
+
+
+def test_first_run_upserts_everything_and_removes_stale_rows(manifest):
+    client = FakeClient({"99999999": {"tax_id": "99999999"}})
+    df = frame([("00000001", "甲", "A"), ("00000002", "乙", "A"), ("00000003", "丙", "B"), ("00000004", "丁", "B"), ("00000005", "戊", "B")])
+
+    summary = batch_update.sync(client, df, manifest_path=manifest)
+
+    assert summary["mode"] == "full"
+    assert summary["new"] == 5 and summary["removed"] == 1
+    assert sorted(client.rows) == ["00000001", "00000002", "00000003", "00000004", "00000005"]
+
+
+def test_delta_only_touches_changed_rows(manifest):
+    client = FakeClient()
+    rows = [("%08d" % i, "名稱%d" % i, "A") for i in range(20)]
+    batch_update.sync(client, frame(rows), manifest_path=manifest)
+    client.calls.clear()
+
+    rows[3] = (rows[3][0], "改名", "A")
+    del rows[5]
+    rows.append(("00000099", "新的", "B"))
+    summary = batch_update.sync(client, frame(rows), manifest_path=manifest)
+
+    assert summary["mode"] == "delta"
+    assert (summary["new"], summary["changed"], summary["removed"], summary["unchanged"]) == (1, 1, 1, 18)
+    assert client.calls == [("upsert", 2), ("delete", 1)]
+    assert client.rows["00000003"]["name"] == "改名"
+    assert "00000005" not in client.rows
+
+
+def test_incomplete_sources_skip_deletes(manifest):
+    client = FakeClient()
+    rows = [("%08d" % i, "x", "A") for i in range(10)]
+    batch_update.sync(client, frame(rows), manifest_path=manifest)
+
+    summary = batch_update.sync(client, frame(rows[:9]), complete=False, manifest_path=manifest)
+
+    assert summary["skipped_delete"]
+    assert "00000009" in client.rows
+    # 沒刪掉的仍留在紀錄中，下次來源完整時會再刪除
+    summary = batch_update.sync(client, frame(rows[:9]), manifest_path=manifest)
+    assert summary["removed"] == 1
+
+
+def test_mass_delete_is_refused(manifest):
+    client = FakeClient()
+    rows = [("%08d" % i, "x", "A") for i in range(10)]
+    batch_update.sync(client, frame(rows), manifest_path=manifest)
+
+    summary = batch_update.sync(client, frame(rows[:5]), manifest_path=manifest)
+
+    assert summary["skipped_delete"] and len(client.rows) == 10
+
+
+def test_failed_upserts_are_retried_next_run(manifest):
+    client = FakeClient()
+    rows = [("00000001", "甲", "A")]
+    client.fail_upsert = True
+    summary = batch_update.sync(client, frame(rows), manifest_path=manifest)
+    assert summary["failed_upserts"] == 1
+
+    with open(manifest) as f:
+        assert json.load(f)["rows"] == {}
+
+    client.fail_upsert = False
+    summary = batch_update.sync(client, frame(rows), manifest_path=manifest)
+    assert summary["new"] == 1 and "00000001" in client.rows
+
+
+def test_supabase_sink_uses_pipeline_completeness(manifest):
+    client = FakeClient({"00000099": {"tax_id": "00000099"}})
+    sink = batch_update.SupabaseSink(client, manifest_path=manifest)
+    df = frame([("03730043", "國立臺灣大學", "全國各級學校")])
+
+    info = sink.write(df, type("Run", (), {"complete": False})())
+
+    assert info["new"] == 1
+    # 有來源失敗時不刪除
+    assert "00000099" in client.rows
+    assert sink.summary["removed"] == 0
+
+
+class FlakyClient(FakeClient):
+    """前幾次 upsert 失敗；crash_on 指定的那一次則模擬整個程式中斷"""
+
+    def __init__(self, failures=0, crash_on=None):
+        super().__init__()
+        self.failures = failures
+        self.crash_on = crash_on
+        self.upserts = 0
+
+    def table(self, name):
+        client = self
+        table = FakeTable(self)
+        execute = table.execute
+
+        def flaky_execute():
+            if table.op[0] == "upsert":
+                client.upserts += 1
+                if client.upserts == client.crash_on:
+                    raise KeyboardInterrupt
+                if client.upserts <= client.failures:
+                    raise RuntimeError("503")
+            return execute()
+
+        table.execute = flaky_execute
+        return table
+
+
+def test_failed_batches_are_retried_with_backoff(manifest):
+    client = FlakyClient(failures=2)
+    summary = batch_update.sync(client, frame([("00000001", "甲", "A")]), manifest_path=manifest)
+
+    assert summary["failed_upserts"] == 0
+    assert client.upserts == 3 and "00000001" in client.rows
+
+
+def test_interrupted_upload_resumes_from_checkpoint(manifest, tmp_path):
+    rows = [("%08d" % i, "名稱%d" % i, "A") for i in range(2500)]
+    client = FlakyClient(crash_on=2)
+    with pytest.raises(KeyboardInterrupt):
+        batch_update.sync(client, frame(rows), manifest_path=manifest, workers=1)
+    with open(tmp_path / "checkpoint.json") as f:
+        assert json.load(f)["offset"] == 1000
+
+    client.crash_on = None
+    client.calls.clear()
+    summary = batch_update.sync(client, frame(rows), manifest_path=manifest, workers=1)
+
+    # 前 1000 筆不再上傳
+    assert sum(n for kind, n in client.calls if kind == "upsert") == 1500
+    assert summary["new"] == 2500 and len(client.rows) == 2500
+    assert not (tmp_path / "checkpoint.json").exists()
+
+
+def test_checkpoint_of_other_plan_is_ignored(manifest, tmp_path):
+    with open(tmp_path / "checkpoint.json", "w") as f:
+        json.dump({"plan": "other", "offset": 1, "failed": []}, f)
+    client = FakeClient()
+    batch_update.sync(client, frame([("00000001", "甲", "A"), ("00000002", "乙", "A")]), manifest_path=manifest)
+    assert sorted(client.rows) == ["00000001", "00000002"]
+
+
+def test_batch_sizer_follows_payload_and_latency():
+    sizer = batch_update.BatchSizer(size=1000, minimum=100, maximum=5000, target_bytes=100000, target_seconds=1.0)
+    sizer.observe(1000, 50000, 0.1)
+    assert sizer.size == 2000
+    # 太慢時縮小，每次最多減半
+    sizer.observe(2000, 100000, 10.0)
+    assert sizer.size == 1000
+    sizer.observe(1000, 400000, 0.5)
+    assert sizer.size == 500
+    sizer.observe(100, 10 ** 7, 10.0)
+    assert sizer.size == 100
+
+
+def test_iter_records_is_lazy_and_cleans_nan():
+    df = pd.DataFrame({"tax_id": ["00000001", "00000002"], "name": ["甲", float("nan")], "source": ["A", "B"]})
+    records = batch_update.iter_records(df, start=1)
+    assert not isinstance(records, list)
+    assert list(records) == [{"tax_id": "00000002", "name": None, "source": "B"}]
@@ -0,0 +1,66 @@
+from supabase import create_client
+
+from tools.bench import Workload, main, percentile
+from tools.bench_startup import DEFAULT_MODULE, measure, summarize
+from tools.stub_servers import PostgrestStub, make_companies, make_units
+
+
+def test_percentile_nearest_rank():
+    values = [i / 100 for i in range(1, 101)]
+    assert percentile(values, 50) == 0.5
+    assert percentile(values, 99) == 0.99
+    assert percentile([], 50) is None
+
+
+def test_postgrest_stub_speaks_supabase_client():
+    rows = make_units(30)
+    with PostgrestStub({"unified_numbers": rows}) as stub:
+        client = create_client(stub.url, "test-key")
+        table = lambda: client.table("unified_numbers")  # noqa: E731
+
+        wanted = [rows[0]["tax_id"], rows[5]["tax_id"], "99999997"]
+        assert {r["tax_id"] for r in table().select("*").in_("tax_id", wanted).execute().data} == set(wanted[:2])
+        found = table().select("*").ilike("name", "%臺北市%").limit(50).execute().data
+        assert found and all("臺北市" in r["name"] for r in found)
+        page = table().select("tax_id").order("tax_id").range(10, 19).execute().data
+        assert [r["tax_id"] for r in page] == sorted(r["tax_id"] for r in rows)[10:20]
+
+        table().upsert([{"tax_id": rows[0]["tax_id"], "name": "改名", "source": "x"}], on_conflict="tax_id").execute()
+        table().delete().in_("tax_id", [rows[1]["tax_id"]]).execute()
+        assert stub.tables["unified_numbers"][rows[0]["tax_id"]]["name"] == "改名"
+        assert rows[1]["tax_id"] not in stub.tables["unified_numbers"]
+
+
+def test_workload_builds_requests():
+    workload = Workload(make_companies(5), make_units(5))
+    method, path, body = workload.request("bulk_10")
+    assert (method, path) == ("POST", "/api")
+    assert body.count(b'"') == 2 + 2 * 10
+
+
+def test_bench_runs_scenarios_end_to_end(tmp_path, monkeypatch):
+    # Bench 會改寫這些環境變數，測試結束後還原
+    for name in ("GCIS_API_URL", "SUPABASE_URL", "SUPABASE_KEY", "SNAPSHOT_PATH", "NAME_INDEX_PATH", "GCIS_MIRROR_PATH",
+                 "KNOWN_IDS_PATH", "GCIS_NAME_API_URL"):
+        monkeypatch.setenv(name, "")
+    results = main([
+        "--scenarios", "get_id,name,bulk_10", "--requests", "6", "--concurrency", "2",
+        "--companies", "50", "--rows", "50", "--gcis-latency", "0", "--db-latency", "0",
+        "--snapshot", "--json", str(tmp_path / "bench.json"),
+    ])
+
+    assert [r["scenario"] for r in results] == ["get_id", "name", "bulk_10"]
+    assert all(r["errors"] == 0 and r["requests"] == 6 for r in results)
+    assert all(r["p50_ms"] <= r["p95_ms"] <= r["p99_ms"] for r in results)
+    # 有快照時名稱查詢不會打 Supabase
+    assert results[1]["db_calls"] == 0
+    assert (tmp_path / "bench.json").exists()
+
+
+def test_cold_start_skips_heavy_modules():
+    sample = measure(DEFAULT_MODULE)
+
+    assert sample["status"] == 200
+    # 說明頁面的冷啟動不應載入 requests 與 supabase SDK
+    assert sample["heavy_modules"] == []
+    assert summarize([sample])["import_ms"]["median"] == round(sample["import_ms"], 1)
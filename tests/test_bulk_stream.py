@@ -0,0 +1,76 @@
+import io
+import json
+import time
+import urllib.request
+
+
+def post_text(base, path, text):
+    req = urllib.request.Request(base + path, data=text.encode("utf-8"), method="POST",
+                                 headers={"Content-Type": "text/csv"})
+    with urllib.request.urlopen(req) as resp:
+        return resp.headers.get("Content-Type"), resp.read().decode("utf-8")
+
+
+def test_iter_upload_ids_skips_header_and_takes_first_column(api):
+    body = "\ufeff統一編號,單位名稱\n03730043,臺大\n\n\"04199019\",市府\n22099131\t台積電\n".encode("utf-8")
+    assert list(api.iter_upload_ids(io.BytesIO(body), len(body))) == ["03730043", "04199019", "22099131"]
+
+
+def test_iter_upload_ids_respects_content_length(api):
+    body = b"03730043\n04199019\n"
+    assert list(api.iter_upload_ids(io.BytesIO(body + b"99999997\n"), len(body))) == ["03730043", "04199019"]
+
+
+def test_stream_keeps_input_order_across_chunks(api, fake_db, monkeypatch):
+    monkeypatch.setattr(api, "query_govt", lambda tax_id, timeout: None)
+    ids = ["%08d" % i for i in range(25)] + ["03730043"]
+
+    chunks = list(api.stream_lookup(iter(ids), True, chunk_size=10))
+
+    assert [len(c) for c in chunks] == [10, 10, 6]
+    assert [row["統一編號"] for c in chunks for row in c] == ids
+    assert chunks[-1][-1]["單位名稱"] == "國立臺灣大學"
+
+
+def test_stream_yields_first_chunk_before_later_chunks_finish(api, monkeypatch):
+    def slow_lookup(ids, skip_govt, deadline_at, govt_timeout=None, trace=None):
+        if "00000002" in ids:
+            time.sleep(0.5)
+        return {x: api.not_found(x) for x in ids}
+
+    monkeypatch.setattr(api, "lookup_ids", slow_lookup)
+    started = time.monotonic()
+    gen = api.stream_lookup(iter(["00000001", "00000002", "00000003"]), True, chunk_size=1, depth=2)
+
+    first = next(gen)
+    assert first[0]["統一編號"] == "00000001"
+    assert time.monotonic() - started < 0.4
+    assert [c[0]["統一編號"] for c in gen] == ["00000002", "00000003"]
+
+
+def test_supabase_in_queries_are_chunked(api, fake_db, monkeypatch):
+    monkeypatch.setattr(api, "DB_IN_CHUNK", 3)
+    ids = ["%08d" % i for i in range(7)]
+
+    api.lookup_ids(ids, True, time.monotonic() + 5)
+
+    assert [len(call[2]) for call in fake_db.calls] == [3, 3, 1]
+
+
+def test_bulk_endpoint_ndjson(api, fake_db, server, monkeypatch):
+    monkeypatch.setattr(api, "query_govt", lambda tax_id, timeout: None)
+
+    content_type, body = post_text(server, "/api/bulk", "統一編號\n04199019\n99999997\n03730043\n")
+
+    rows = [json.loads(line) for line in body.splitlines()]
+    assert content_type.startswith("application/x-ndjson")
+    assert [(r["統一編號"], r["資料來源"]) for r in rows] == [
+        ("04199019", "地方政府機關"), ("99999997", "查無資料"), ("03730043", "全國各級學校")
+    ]
+
+
+def test_bulk_endpoint_tsv(api, fake_db, server):
+    content_type, body = post_text(server, "/api/bulk?format=tsv&skip_govt=true", "03730043\n99999997\n")
+
+    assert content_type.startswith("text/tab-separated-values")
+    assert body.splitlines() == ["統一編號\t單位名稱\t資料來源", "03730043\t國立臺灣大學\t全國各級學校", "99999997\t\t查無資料"]
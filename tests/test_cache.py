@@ -0,0 +1,92 @@
+import json
+import threading
+import time
+import urllib.request
+
+from conftest import post_json
+
+
+def test_cache_expires_by_source_ttl(api, monkeypatch):
+    cache = api.LookupCache(max_entries=10, ttl_govt=100, ttl_db=100, ttl_miss=1)
+    now = [1000.0]
+    monkeypatch.setattr(api.time, "monotonic", lambda: now[0])
+
+    cache.put("a", {"資料來源": "經濟部商業司"})
+    cache.put("b", api.not_found("b"))
+    now[0] += 2
+
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_cache_evicts_least_recently_used(api):
+    cache = api.LookupCache(max_entries=2, ttl_govt=100, ttl_db=100, ttl_miss=100)
+    cache.put("a", {"資料來源": "全國各級學校"})
+    cache.put("b", {"資料來源": "全國各級學校"})
+    cache.get("a")
+    cache.put("c", {"資料來源": "全國各級學校"})
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lookup_caches_hits_and_misses(api, fake_db, monkeypatch):
+    calls = []
+    monkeypatch.setattr(api, "query_govt", lambda tax_id, timeout: calls.append(tax_id))
+
+    for _ in range(3):
+        results = api.lookup_ids(["03730043", "99999999"], False, time.monotonic() + 5)
+
+    assert results["03730043"]["單位名稱"] == "國立臺灣大學"
+    assert results["99999999"]["資料來源"] == "查無資料"
+    assert sorted(calls) == ["03730043", "99999999"]
+    assert len(fake_db.calls) == 1
+
+
+def test_lookup_does_not_cache_when_govt_failed(api, fake_db, monkeypatch):
+    def failing(tax_id, timeout):
+        raise TimeoutError("gcis down")
+
+    monkeypatch.setattr(api, "query_govt", failing)
+
+    api.lookup_ids(["99999999"], False, time.monotonic() + 5)
+    api.lookup_ids(["99999999"], False, time.monotonic() + 5)
+
+    assert len(fake_db.calls) == 2
+
+
+def test_concurrent_lookups_share_one_upstream_call(api, fake_db, monkeypatch):
+    calls = []
+
+    def slow(tax_id, timeout):
+        calls.append(tax_id)
+        time.sleep(0.3)
+        return None
+
+    monkeypatch.setattr(api, "query_govt", slow)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(api.lookup_ids(["03730043"], False, time.monotonic() + 5)))
+        for _ in range(4)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert calls == ["03730043"]
+    assert all(r["03730043"]["單位名稱"] == "國立臺灣大學" for r in results)
+    assert api.lookup_cache.stats()["shared_loads"] == 3
+
+
+def test_stats_endpoint(api, fake_db, server, monkeypatch):
+    monkeypatch.setattr(api, "query_govt", lambda tax_id, timeout: None)
+    post_json(server, "/api", {"ids": ["03730043", "03730043"]})
+
+    with urllib.request.urlopen(server + "/api/stats") as resp:
+        stats = json.loads(resp.read())["cache"]
+
+    assert stats["entries"] == 1
+    assert stats["misses"] == 1
@@ -0,0 +1,60 @@
+import requests
+
+
+def test_supabase_client_is_reused_until_env_changes(api, monkeypatch):
+    created = []
+    monkeypatch.setattr(api, "PostgrestClient", lambda url, key, **kwargs: created.append(url) or object())
+
+    first = api.get_supabase()
+    assert api.get_supabase() is first
+
+    monkeypatch.setenv("SUPABASE_URL", "http://other.invalid")
+    assert api.get_supabase() is not first
+    assert created == ["http://supabase.invalid", "http://other.invalid"]
+
+    monkeypatch.delenv("SUPABASE_KEY")
+    assert api.get_supabase() is None
+
+
+def test_query_supabase_rebuilds_pool_on_connection_error(api):
+    sessions = []
+
+    class Query:
+        def __init__(self, client):
+            self.client = client
+
+        def execute(self):
+            sessions.append(self.client.session())
+            if len(sessions) == 1:
+                raise requests.ConnectionError("stale connection")
+            return "ok"
+
+    assert api.query_supabase(Query) == "ok"
+    # 與政府 API 共用連線池，重建後改用新的 session
+    assert sessions[0] is not sessions[1]
+    assert sessions[1] is api.get_http_session()
+
+
+def test_govt_session_is_shared_and_rebuilt_after_connection_error(api, monkeypatch):
+    session = api.get_http_session()
+    assert api.get_http_session() is session
+
+    calls = []
+
+    def fake_get(self, url, params=None, timeout=None):
+        calls.append(self)
+        if len(calls) == 1:
+            raise requests.ConnectionError("connection reset")
+        resp = requests.Response()
+        resp.status_code = 200
+        resp._content = '[{"Company_Name": "台積電"}]'.encode("utf-8")
+        return resp
+
+    monkeypatch.setattr(requests.Session, "get", fake_get)
+
+    item = api.query_govt("22099131", 1)
+
+    assert item["單位名稱"] == "台積電"
+    assert calls[0] is session and calls[1] is not session
+    assert api.get_http_session() is calls[1]
+
@@ -0,0 +1,109 @@
+import time
+
+import pytest
+import requests
+
+from gcis_mirror import load_state, run_mirror
+from lookup_snapshot import Snapshot, write_snapshot
+from tools.stub_servers import GcisStub, make_companies
+
+
+@pytest.fixture
+def companies():
+    return make_companies(25)
+
+
+class FlakySession(requests.Session):
+    """第 fail_at 次以後的請求都失敗，模擬執行到一半中斷"""
+
+    def __init__(self, fail_at):
+        super().__init__()
+        self.fail_at = fail_at
+        self.calls = 0
+
+    def get(self, *args, **kwargs):
+        self.calls += 1
+        if self.calls >= self.fail_at:
+            raise requests.ConnectionError("boom")
+        return super().get(*args, **kwargs)
+
+
+def test_full_sweep_writes_mirror(tmp_path, companies):
+    mirror_path = str(tmp_path / "gcis_mirror.snap")
+    with GcisStub(companies) as stub:
+        summary = run_mirror(mirror_path, url=stub.url, state_dir=str(tmp_path / "state"), page_size=10)
+
+    assert summary["status"] == "completed"
+    assert summary["pages"] == 3
+    snapshot = Snapshot(mirror_path)
+    assert len(snapshot) == 25
+    assert snapshot.created_at == summary["sweep_started_at"]
+    tax_id, name = next(iter(companies.items()))
+    assert snapshot.get(tax_id) == (name, "經濟部商業司")
+    snapshot.close()
+    # 掃描完成後游標歸零
+    assert load_state(str(tmp_path / "state")) is None
+
+
+def test_interrupted_sweep_resumes_from_cursor(tmp_path, companies):
+    mirror_path = str(tmp_path / "gcis_mirror.snap")
+    state_dir = str(tmp_path / "state")
+    with GcisStub(companies) as stub:
+        first = run_mirror(mirror_path, url=stub.url, state_dir=state_dir, page_size=10,
+                           session=FlakySession(fail_at=2), sleep=lambda s: None)
+        assert first["status"] == "failed"
+        assert first["cursor"] == 10
+        assert load_state(state_dir)["skip"] == 10
+
+        before = stub.requests
+        second = run_mirror(mirror_path, url=stub.url, state_dir=state_dir, page_size=10)
+        # 只抓剩下的兩頁
+        assert stub.requests - before == 2
+
+    assert second["status"] == "completed"
+    assert second["sweep_started_at"] == first["sweep_started_at"]
+    snapshot = Snapshot(mirror_path)
+    assert [row[0] for row in snapshot] == sorted(companies)
+    snapshot.close()
+
+
+def test_query_govt_against_stub(api, companies):
+    tax_id = next(iter(companies))
+    with GcisStub(companies) as stub:
+        api.GOVT_API_URL = stub.url
+        assert api.query_govt(tax_id, 2)["單位名稱"] == companies[tax_id]
+        assert api.query_govt("99999997", 2) is None
+
+
+def test_lookup_prefers_fresh_mirror(api, fake_db, tmp_path, monkeypatch):
+    mirror_path = str(tmp_path / "gcis_mirror.snap")
+    write_snapshot(mirror_path, [("22099131", "台灣積體電路製造股份有限公司", "經濟部商業司")])
+    monkeypatch.setattr(api, "GCIS_MIRROR_PATH", mirror_path)
+    calls = []
+
+    def stub(tax_id, timeout):
+        calls.append(tax_id)
+        return None
+
+    monkeypatch.setattr(api, "query_govt", stub)
+
+    results = api.lookup_ids(["22099131", "04541302"], False, time.monotonic() + 5)
+
+    assert results["22099131"]["單位名稱"] == "台灣積體電路製造股份有限公司"
+    assert results["22099131"]["資料來源"] == "經濟部商業司"
+    # 鏡像沒有的才即時查詢
+    assert calls == ["04541302"]
+    # 跳過政府 API 時也不使用鏡像
+    assert api.lookup_ids(["22099131"], True, time.monotonic() + 5)["22099131"]["資料來源"] == "查無資料"
+
+
+def test_stale_mirror_is_ignored(api, fake_db, tmp_path, monkeypatch):
+    mirror_path = str(tmp_path / "gcis_mirror.snap")
+    write_snapshot(mirror_path, [("22099131", "舊名稱", "經濟部商業司")], created_at=time.time() - 60 * 86400)
+    monkeypatch.setattr(api, "GCIS_MIRROR_PATH", mirror_path)
+    calls = []
+    monkeypatch.setattr(api, "query_govt", lambda tax_id, timeout: calls.append(tax_id))
+
+    api.lookup_ids(["22099131"], False, time.monotonic() + 5)
+
+    assert calls == ["22099131"]
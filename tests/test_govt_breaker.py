@@ -0,0 +1,127 @@
+import time
+
+import pytest
+import requests
+
+from conftest import post_json
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_opens_after_consecutive_failures_and_probes(api):
+    clock = FakeClock()
+    breaker = api.CircuitBreaker(3, cooldown=10, probes=1, clock=clock)
+
+    for _ in range(3):
+        breaker.acquire()
+        breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(api.GovtUnavailable):
+        breaker.acquire()
+
+    # 冷卻後只放行一個試探請求
+    clock.now += 10
+    assert breaker.allows()
+    breaker.acquire()
+    with pytest.raises(api.GovtUnavailable):
+        breaker.acquire()
+
+    # 試探失敗重新開啟，成功則關閉
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock.now += 10
+    breaker.acquire()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.stats()["times_opened"] == 2
+
+
+def test_success_resets_failure_count(api):
+    breaker = api.CircuitBreaker(2, cooldown=10)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_token_bucket_waits_then_rejects_past_deadline(api):
+    clock = FakeClock()
+    slept = []
+
+    def sleep(seconds):
+        slept.append(seconds)
+        clock.now += seconds
+
+    bucket = api.TokenBucket(rate=10, burst=2, clock=clock, sleep=sleep)
+    bucket.acquire(clock.now + 1)
+    bucket.acquire(clock.now + 1)
+    assert slept == []
+
+    bucket.acquire(clock.now + 1)
+    assert slept == [pytest.approx(0.1)]
+
+    with pytest.raises(api.GovtUnavailable):
+        bucket.acquire(clock.now + 0.01)
+    assert bucket.stats()["rejected"] == 1
+
+
+def test_timeout_follows_observed_latency(api, monkeypatch):
+    monkeypatch.setattr(api, "query_govt", lambda tax_id, timeout: None)
+    client = api.GovtClient(api.CircuitBreaker(5, 10), api.TokenBucket(1000, 1000), min_timeout=0.5, min_samples=5)
+
+    # 樣本不足時使用上限
+    assert client.timeout_for(4) == 4
+    for _ in range(5):
+        client.lookup("22099131", 4, time.monotonic() + 5)
+    # 延遲很低時不會低於下限
+    assert client.timeout_for(4) == 0.5
+    client._latencies.extend([2.0] * 5)
+    assert client.timeout_for(4) == pytest.approx(3.0)
+    assert client.timeout_for(2) == 2
+
+
+def test_open_breaker_skips_govt_and_reports_it(api, fake_db, server, monkeypatch):
+    calls = []
+
+    def failing(tax_id, timeout):
+        calls.append(tax_id)
+        raise requests.ConnectionError("down")
+
+    monkeypatch.setattr(api, "query_govt", failing)
+    for _ in range(api.GOVT_BREAKER_FAILURES):
+        api.govt_client.breaker.record_failure()
+
+    body = post_json(server, "/api", {"ids": ["04199019", "99999997"]})
+
+    assert calls == []
+    assert body["govt_skipped"] is True
+    assert [row["資料來源"] for row in body["data"]] == ["地方政府機關", "查無資料"]
+    # 斷路器開啟時的結果不能寫進快取，否則恢復後仍會回覆查無資料
+    assert api.lookup_cache.get((False, "99999997")) is None
+
+
+def test_failures_open_breaker_for_later_requests(api, fake_db, server, monkeypatch):
+    calls = []
+
+    def failing(tax_id, timeout):
+        calls.append(tax_id)
+        raise requests.ConnectionError("down")
+
+    monkeypatch.setattr(api, "query_govt", failing)
+    ids = ["%08d" % (10000000 + i) for i in range(40)]
+    ids = [i for i in ids if api.valid_checksum(i)][:api.GOVT_BREAKER_FAILURES]
+
+    first = post_json(server, "/api", {"ids": ids})
+    assert first["govt_skipped"] is False
+    assert len(calls) == len(ids)
+
+    second = post_json(server, "/api", {"ids": ["99999997"]})
+    assert second["govt_skipped"] is True
+    assert len(calls) == len(ids)
+    assert api.govt_client.stats()["breaker"]["state"] == "open"
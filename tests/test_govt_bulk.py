@@ -0,0 +1,70 @@
+import time
+
+from conftest import post_json
+
+
+def make_stub(found, delays=None, calls=None):
+    def stub(tax_id, timeout):
+        if calls is not None:
+            calls.append(tax_id)
+        time.sleep((delays or {}).get(tax_id, 0))
+        if tax_id in found:
+            return {"統一編號": tax_id, "單位名稱": found[tax_id], "資料來源": "經濟部商業司"}
+        return None
+    return stub
+
+
+def test_bulk_collapses_duplicates(api, monkeypatch):
+    calls = []
+    monkeypatch.setattr(api, "query_govt", make_stub({"22099131": "台積電"}, calls=calls))
+
+    results = api.query_govt_bulk(["22099131", "03730043", "22099131"], time.monotonic() + 5)
+
+    assert sorted(calls) == ["03730043", "22099131"]
+    # 查無資料但有明確回應的統編也會出現在結果中，值為 None
+    assert results["22099131"]["單位名稱"] == "台積電"
+    assert results["03730043"] is None
+
+
+def test_bulk_runs_concurrently(api, monkeypatch):
+    ids = ["%08d" % i for i in range(8)]
+    monkeypatch.setattr(api, "query_govt", make_stub({}, delays={i: 0.3 for i in ids}))
+
+    started = time.monotonic()
+    api.query_govt_bulk(ids, started + 5, concurrency=8)
+
+    assert time.monotonic() - started < 1.0
+
+
+def test_bulk_drops_ids_past_deadline(api, monkeypatch):
+    found = {"22099131": "台積電", "04541302": "中華電信"}
+    monkeypatch.setattr(api, "query_govt", make_stub(found, delays={"04541302": 3}))
+
+    started = time.monotonic()
+    results = api.query_govt_bulk(["22099131", "04541302"], started + 1)
+
+    assert time.monotonic() - started < 1.5
+    assert list(results) == ["22099131"]
+
+
+def test_post_keeps_order_and_falls_through_to_supabase(api, fake_db, server, monkeypatch):
+    found = {"22099131": "台積電", "04541302": "中華電信"}
+    monkeypatch.setattr(api, "GOVT_DEADLINE", 1.0)
+    monkeypatch.setattr(api, "query_govt", make_stub(found, delays={"04541302": 3}))
+
+    body = post_json(server, "/api", {"ids": ["04199019", "22099131", "04541302", "99999997", "03730043"]})
+
+    assert [row["統一編號"] for row in body["data"]] == ["04199019", "22099131", "04541302", "99999997", "03730043"]
+    assert [row["資料來源"] for row in body["data"]] == ["地方政府機關", "經濟部商業司", "查無資料", "查無資料", "全國各級學校"]
+    # 逾時的統編要交給 Supabase 查詢
+    assert ("in_", "tax_id", ["04199019", "04541302", "99999997"]) in fake_db.calls
+
+
+def test_post_skip_govt_never_calls_govt(api, fake_db, server, monkeypatch):
+    calls = []
+    monkeypatch.setattr(api, "query_govt", make_stub({}, calls=calls))
+
+    body = post_json(server, "/api", {"ids": ["03730043"], "skip_govt": True})
+
+    assert calls == []
+    assert body["data"][0]["單位名稱"] == "國立臺灣大學"
@@ -0,0 +1,99 @@
+import gzip
+import json
+import urllib.error
+import urllib.request
+
+import requests
+
+
+def get(url, headers=None):
+    req = urllib.request.Request(url, headers=headers or {})
+    try:
+        with urllib.request.urlopen(req) as resp:
+            return resp.status, resp.headers, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def test_choose_encoding_honours_q_values(api):
+    assert api.choose_encoding("gzip, deflate, br", ("br", "gzip")) == "br"
+    assert api.choose_encoding("gzip;q=1.0, br;q=0.5", ("br", "gzip")) == "gzip"
+    assert api.choose_encoding("br;q=0, *", ("br", "gzip")) == "gzip"
+    assert api.choose_encoding("identity", ("gzip",)) is None
+    assert api.choose_encoding(None, ("gzip",)) is None
+
+
+def test_landing_page_is_precompressed_and_revalidated(api, server):
+    status, headers, body = get(server + "/", {"Accept-Encoding": "gzip"})
+    assert status == 200
+    assert headers["Content-Encoding"] == "gzip"
+    assert "統一編號查詢服務" in gzip.decompress(body).decode("utf-8")
+    etag = headers["ETag"]
+    assert etag.startswith('"') and "must-revalidate" in headers["Cache-Control"]
+
+    # 同一個 process 只建立一次
+    assert api.get_landing_page() is api.get_landing_page()
+
+    status, headers, body = get(server + "/", {"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert status == 304
+    assert body == b""
+
+    # 不接受壓縮的用戶端拿到原始內容，ETag 不同但仍可用來重新驗證
+    status, headers, body = get(server + "/")
+    assert status == 200
+    assert "Content-Encoding" not in headers
+    assert headers["ETag"] != etag
+    assert get(server + "/", {"If-None-Match": headers["ETag"]})[0] == 304
+    assert get(server + "/", {"If-None-Match": '"stale"'})[0] == 200
+
+
+def test_id_lookup_cache_control_follows_source(api, fake_db, server, monkeypatch):
+    def fake_govt(tax_id, timeout):
+        if tax_id == "22099131":
+            return {"統一編號": tax_id, "單位名稱": "台灣積體電路製造股份有限公司", "資料來源": "經濟部商業司"}
+        return None
+
+    monkeypatch.setattr(api, "query_govt", fake_govt)
+
+    def s_maxage(tax_id):
+        status, headers, _ = get(server + "/?id=" + tax_id)
+        return status, headers["Cache-Control"]
+
+    assert s_maxage("22099131") == (200, f"public, max-age=60, s-maxage={api.CDN_MAXAGE_GOVT}")
+    assert s_maxage("04199019") == (200, f"public, max-age=60, s-maxage={api.CDN_MAXAGE_DB}")
+    assert s_maxage("99999997") == (200, f"public, max-age=60, s-maxage={api.CDN_MAXAGE_MISS}")
+    assert s_maxage("12345678") == (400, f"public, max-age=60, s-maxage={api.CDN_MAXAGE_INVALID}")
+
+
+def test_partial_results_are_not_cacheable(api, fake_db, server, monkeypatch):
+    def failing(tax_id, timeout):
+        raise requests.ConnectionError("down")
+
+    monkeypatch.setattr(api, "query_govt", failing)
+    for _ in range(api.GOVT_BREAKER_FAILURES):
+        api.govt_client.breaker.record_failure()
+
+    status, headers, body = get(server + "/?id=04199019")
+    assert json.loads(body)["govt_skipped"] is True
+    assert headers["Cache-Control"] == "no-store"
+
+
+def test_json_is_gzipped_when_accepted_and_large(api, fake_db, server, monkeypatch):
+    monkeypatch.setattr(api, "query_govt", lambda tax_id, timeout: None)
+    ids = ["04199019"] * 100
+    req = urllib.request.Request(
+        server + "/api", data=json.dumps({"ids": ids, "skip_govt": True}).encode(),
+        headers={"Content-Type": "application/json", "Accept-Encoding": "gzip"}, method="POST",
+    )
+    with urllib.request.urlopen(req) as resp:
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert resp.headers["Vary"] == "Accept-Encoding"
+        assert resp.headers["Cache-Control"] == "no-store"
+        assert "compress" in resp.headers["Server-Timing"]
+        body = json.loads(gzip.decompress(resp.read()))
+    assert body["count"] == 100
+
+    # 小的回應不壓縮
+    status, headers, body = get(server + "/?id=04199019&skip_govt=true", {"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in headers
+    assert json.loads(body)["data"][0]["單位名稱"] == "臺北市政府"
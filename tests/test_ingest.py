@@ -0,0 +1,147 @@
+import io
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+import ingest
+
+CSV = "序號, 統一編號 ,單位名稱,地址\n1,03730043,國立臺灣大學,臺北市\n2,04199019, 臺北市政府 ,臺北市\n3,00000001,測試基金會,新北市\n"
+
+
+def test_detect_encoding():
+    assert ingest.detect_encoding(CSV.encode("utf-8")) == "utf-8-sig"
+    assert ingest.detect_encoding(CSV.encode("cp950")) == "cp950"
+    # 開頭剛好切在多位元組字元中間仍判斷為 UTF-8
+    assert ingest.detect_encoding(CSV.encode("utf-8")[:7]) == "utf-8-sig"
+
+
+@pytest.mark.parametrize("encoding", ["utf-8", "utf-8-sig", "cp950"])
+def test_parse_stream_in_chunks(monkeypatch, encoding):
+    monkeypatch.setattr(ingest, "CHUNK_ROWS", 2)
+
+    df = ingest.parse_csv_stream(io.BytesIO(CSV.encode(encoding)), "測試")
+
+    assert list(df.columns) == ["tax_id", "name", "source"]
+    assert df.values.tolist() == [
+        ["03730043", "國立臺灣大學", "測試"],
+        ["04199019", "臺北市政府", "測試"],
+        ["00000001", "測試基金會", "測試"],
+    ]
+
+
+def test_parse_stream_alternative_name_column():
+    df = ingest.parse_csv_stream(io.BytesIO("統一編號,機關名稱\n01234567,某機關\n".encode("utf-8")), "機關")
+    assert df.values.tolist() == [["01234567", "某機關", "機關"]]
+
+
+def test_parse_stream_missing_columns():
+    assert ingest.parse_csv_stream(io.BytesIO("a,b\n1,2\n".encode("utf-8")), "x") is None
+
+
+@pytest.fixture
+def csv_server():
+    hits = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            hits.append(self.headers.get("If-None-Match"))
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = CSV.encode("cp950")
+            self.send_response(200)
+            self.send_header("ETag", '"v1"')
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:%d" % httpd.server_address[1], hits
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_conditional_fetch_reuses_cached_result(csv_server, tmp_path, monkeypatch):
+    base, hits = csv_server
+    monkeypatch.setattr(ingest, "CACHE_DIR", str(tmp_path))
+    sources = [(base + "/a.csv", "甲"), (base + "/b.csv", "乙")]
+
+    first = ingest.fetch_all(sources)
+    second = ingest.fetch_all(sources)
+
+    assert [r.status for r in first] == ["downloaded", "downloaded"]
+    assert [r.status for r in second] == ["unchanged", "unchanged"]
+    assert second[1].df.values.tolist() == first[1].df.values.tolist()
+    assert sorted(hits, key=str) == ['"v1"', '"v1"', None, None]
+
+
+def test_fetch_failure_is_reported(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "CACHE_DIR", str(tmp_path))
+    [result] = ingest.fetch_all([("http://127.0.0.1:9/none.csv", "壞掉")])
+    assert result.status == "failed" and result.df is None
+
+
+def test_normalize_and_dedup():
+    df = pd.DataFrame(
+        [["０３７３００４３", "國立臺灣大學", "甲"], [" 04199019", None, "甲"], ["03730043", "臺大", "乙"], [None, "x", "乙"]],
+        columns=["tax_id", "name", "source"],
+    )
+
+    unique, duplicates = ingest.dedup_rows(ingest.normalize_rows(df))
+
+    assert unique.values.tolist() == [["03730043", "國立臺灣大學", "甲"], ["04199019", "", "甲"]]
+    assert duplicates["source"].tolist() == ["甲", "乙"]
+
+
+class RecordingSink:
+    name = "recording"
+
+    def __init__(self, fail=False):
+        self.seen = None
+        self.fail = fail
+
+    def write(self, df, run):
+        if self.fail:
+            raise RuntimeError("boom")
+        self.seen = (len(df), run.complete)
+        return {"rows": len(df)}
+
+
+def test_pipeline_fans_out_to_every_sink_once(csv_server, tmp_path, monkeypatch):
+    base, hits = csv_server
+    monkeypatch.setattr(ingest, "CACHE_DIR", str(tmp_path / "cache"))
+    sources = [(base + "/a.csv", "甲"), (base + "/b.csv", "乙")]
+    recording = RecordingSink()
+    failing = RecordingSink(fail=True)
+    failing.name = "failing"
+    csv_path = tmp_path / "out.csv"
+    sinks = [
+        recording, failing,
+        ingest.CsvSink(str(csv_path)),
+        ingest.SnapshotSink(
+            str(tmp_path / "lookup.snap"), str(tmp_path / "name_index.bin"), str(tmp_path / "known_ids.bin")
+        ),
+        ingest.ParquetSink(str(tmp_path / "out.parquet")),
+    ]
+
+    result = ingest.run_pipeline(sinks, sources, duplicate_report=str(tmp_path / "dups.csv"))
+
+    # 兩個來源各下載一次，所有 sink 共用
+    assert len(hits) == 2
+    assert recording.seen == (3, True)
+    assert len(result.duplicates) == 6
+    assert result.sinks["failing"]["status"] == "failed"
+    assert result.sinks["snapshot"]["count"] == 3
+    assert result.sinks["snapshot"]["known_ids"] == 3
+    # 沒有安裝 pyarrow 時略過，不影響其他輸出
+    assert result.sinks["parquet:out.parquet"]["status"] in ("ok", "skipped")
+    assert csv_path.read_text(encoding="utf-8-sig").splitlines()[0] == "統一編號,單位名稱"
+    assert set(result.stages) >= {"fetch", "normalize", "dedup", "sink:recording", "sink:snapshot"}
+    assert result.stages["fetch"]["rows"] == 6
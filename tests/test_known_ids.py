@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+from conftest import post_json
+from known_ids import KnownIds, write_known_ids
+
+
+def test_roundtrip_sorted_and_deduplicated(tmp_path):
+    path = str(tmp_path / "known.bin")
+    count = write_known_ids(path, ["22222222", " 00000001 ", "22222222", "1234", None, "abcdefgh", 99999999])
+
+    assert count == 3
+    known = KnownIds(path)
+    assert len(known) == 3
+    assert "00000001" in known and "22222222" in known and "99999999" in known
+    assert "00000002" not in known
+    assert "1" not in known and "臺大" not in known
+    # 檔案為 header 加上每筆 4 bytes
+    assert (tmp_path / "known.bin").stat().st_size == 24 + 3 * 4
+
+
+def test_rejects_unknown_format(tmp_path):
+    path = tmp_path / "known.bin"
+    path.write_bytes(b"not a known id list at all")
+    with pytest.raises(ValueError):
+        KnownIds(str(path))
+
+
+@pytest.fixture
+def known_file(api, monkeypatch, tmp_path):
+    path = str(tmp_path / "known_ids.bin")
+    write_known_ids(path, ["03730043", "04199019"])
+    monkeypatch.setattr(api, "KNOWN_IDS_PATH", path)
+    return path
+
+
+def test_known_ids_skip_govt(api, fake_db, known_file, monkeypatch):
+    asked = []
+
+    def fake_govt(tax_id, timeout):
+        asked.append(tax_id)
+        if tax_id == "22099131":
+            return {"統一編號": tax_id, "單位名稱": "台灣積體電路製造股份有限公司", "資料來源": "經濟部商業司"}
+        return None
+
+    monkeypatch.setattr(api, "query_govt", fake_govt)
+    trace = api.RequestTrace("test")
+
+    results = api.lookup_ids(["04199019", "22099131"], False, time.monotonic() + 5, trace=trace)
+
+    assert asked == ["22099131"]
+    assert results["04199019"]["單位名稱"] == "臺北市政府"
+    assert results["22099131"]["資料來源"] == "經濟部商業司"
+    assert trace.get("govt_avoided") == 1
+    # 清單中的統編結果已確定，可以放進快取
+    assert api.lookup_cache.get((False, "04199019")) is not None
+
+
+def test_response_reports_avoided_calls(api, fake_db, known_file, server, monkeypatch):
+    monkeypatch.setattr(api, "query_govt", lambda tax_id, timeout: None)
+
+    body = post_json(server, "/api", {"ids": ["04199019", "22099131", "04199019"]})
+
+    assert body["govt_calls_avoided"] == 1
+    assert [d["資料來源"] for d in body["data"]] == ["地方政府機關", "查無資料", "地方政府機關"]
+
+
+def test_stale_list_is_ignored(api, fake_db, known_file, monkeypatch):
+    write_known_ids(known_file, ["04199019"], created_at=time.time() - 90 * 86400)
+    asked = []
+    monkeypatch.setattr(api, "query_govt", lambda tax_id, timeout: asked.append(tax_id))
+
+    api.lookup_ids(["04199019"], False, time.monotonic() + 5)
+
+    assert asked == ["04199019"]
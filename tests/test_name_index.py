@@ -0,0 +1,128 @@
+import json
+import urllib.parse
+import urllib.request
+
+import pytest
+
+from lookup_snapshot import Snapshot, write_snapshot
+from name_index import NameIndex, PrefixIndex, normalize_name, write_name_index
+
+ROWS = [
+    ("00000001", "國立臺灣大學", "全國各級學校"),
+    ("00000002", "台灣大學", "全國各級學校"),
+    ("00000003", "台灣大學附設醫院", "行政院所屬機關"),
+    ("00000004", "私立台灣大學城補習班", "非營利事業"),
+    ("00000005", "灣大學台", "非營利事業"),
+    ("00000006", "ＡＢＣ　協會", "非營利事業"),
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    snap_path = str(tmp_path / "s.snap")
+    write_snapshot(snap_path, ROWS)
+    snapshot = Snapshot(snap_path)
+    write_name_index(str(tmp_path / "n.bin"), snapshot)
+    return NameIndex(str(tmp_path / "n.bin"), snapshot)
+
+
+def test_normalize_name():
+    assert normalize_name("國立臺灣 大學") == "國立台灣大學"
+    assert normalize_name("ＡＢＣ　協會") == "abc協會"
+
+
+def test_ranking_exact_prefix_substring(index):
+    names = [row[1] for row in index.search("臺灣大學")]
+    assert names == ["台灣大學", "台灣大學附設醫院", "國立臺灣大學", "私立台灣大學城補習班"]
+
+
+def test_full_width_and_case_insensitive(index):
+    assert [row[0] for row in index.search("abc")] == ["00000006"]
+
+
+def test_grams_out_of_order_are_not_matched(index):
+    assert index.search("台灣大學台") == []
+
+
+def test_short_query_cannot_use_index(index):
+    assert index.search("台") is None
+    assert [row[0] for row in index.search("協會")] == ["00000006"]
+
+
+def test_limit(index):
+    assert len(index.search("大學", limit=2)) == 2
+
+
+def test_rejects_index_of_other_snapshot(tmp_path, index):
+    other = str(tmp_path / "other.snap")
+    write_snapshot(other, ROWS[:2])
+    with pytest.raises(ValueError):
+        NameIndex(index.path, Snapshot(other))
+
+
+@pytest.fixture
+def prefix_index(tmp_path):
+    snap_path = str(tmp_path / "p.snap")
+    write_snapshot(snap_path, ROWS + [("00000007", "台灣大學", "行政院所屬機關"), ("00000008", "台大", "其他")])
+    return PrefixIndex(Snapshot(snap_path))
+
+
+def test_prefix_complete_ranks_by_length_then_source(prefix_index):
+    rows = prefix_index.complete("臺灣")
+    # 同名時依 SOURCE_ORDER，再依統編
+    assert [row[0] for row in rows] == ["00000002", "00000007", "00000003"]
+    assert [row[0] for row in prefix_index.complete("台")][:2] == ["00000008", "00000002"]
+
+
+def test_prefix_complete_source_filter_and_limit(prefix_index):
+    assert [row[0] for row in prefix_index.complete("台", source="行政院所屬機關")] == ["00000007", "00000003"]
+    assert [row[0] for row in prefix_index.complete("台", source="其他")] == ["00000008"]
+    assert prefix_index.complete("台", source="不存在") == []
+    assert len(prefix_index.complete("台", limit=1)) == 1
+    assert prefix_index.complete("  ") == []
+    assert [row[0] for row in prefix_index.complete("ａｂ")] == ["00000006"]
+
+
+def test_api_name_search_uses_index(api, fake_db, snapshot_file, server, monkeypatch):
+    monkeypatch.setattr(api, "query_govt_names", lambda name, timeout: [])
+    write_name_index(api.NAME_INDEX_PATH, Snapshot(snapshot_file))
+
+    url = server + "/?name=" + urllib.parse.quote("台灣大學")
+    with urllib.request.urlopen(url) as resp:
+        body = json.loads(resp.read())
+
+    assert [row["統一編號"] for row in body["data"]] == ["03730043"]
+    assert fake_db.calls == []
+
+
+def test_api_name_search_falls_back_to_supabase(api, fake_db, server, monkeypatch):
+    monkeypatch.setattr(api, "query_govt_names", lambda name, timeout: [])
+    url = server + "/?name=" + urllib.parse.quote("臺北")
+    with urllib.request.urlopen(url) as resp:
+        body = json.loads(resp.read())
+
+    assert [row["統一編號"] for row in body["data"]] == ["04199019"]
+    assert fake_db.calls[0][0] == "ilike"
+
+
+def test_api_suggest_uses_prefix_index(api, fake_db, snapshot_file, server):
+    url = server + "/api/suggest?limit=5&q=" + urllib.parse.quote("台北")
+    with urllib.request.urlopen(url) as resp:
+        assert "prefix_index" in resp.headers["Server-Timing"]
+        assert "s-maxage" in resp.headers["Cache-Control"]
+        body = json.loads(resp.read())
+
+    assert [row["統一編號"] for row in body["data"]] == ["04199019"]
+    assert fake_db.calls == []
+    # 同一份快照只建立一次
+    assert api.get_prefix_index() is api.get_prefix_index()
+
+
+def test_api_suggest_falls_back_to_supabase_prefix(api, fake_db, server):
+    url = server + "/api/suggest?source=" + urllib.parse.quote("地方政府機關") + "&q=" + urllib.parse.quote("臺北")
+    with urllib.request.urlopen(url) as resp:
+        body = json.loads(resp.read())
+
+    assert [row["統一編號"] for row in body["data"]] == ["04199019"]
+    assert ("ilike", "name", "臺北%") in fake_db.calls
+    assert ("eq", "source", "地方政府機關") in fake_db.calls
@@ -0,0 +1,109 @@
+import json
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import pytest
+
+from tools.stub_servers import GcisStub, PostgrestStub
+
+COMPANIES = {"%08d" % (10000000 + i): "測試%d科技股份有限公司" % i for i in range(120)}
+COMPANIES["22099131"] = "台灣積體電路製造股份有限公司"
+UNITS = [{"tax_id": "%08d" % (70000000 + i), "name": "財團法人測試%d基金會" % i, "source": "非營利事業"} for i in range(80)]
+# 兩邊都有的統編，以經濟部商業司為準
+UNITS.append({"tax_id": "10000001", "name": "測試舊名", "source": "非營利事業"})
+UNITS.append({"tax_id": "03730043", "name": "測試", "source": "全國各級學校"})
+
+
+@pytest.fixture
+def stubs(api, monkeypatch):
+    gcis = GcisStub(COMPANIES).start()
+    db = PostgrestStub({"unified_numbers": UNITS}).start()
+    monkeypatch.setattr(api, "GOVT_NAME_API_URL", gcis.url)
+    monkeypatch.setenv("SUPABASE_URL", db.url)
+    yield gcis, db
+    gcis.stop()
+    db.stop()
+
+
+def get(server, name, **params):
+    url = server + "/?" + urllib.parse.urlencode(dict(name=name, **params))
+    try:
+        with urllib.request.urlopen(url) as resp:
+            return resp.status, resp.headers, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, json.loads(e.read())
+
+
+def test_merges_and_deduplicates_by_tax_id(api, stubs, server):
+    status, headers, body = get(server, "測試", limit=5)
+
+    assert status == 200
+    # 完全相同的名稱排最前面，其次是開頭相同、名稱較短的
+    assert [row["統一編號"] for row in body["data"]][:2] == ["03730043", "10000000"]
+    assert body["govt_skipped"] is False and body["next_cursor"]
+    assert f"s-maxage={api.CDN_MAXAGE_GOVT}" in headers["Cache-Control"]
+
+    _, _, everything = get(server, "測試", limit=500)
+    rows = {row["統一編號"]: row for row in everything["data"]}
+    assert len(rows) == len(everything["data"]) == 120 + 80 + 1
+    assert rows["10000001"]["資料來源"] == "經濟部商業司"
+    assert everything["next_cursor"] is None
+
+
+def test_cursor_pages_through_every_match_once(api, stubs, server):
+    gcis, db = stubs
+    _, _, everything = get(server, "測試", limit=500)
+    expected = [row["統一編號"] for row in everything["data"]]
+    api.name_cache.clear()
+    gcis_before, db_before = gcis.requests, db.requests
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        params = {"limit": 30}
+        if cursor:
+            params["cursor"] = cursor
+        _, _, body = get(server, "測試", **params)
+        seen += [row["統一編號"] for row in body["data"]]
+        pages += 1
+        cursor = body["next_cursor"]
+        if pages == 3:
+            # 快取過期 (或換了實例) 時重新查詢，翻頁仍不重複、不遺漏
+            api.name_cache.clear()
+        if not cursor:
+            break
+
+    assert seen == expected
+    assert pages == 7
+    # 上游只在第一頁與快取清除後各查一次，其餘頁面從合併結果取
+    assert gcis.requests - gcis_before == 2
+    assert db.requests - db_before == 2
+
+
+def test_queries_upstreams_concurrently(api, stubs, server):
+    gcis, db = stubs
+    gcis.latency = db.latency = 0.4
+    started = time.monotonic()
+    status, _, body = get(server, "台灣積體")
+    assert status == 200
+    assert [row["統一編號"] for row in body["data"]] == ["22099131"]
+    assert time.monotonic() - started < 0.75
+
+
+def test_govt_failure_returns_local_rows_uncached(api, stubs, server):
+    gcis, _ = stubs
+    gcis.error_rate = 1.0
+    status, headers, body = get(server, "測試", limit=500)
+
+    assert status == 200
+    assert body["govt_skipped"] is True
+    assert {row["資料來源"] for row in body["data"]} == {"非營利事業", "全國各級學校"}
+    assert headers["Cache-Control"] == "no-store"
+    assert api.name_cache.get("測試") is None
+
+
+def test_invalid_cursor_is_rejected(api, stubs, server):
+    status, _, body = get(server, "測試", cursor="not-a-cursor")
+    assert status == 400
+    assert body["error"] == "cursor 格式錯誤"
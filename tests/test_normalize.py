@@ -0,0 +1,79 @@
+import json
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from conftest import post_json
+
+
+@pytest.mark.parametrize("tax_id, expected", [
+    ("22099131", True),
+    ("04541302", True),
+    ("04199019", True),
+    # 第七碼為 7，位數和 10 視為 1 或 0
+    ("10458575", True),
+    ("10458574", True),
+    ("22099132", False),
+    ("99999999", False),
+])
+def test_valid_checksum(api, tax_id, expected):
+    assert api.valid_checksum(tax_id) is expected
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("22099131", ("22099131", None)),
+    ("２２０９９１３１", ("22099131", None)),
+    (" 2209-9131 ", ("22099131", None)),
+    ("2209．9131", ("22099131", None)),
+    ("4541302", ("04541302", None)),
+    (4541302, ("04541302", None)),
+    ("22099132", ("22099132", "統一編號檢查碼錯誤")),
+    ("220991311", (None, "統一編號格式錯誤")),
+    ("A2099131", (None, "統一編號格式錯誤")),
+    ("", (None, "統一編號格式錯誤")),
+])
+def test_normalize_tax_id(api, raw, expected):
+    assert api.normalize_tax_id(raw) == expected
+
+
+def test_resolve_dedups_and_fans_out(api, fake_db, monkeypatch):
+    calls = []
+    monkeypatch.setattr(api, "query_govt", lambda tax_id, timeout: calls.append(tax_id))
+
+    out = api.resolve_ids(["04199019", "０４１９９０１９", "4199019", "abc", "22099132"], False, time.monotonic() + 5)
+
+    assert calls == ["04199019"]
+    assert [row["統一編號"] for row in out] == ["04199019", "04199019", "04199019", "abc", "22099132"]
+    assert [row["資料來源"] for row in out] == [
+        "地方政府機關", "地方政府機關", "地方政府機關", "統一編號格式錯誤", "統一編號檢查碼錯誤"
+    ]
+
+
+def test_checksum_failures_found_locally_are_kept(api, fake_db, monkeypatch):
+    calls = []
+    monkeypatch.setattr(api, "query_govt", lambda tax_id, timeout: calls.append(tax_id))
+
+    [row] = api.resolve_ids(["03730043"], False, time.monotonic() + 5)
+
+    # 自建資料中有些機關統編不符檢查碼規則，仍要查得到，但不必問政府 API
+    assert row["單位名稱"] == "國立臺灣大學"
+    assert calls == []
+
+
+def test_invalid_format_never_hits_upstream(api, fake_db, server, monkeypatch):
+    monkeypatch.setattr(api, "query_govt", lambda tax_id, timeout: pytest.fail("should not call govt"))
+
+    body = post_json(server, "/api", {"ids": ["12-34-56-78-9", "hello"]})
+
+    assert [row["資料來源"] for row in body["data"]] == ["統一編號格式錯誤", "統一編號格式錯誤"]
+    assert fake_db.calls == []
+
+
+def test_get_invalid_id_returns_400(api, fake_db, server):
+    with pytest.raises(urllib.error.HTTPError) as exc:
+        urllib.request.urlopen(server + "/?id=hello")
+
+    assert exc.value.code == 400
+    assert json.loads(exc.value.read())["error"] == "統一編號格式錯誤"
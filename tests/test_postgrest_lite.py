@@ -0,0 +1,42 @@
+import pytest
+import requests
+
+from postgrest_lite import APIError, PostgrestClient
+from tools.stub_servers import PostgrestStub, make_units
+
+
+@pytest.fixture
+def stub_rows():
+    rows = make_units(30)
+    rows.append({"tax_id": "12345675", "name": '逗號,與"引號"', "source": "非營利事業"})
+    with PostgrestStub({"unified_numbers": rows}) as stub:
+        session = requests.Session()
+        yield PostgrestClient(stub.url, "test-key", session=lambda: session), rows, stub
+        session.close()
+
+
+def test_read_queries_match_supabase_sdk(stub_rows):
+    client, rows, _ = stub_rows
+    table = lambda: client.table("unified_numbers")  # noqa: E731
+
+    wanted = [rows[0]["tax_id"], rows[5]["tax_id"], "99999997"]
+    assert {r["tax_id"] for r in table().select("*").in_("tax_id", wanted).execute().data} == set(wanted[:2])
+    found = table().select("*").ilike("name", "%臺北市%").limit(3).execute().data
+    assert 0 < len(found) <= 3 and all("臺北市" in r["name"] for r in found)
+    assert table().select("*").eq("source", "非營利事業").execute().data
+    ordered = table().select("tax_id").gt("tax_id", rows[10]["tax_id"]).order("tax_id").limit(5).execute().data
+    assert [r["tax_id"] for r in ordered] == sorted(r["tax_id"] for r in rows if r["tax_id"] > rows[10]["tax_id"])[:5]
+
+
+def test_in_filter_quotes_reserved_characters(stub_rows):
+    client, _, _ = stub_rows
+    data = client.table("unified_numbers").select("*").in_("name", ['逗號,與"引號"']).execute().data
+    assert [r["tax_id"] for r in data] == ["12345675"]
+
+
+def test_http_errors_raise(stub_rows):
+    client, _, stub = stub_rows
+    stub.error_rate = 1.0
+    with pytest.raises(APIError) as e:
+        client.table("unified_numbers").select("*").limit(1).execute()
+    assert e.value.status == 503
@@ -0,0 +1,60 @@
+import time
+
+import pytest
+
+from lookup_snapshot import Snapshot, write_snapshot
+
+
+def test_roundtrip_sorted_and_searchable(tmp_path):
+    path = str(tmp_path / "s.snap")
+    rows = [
+        ("22222222", "乙", "B"),
+        ("11111111", "甲", "A"),
+        (" 33333333 ", float("nan"), "A"),
+        ("11111111", "重複", "B"),
+        ("1234", "格式錯誤", "A"),
+        (None, "空的", "A"),
+    ]
+
+    assert write_snapshot(path, rows, created_at=1700000000) == 3
+
+    snap = Snapshot(path)
+    assert list(snap) == [("11111111", "甲", "A"), ("22222222", "乙", "B"), ("33333333", "", "A")]
+    assert snap.get("22222222") == ("乙", "B")
+    assert snap.get("00000000") is None
+    assert snap.get("99999999") is None
+    assert snap.get("臺大") is None
+    assert snap.created_at == 1700000000
+    snap.close()
+
+
+def test_empty_snapshot(tmp_path):
+    path = str(tmp_path / "s.snap")
+    write_snapshot(path, [])
+    assert Snapshot(path).get("11111111") is None
+
+
+def test_rejects_unknown_format(tmp_path):
+    path = tmp_path / "s.snap"
+    path.write_bytes(b"not a snapshot at all, definitely")
+    with pytest.raises(ValueError):
+        Snapshot(str(path))
+
+
+def test_lookup_uses_snapshot_without_supabase(api, fake_db, snapshot_file, monkeypatch):
+    monkeypatch.setattr(api, "query_govt", lambda tax_id, timeout: None)
+
+    results = api.lookup_ids(["77777777", "99999999"], False, time.monotonic() + 5)
+
+    assert results["77777777"]["單位名稱"] == "財團法人測試基金會"
+    assert results["99999999"]["資料來源"] == "查無資料"
+    assert fake_db.calls == []
+
+
+def test_stale_snapshot_falls_back_to_supabase(api, fake_db, snapshot_file, monkeypatch):
+    write_snapshot(snapshot_file, [("03730043", "舊資料", "全國各級學校")], created_at=time.time() - 30 * 86400)
+
+    results = api.lookup_ids(["03730043"], True, time.monotonic() + 5)
+
+    assert results["03730043"]["單位名稱"] == "國立臺灣大學"
+    assert len(fake_db.calls) == 1
@@ -0,0 +1,82 @@
+import json
+import time
+import urllib.request
+
+from conftest import post_json
+
+
+def log_lines(capsys, expected=0, timeout=2.0):
+    """
+    讀取 handler 輸出的 JSON 紀錄。紀錄在回應送出後才印出，
+    指定 expected 時等到至少有這麼多行 (或逾時) 再回傳。
+    """
+    lines = []
+    deadline = time.monotonic() + timeout
+    while True:
+        for line in capsys.readouterr().out.splitlines():
+            if line.startswith("{"):
+                lines.append(json.loads(line))
+        if len(lines) >= expected or time.monotonic() > deadline:
+            return lines
+        time.sleep(0.01)
+
+
+def test_server_timing_format(api):
+    trace = api.RequestTrace("test")
+    trace.add("db", 0.010)
+    trace.add("db", 0.005)
+    trace.add("govt_id", 0.2)
+    trace.add("govt_id", 0.3)
+
+    parts = dict(p.split(";", 1) for p in trace.server_timing().split(", "))
+    assert parts["db"] == 'dur=15.0;desc="n=2"'
+    # 併發的階段取最慢一筆
+    assert parts["govt_id"] == 'dur=300.0;desc="n=2"'
+    assert "total" in parts
+
+
+def test_null_trace_records_nothing(api):
+    api.NO_TRACE.add("db", 1)
+    api.NO_TRACE.count("ids", 3)
+    assert api.NO_TRACE.stages == {} and api.NO_TRACE.counts == {}
+
+
+def test_get_emits_header_and_log_line(api, fake_db, server, monkeypatch, capsys):
+    monkeypatch.setattr(api, "query_govt", lambda tax_id, timeout: None)
+
+    with urllib.request.urlopen(server + "/?id=04199019") as resp:
+        timing = resp.headers["Server-Timing"]
+        json.loads(resp.read())
+
+    names = [part.split(";")[0] for part in timing.split(", ")]
+    for stage in ("parse", "db_client", "normalize", "cache", "govt", "govt_id", "db", "serialize", "total"):
+        assert stage in names
+    [record] = log_lines(capsys, 1)
+    assert record["route"] == "GET id"
+    assert record["status"] == 200
+    assert record["counts"]["govt_miss"] == 1
+    assert record["counts"]["db_hit"] == 1
+    assert record["hit_ratio"]["db"] == 1.0
+
+
+def test_post_log_counts_and_hit_ratios(api, fake_db, server, monkeypatch, capsys):
+    monkeypatch.setattr(api, "query_govt", lambda tax_id, timeout: None)
+    post_json(server, "/api", {"ids": ["04199019", "99999997"], "skip_govt": True})
+    log_lines(capsys, 1)
+
+    post_json(server, "/api", {"ids": ["04199019", "04199019", "99999997", "abc"], "skip_govt": True})
+
+    [record] = log_lines(capsys, 1)
+    assert record["route"] == "POST"
+    assert record["counts"]["ids"] == 4
+    assert record["counts"]["unique_ids"] == 2
+    assert record["counts"]["invalid_format"] == 1
+    # 第二次全部命中快取
+    assert record["hit_ratio"]["cache"] == 1.0
+    assert set(record["stages_ms"]) >= {"parse", "normalize", "cache", "serialize"}
+
+
+def test_request_log_can_be_disabled(api, fake_db, server, monkeypatch, capsys):
+    monkeypatch.setattr(api, "REQUEST_LOG", False)
+    post_json(server, "/api", {"ids": ["04199019"], "skip_govt": True})
+    assert log_lines(capsys) == []
@@ -0,0 +1,289 @@
+"""
+api/index.py 的壓測工具，全部在本機執行，不會打到真正的 GCIS 與 Supabase。
+
+啟動 GCIS 與 PostgREST 替身 (可設定延遲、錯誤率與資料量)，以本機 HTTP server 執行 handler，
+依情境重播請求，回報各情境的吞吐量與 p50/p95/p99 延遲：
+
+    python tools/bench.py
+    python tools/bench.py --scenarios get_id,bulk_100 --requests 200 --concurrency 8 \\
+        --gcis-latency 0.15 --gcis-error-rate 0.05 --db-latency 0.03 --snapshot
+
+情境：
+    get_id      單筆統編 GET (公司、自建資料與查無資料混合)
+    name        名稱查詢 GET
+    bulk_10 / bulk_100 / bulk_1000
+                批次 POST，每次 10 / 100 / 1000 筆
+    mix         依 --mix 權重混合上述請求，預設 get_id 70%、name 20%、bulk_10 10%
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from http.server import ThreadingHTTPServer
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from known_ids import write_known_ids  # noqa: E402
+from lookup_snapshot import Snapshot, write_snapshot  # noqa: E402
+from name_index import write_name_index  # noqa: E402
+from tools.stub_servers import GcisStub, PostgrestStub, make_companies, make_units  # noqa: E402
+
+SCENARIOS = ["get_id", "name", "bulk_10", "bulk_100", "bulk_1000", "mix"]
+DEFAULT_MIX = "get_id=70,name=20,bulk_10=10"
+NAME_QUERIES = ["臺北市", "國民小學", "基金會", "高雄市衛生局", "台中市", "協會", "第12", "科技"]
+
+
+def percentile(sorted_values, p):
+    """nearest-rank 百分位數"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class Workload:
+    """依資料集產生請求；統編從公司、自建資料與查無資料三者中抽樣"""
+
+    def __init__(self, companies, units, seed=0, miss_ratio=0.1, unit_ratio=0.3):
+        self.company_ids = list(companies)
+        self.unit_ids = [row["tax_id"] for row in units]
+        self.miss_ratio = miss_ratio
+        self.unit_ratio = unit_ratio
+        self._local = threading.local()
+        self._seeds = iter(range(seed, seed + 1000000))
+        self._lock = threading.Lock()
+
+    @property
+    def rng(self):
+        # 每個執行緒各自一個 Random，避免共用鎖影響量測
+        if not hasattr(self._local, "rng"):
+            with self._lock:
+                self._local.rng = random.Random(next(self._seeds))
+        return self._local.rng
+
+    def tax_id(self):
+        roll = self.rng.random()
+        if roll < self.miss_ratio:
+            # 檢查碼正確但不存在的統編
+            return "99999997"
+        if roll < self.miss_ratio + self.unit_ratio and self.unit_ids:
+            return self.rng.choice(self.unit_ids)
+        return self.rng.choice(self.company_ids)
+
+    def request(self, scenario):
+        """回傳 (method, path, body)"""
+        if scenario == "get_id":
+            return "GET", "/?id=" + self.tax_id(), None
+        if scenario == "name":
+            return "GET", "/?name=" + urllib.parse.quote(self.rng.choice(NAME_QUERIES)), None
+        if scenario.startswith("bulk_"):
+            ids = [self.tax_id() for _ in range(int(scenario.split("_")[1]))]
+            return "POST", "/api", json.dumps({"ids": ids}).encode("utf-8")
+        raise ValueError(f"unknown scenario: {scenario}")
+
+
+class Bench:
+    """在同一個 process 內啟動替身與 API，結束時全部關閉"""
+
+    def __init__(self, args):
+        self.args = args
+        self.tmp = tempfile.TemporaryDirectory(prefix="ubn-bench-")
+        self.companies = make_companies(args.companies, seed=args.seed)
+        self.units = make_units(args.rows, seed=args.seed)
+        self.gcis = GcisStub(
+            self.companies, latency=args.gcis_latency, jitter=args.jitter,
+            error_rate=args.gcis_error_rate, seed=args.seed,
+        ).start()
+        self.db = PostgrestStub(
+            {"unified_numbers": self.units}, latency=args.db_latency, jitter=args.jitter,
+            error_rate=args.db_error_rate, seed=args.seed,
+        ).start()
+        self.api = self._load_api()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.workload = Workload(self.companies, self.units, seed=args.seed, miss_ratio=args.miss_ratio)
+
+    def _load_api(self):
+        args = self.args
+        snapshot_path = os.path.join(self.tmp.name, "lookup.snap")
+        index_path = os.path.join(self.tmp.name, "name_index.bin")
+        mirror_path = os.path.join(self.tmp.name, "gcis_mirror.snap")
+        known_ids_path = os.path.join(self.tmp.name, "known_ids.bin")
+        if args.snapshot:
+            write_snapshot(snapshot_path, ((r["tax_id"], r["name"], r["source"]) for r in self.units))
+            snapshot = Snapshot(snapshot_path)
+            write_name_index(index_path, snapshot)
+            snapshot.close()
+            write_known_ids(known_ids_path, (r["tax_id"] for r in self.units))
+        if args.mirror:
+            write_snapshot(mirror_path, ((t, n, "經濟部商業司") for t, n in self.companies.items()))
+        os.environ.update({
+            "GCIS_API_URL": self.gcis.url,
+            "GCIS_NAME_API_URL": self.gcis.url,
+            "SUPABASE_URL": self.db.url,
+            "SUPABASE_KEY": "bench",
+            "SNAPSHOT_PATH": snapshot_path,
+            "NAME_INDEX_PATH": index_path,
+            "GCIS_MIRROR_PATH": mirror_path,
+            "KNOWN_IDS_PATH": known_ids_path,
+        })
+        spec = importlib.util.spec_from_file_location("api_index", os.path.join(ROOT_DIR, "api", "index.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    def _handler_class(self):
+        api = self.api
+        if self.args.verbose:
+            return api.handler
+        # 壓測時關掉存取紀錄與 API 的 print，避免輸出拖慢量測
+        api.print = lambda *args, **kwargs: None
+
+        class QuietHandler(api.handler):
+            def log_message(self, format, *args):
+                pass
+
+        return QuietHandler
+
+    def reset(self):
+        """每個情境從冷快取開始，結果才能互相比較"""
+        if not self.args.warm_cache:
+            self.api.lookup_cache.clear()
+            self.api.name_cache.clear()
+
+    def run(self, scenario):
+        args = self.args
+        self.reset()
+        host, port = self.httpd.server_address[:2]
+        if scenario == "mix":
+            weights = dict((k, float(v)) for k, v in (part.split("=") for part in args.mix.split(",")))
+            choices, cum = list(weights), list(weights.values())
+        total = args.requests if not scenario.startswith("bulk_1000") else max(1, args.requests // 10)
+        local = threading.local()
+        latencies = []
+        errors = [0]
+        lock = threading.Lock()
+
+        def one(i):
+            if not hasattr(local, "conn"):
+                local.conn = HTTPConnection(host, port, timeout=60)
+            kind = self.workload.rng.choices(choices, cum)[0] if scenario == "mix" else scenario
+            method, path, body = self.workload.request(kind)
+            headers = {"Content-Type": "application/json"} if body else {}
+            started = time.perf_counter()
+            try:
+                local.conn.request(method, path, body=body, headers=headers)
+                resp = local.conn.getresponse()
+                resp.read()
+                ok = resp.status < 500
+                if resp.will_close:
+                    local.conn.close()
+                    del local.conn
+            except Exception:
+                ok = False
+                local.conn.close()
+                del local.conn
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors[0] += 1
+
+        gcis_before, db_before = self.gcis.requests, self.db.requests
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            list(executor.map(one, range(total)))
+        wall = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            "scenario": scenario,
+            "requests": total,
+            "errors": errors[0],
+            "seconds": round(wall, 3),
+            "rps": round(total / wall, 1) if wall else None,
+            "p50_ms": _ms(percentile(latencies, 50)),
+            "p95_ms": _ms(percentile(latencies, 95)),
+            "p99_ms": _ms(percentile(latencies, 99)),
+            "gcis_calls": self.gcis.requests - gcis_before,
+            "db_calls": self.db.requests - db_before,
+        }
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.gcis.stop()
+        self.db.stop()
+        self.tmp.cleanup()
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def format_table(results):
+    columns = ["scenario", "requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms", "gcis_calls", "db_calls"]
+    rows = [[str(r[c]) for c in columns] for r in results]
+    widths = [max(len(c), *(len(row[i]) for row in rows)) for i, c in enumerate(columns)]
+    lines = ["  ".join(c.ljust(w) for c, w in zip(columns, widths))]
+    lines += ["  ".join(v.rjust(w) for v, w in zip(row, widths)) for row in rows]
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="以本機替身壓測 api/index.py")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"逗號分隔，可用: {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=200, help="每個情境的請求數 (bulk_1000 為十分之一)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="mix 情境的權重")
+    parser.add_argument("--companies", type=int, default=20000, help="GCIS 替身的公司筆數")
+    parser.add_argument("--rows", type=int, default=20000, help="PostgREST 替身的自建資料筆數")
+    parser.add_argument("--miss-ratio", type=float, default=0.1, help="查無資料的統編比例")
+    parser.add_argument("--gcis-latency", type=float, default=0.05)
+    parser.add_argument("--gcis-error-rate", type=float, default=0.0)
+    parser.add_argument("--db-latency", type=float, default=0.02)
+    parser.add_argument("--db-error-rate", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.5, help="延遲的隨機浮動比例 (0-1)")
+    parser.add_argument("--snapshot", action="store_true", help="產生自建資料快照、名稱索引與統編清單")
+    parser.add_argument("--mirror", action="store_true", help="產生 GCIS 鏡像")
+    parser.add_argument("--warm-cache", action="store_true", help="情境之間不清除查詢快取")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="顯示存取紀錄與 API 的輸出")
+    parser.add_argument("--json", help="另外把結果寫成 JSON 檔")
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios.split(",")) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    bench = Bench(args)
+    results = []
+    try:
+        for scenario in args.scenarios.split(","):
+            print(f"執行情境 {scenario} ...", flush=True)
+            results.append(bench.run(scenario))
+    finally:
+        bench.close()
+    print(format_table(results))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
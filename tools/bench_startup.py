@@ -0,0 +1,119 @@
+"""
+量測 api/index.py 的冷啟動成本：每次開一個全新的 Python process，記錄載入模組的時間、
+第一個說明頁面請求的時間、載入的模組數與記憶體用量 (max RSS)，重複多次後回報中位數與最大值。
+
+    python tools/bench_startup.py
+    python tools/bench_startup.py --runs 20 --json startup.json
+    python tools/bench_startup.py --module /tmp/old_index.py   # 與舊版本比較
+
+部署前後各跑一次，可追蹤冷啟動的 import 成本是否退步。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODULE = os.path.join(ROOT_DIR, "api", "index.py")
+# 冷啟動時不應該載入的大型套件
+HEAVY_MODULES = ("requests", "supabase", "httpx", "pandas")
+
+# 在全新的 process 中執行，最後一行輸出 JSON 結果
+CHILD = r"""
+import time
+started = time.perf_counter()
+import importlib.util, json, resource, sys
+sys.path.insert(0, sys.argv[2])
+spec = importlib.util.spec_from_file_location("api_index", sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+imported = time.perf_counter()
+
+import threading
+from http.client import HTTPConnection
+from http.server import HTTPServer
+
+class Handler(module.handler):
+    def log_message(self, format, *args):
+        pass
+
+httpd = HTTPServer(("127.0.0.1", 0), Handler)
+thread = threading.Thread(target=httpd.handle_request, daemon=True)
+thread.start()
+requested = time.perf_counter()
+conn = HTTPConnection(*httpd.server_address[:2])
+conn.request("GET", "/", headers={"Accept-Encoding": "gzip"})
+resp = conn.getresponse()
+resp.read()
+served = time.perf_counter()
+thread.join()
+
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "first_request_ms": (served - requested) * 1000,
+    "status": resp.status,
+    "modules": len(sys.modules),
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "heavy_modules": [m for m in sys.argv[3].split(",") if m in sys.modules],
+}))
+"""
+
+
+def measure(module_path, python=sys.executable):
+    """在全新的 process 中載入模組並送出一個請求，回傳量測結果 dict"""
+    env = dict(os.environ)
+    # 冷啟動只量測模組本身，不使用 repo 內的快照
+    env.setdefault("SNAPSHOT_PATH", os.devnull)
+    env["REQUEST_LOG"] = "0"
+    out = subprocess.run(
+        [python, "-c", CHILD, module_path, ROOT_DIR, ",".join(HEAVY_MODULES)],
+        cwd=ROOT_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def summarize(samples):
+    summary = {}
+    for key in ("import_ms", "first_request_ms", "modules", "max_rss_kb"):
+        values = [s[key] for s in samples]
+        summary[key] = {
+            "median": round(statistics.median(values), 1),
+            "min": round(min(values), 1),
+            "max": round(max(values), 1),
+        }
+    summary["heavy_modules"] = sorted({m for s in samples for m in s["heavy_modules"]})
+    return summary
+
+
+def format_summary(summary):
+    lines = ["metric            median       min       max"]
+    for key in ("import_ms", "first_request_ms", "modules", "max_rss_kb"):
+        row = summary[key]
+        lines.append(f"{key:<16} {row['median']:>8} {row['min']:>9} {row['max']:>9}")
+    lines.append("heavy modules loaded: " + (", ".join(summary["heavy_modules"]) or "none"))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="量測 api/index.py 的冷啟動成本")
+    parser.add_argument("--runs", type=int, default=10, help="重複次數 (每次都是新的 process)")
+    parser.add_argument("--module", default=DEFAULT_MODULE, help="要量測的 handler 模組路徑")
+    parser.add_argument("--json", help="另外把結果寫成 JSON 檔")
+    args = parser.parse_args(argv)
+
+    # 第一次執行會產生 .pyc，不列入統計
+    measure(args.module)
+    samples = [measure(args.module) for _ in range(max(1, args.runs))]
+    summary = summarize(samples)
+    print(format_summary(summary))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"module": args.module, "runs": len(samples), "summary": summary, "samples": samples},
+                      f, ensure_ascii=False, indent=2)
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""
+本機替身伺服器，測試與壓測時取代經濟部商業司 (GCIS) API 與 Supabase (PostgREST)。
+
+    python tools/stub_servers.py gcis --port 8081 --companies 100000 --latency 0.05 --error-rate 0.01
+    python tools/stub_servers.py postgrest --port 8082 --rows 150000 --latency 0.02
+
+API 與 batch_update.py 透過環境變數 GCIS_API_URL 指向 GCIS 替身，
+SUPABASE_URL 指向 PostgREST 替身 (SUPABASE_KEY 任意填寫) 即可。
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+UBN_WEIGHTS = (1, 2, 1, 2, 1, 2, 4, 1)
+
+
+def _checksum_ok(tax_id):
+    # 與 api/index.py 的 valid_checksum 相同規則，產生的假資料才不會被當成檢查碼錯誤
+    total = sum(int(d) * w // 10 + int(d) * w % 10 for d, w in zip(tax_id, UBN_WEIGHTS))
+    return total % 5 == 0 or (tax_id[6] == '7' and (total + 1) % 5 == 0)
+
+
+def _valid_ids(start):
+    candidate = start
+    while True:
+        tax_id = "%08d" % candidate
+        candidate += 1
+        if _checksum_ok(tax_id):
+            yield tax_id
+
+
+def make_companies(count, seed=0, start=10000000):
+    """產生 count 筆檢查碼正確的假公司資料，回傳依統編排序的 {統編: 名稱}"""
+    rng = random.Random(seed)
+    words = ["台灣", "國際", "科技", "電子", "實業", "貿易", "建設", "生技", "資訊", "光電", "精密", "食品"]
+    ids = _valid_ids(start)
+    return {next(ids): "".join(rng.sample(words, 3)) + "股份有限公司" for _ in range(count)}
+
+
+def make_units(count, seed=0, start=70000000):
+    """產生 count 筆假的自建資料 (學校、機關、非營利事業)，回傳 unified_numbers 表的 row list"""
+    rng = random.Random(seed)
+    places = ["臺北市", "新北市", "臺中市", "臺南市", "高雄市", "桃園市", "新竹縣", "花蓮縣"]
+    kinds = [
+        ("立{}國民小學", "全國各級學校"), ("立{}高級中學", "全國各級學校"),
+        ("{}政府", "地方政府機關"), ("{}衛生局", "地方政府機關"),
+        ("財團法人{}文教基金會", "非營利事業"), ("社團法人{}協會", "非營利事業"),
+    ]
+    ids = _valid_ids(start)
+    rows = []
+    for i in range(count):
+        pattern, source = rng.choice(kinds)
+        name = rng.choice(places) + pattern.format("第%d" % i if "立" in pattern else "")
+        rows.append({"tax_id": next(ids), "name": name, "source": source})
+    return rows
+
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 呼叫端逾時先斷線是壓測的常態，不必印出 traceback
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubServer:
+    """在背景執行緒跑 ThreadingHTTPServer，port 為 0 時自動挑選可用的 port"""
+
+    def __init__(self, handler_class, port=0, host="127.0.0.1"):
+        self.httpd = _QuietServer((host, port), handler_class)
+        self.httpd.stub = self
+        self._thread = None
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _FaultInjectingHandler(BaseHTTPRequestHandler):
+    """依伺服器設定加上延遲與隨機錯誤"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def inject_faults(self):
+        stub = self.server.stub
+        stub.count_request()
+        if stub.latency:
+            time.sleep(stub.latency * (1 + stub.jitter * (stub.rng.random() * 2 - 1)))
+        if stub.error_rate and stub.rng.random() < stub.error_rate:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return True
+        return False
+
+    def send_body(self, body, content_type="application/json"):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _GcisHandler(_FaultInjectingHandler):
+    def do_GET(self):
+        if self.inject_faults():
+            return
+        stub = self.server.stub
+        params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        filter_expr = params.get("$filter", "")
+        skip = int(params.get("$skip", 0))
+        top = min(int(params.get("$top", 1000)), stub.max_top)
+        if filter_expr.startswith("Business_Accounting_NO eq "):
+            tax_id = filter_expr.rsplit(" ", 1)[1]
+            ids = [tax_id] if tax_id in stub.companies else []
+        elif filter_expr.startswith("Company_Name like "):
+            # 公司名稱資料集：Company_Name like X and Company_Status eq 01 (部分吻合)
+            name = filter_expr[len("Company_Name like "):].split(" and ")[0]
+            ids = [t for t in stub.sorted_ids if name in stub.companies[t]][skip:skip + top]
+        else:
+            ids = stub.sorted_ids[skip:skip + top]
+        # 與真正的 GCIS 一樣，查無資料時回傳空白內容
+        if not ids:
+            self.send_body(b"")
+            return
+        rows = [
+            {"Business_Accounting_NO": t, "Company_Name": stub.companies[t], "Company_Status": "01"}
+            for t in ids
+        ]
+        self.send_body(json.dumps(rows, ensure_ascii=False).encode("utf-8"))
+
+
+class GcisStub(StubServer):
+    """
+    經濟部商業司 API 替身：支援 $filter=Business_Accounting_NO eq X 單筆查詢、
+    Company_Name like X 名稱查詢，以及沒有 $filter 時以 $skip/$top 分頁列出全部公司。
+    不同資料集的網址都指向同一個替身即可。
+    """
+
+    def __init__(self, companies, latency=0.0, jitter=0.0, error_rate=0.0, seed=0, max_top=1000, port=0):
+        super().__init__(_GcisHandler, port)
+        self.companies = companies
+        self.sorted_ids = sorted(companies)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_top = max_top
+        self.rng = random.Random(seed)
+
+
+def _like(pattern):
+    # PostgREST 的 like/ilike 以 * 或 % 為萬用字元
+    parts = pattern.replace("*", "%").split("%")
+    return lambda value: _like_match(parts, value)
+
+
+def _like_match(parts, value):
+    if len(parts) == 1:
+        return value == parts[0]
+    if not value.startswith(parts[0]) or not value.endswith(parts[-1]):
+        return False
+    pos = len(parts[0])
+    end = len(value) - len(parts[-1])
+    for part in parts[1:-1]:
+        pos = value.find(part, pos, end)
+        if pos < 0:
+            return False
+        pos += len(part)
+    return pos <= end
+
+
+def _in_values(text):
+    """拆開 in.(a,"b,c") 的值：雙引號內的逗號不算分隔，反斜線跳脫下一個字元"""
+    values, current, quoted, i = [], [], False, 0
+    while i < len(text):
+        ch = text[i]
+        if ch == "\\" and quoted and i + 1 < len(text):
+            current.append(text[i + 1])
+            i += 1
+        elif ch == '"':
+            quoted = not quoted
+        elif ch == "," and not quoted:
+            values.append("".join(current))
+            current = []
+        else:
+            current.append(ch)
+        i += 1
+    values.append("".join(current))
+    return values
+
+
+def _parse_filter(expr):
+    """把 PostgREST 的 "op.value" 轉成判斷函式，只支援這個專案用到的運算子"""
+    op, _, arg = expr.partition(".")
+    if op == "in":
+        values = set(_in_values(arg[1:-1] if arg.startswith("(") else arg))
+        return lambda v: v in values
+    if op in ("like", "ilike"):
+        match = _like(arg.lower() if op == "ilike" else arg)
+        return (lambda v: match((v or "").lower())) if op == "ilike" else (lambda v: match(v or ""))
+    comparisons = {
+        "eq": lambda v: v == arg, "neq": lambda v: v != arg,
+        "gt": lambda v: v is not None and v > arg, "gte": lambda v: v is not None and v >= arg,
+        "lt": lambda v: v is not None and v < arg, "lte": lambda v: v is not None and v <= arg,
+    }
+    if op not in comparisons:
+        raise ValueError(f"unsupported operator: {op}")
+    return comparisons[op]
+
+
+class _PostgrestHandler(_FaultInjectingHandler):
+    RESERVED = {"select", "limit", "offset", "order", "on_conflict", "columns"}
+
+    def _table(self):
+        parsed = urlparse(self.path)
+        prefix = "/rest/v1/"
+        if not parsed.path.startswith(prefix):
+            return None, None
+        params = parse_qs(parsed.query, keep_blank_values=True)
+        return self.server.stub.tables.setdefault(unquote(parsed.path[len(prefix):]), {}), params
+
+    def _matching(self, table, params):
+        filters = [(k, _parse_filter(v[0])) for k, v in params.items() if k not in self.RESERVED]
+        return [row for row in table.values() if all(f(row.get(k)) for k, f in filters)]
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"null")
+
+    def do_GET(self):
+        if self.inject_faults():
+            return
+        table, params = self._table()
+        if table is None:
+            self.send_error(404)
+            return
+        rows = self._matching(table, params)
+        if "order" in params:
+            column, _, direction = params["order"][0].partition(".")
+            rows.sort(key=lambda r: r.get(column) or "", reverse=direction.startswith("desc"))
+        offset = int(params.get("offset", ["0"])[0])
+        limit = params.get("limit", [None])[0]
+        # .range() 會以 Range header 指定範圍
+        range_header = self.headers.get("Range")
+        if range_header and "-" in range_header:
+            start, end = range_header.split("-")
+            offset, limit = int(start), int(end) - int(start) + 1
+        rows = rows[offset:offset + int(limit)] if limit is not None else rows[offset:]
+        self.send_body(json.dumps(rows, ensure_ascii=False).encode("utf-8"))
+
+    def do_POST(self):
+        # upsert：以 on_conflict 欄位 (預設 tax_id) 為 key 覆寫
+        if self.inject_faults():
+            return
+        table, params = self._table()
+        if table is None:
+            self.send_error(404)
+            return
+        key = params.get("on_conflict", ["tax_id"])[0]
+        payload = self._read_json()
+        for row in payload if isinstance(payload, list) else [payload]:
+            table[row[key]] = dict(row)
+        self.send_body(b"[]")
+
+    def do_DELETE(self):
+        if self.inject_faults():
+            return
+        table, params = self._table()
+        if table is None:
+            self.send_error(404)
+            return
+        for row in self._matching(table, params):
+            table.pop(row["tax_id"], None)
+        self.send_body(b"[]")
+
+
+class PostgrestStub(StubServer):
+    """
+    Supabase (PostgREST) 替身：資料放在記憶體中，
+    支援 select 與 eq / in / ilike / gt 等篩選、order、limit/offset、Range，以及 upsert 與 delete。
+    """
+
+    def __init__(self, tables=None, latency=0.0, jitter=0.0, error_rate=0.0, seed=0, port=0):
+        super().__init__(_PostgrestHandler, port)
+        # {資料表: {tax_id: row}}
+        self.tables = {
+            name: {row["tax_id"]: dict(row) for row in rows} for name, rows in (tables or {}).items()
+        }
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="啟動本機替身伺服器")
+    parser.add_argument("kind", choices=["gcis", "postgrest"])
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--companies", type=int, default=10000, help="GCIS 替身的假公司資料筆數")
+    parser.add_argument("--rows", type=int, default=10000, help="PostgREST 替身 unified_numbers 表的筆數")
+    parser.add_argument("--latency", type=float, default=0.0, help="每個請求的延遲秒數")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延遲的隨機浮動比例 (0-1)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="回傳 503 的機率 (0-1)")
+    args = parser.parse_args(argv)
+
+    faults = dict(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, port=args.port)
+    if args.kind == "gcis":
+        stub = GcisStub(make_companies(args.companies), **faults)
+    else:
+        stub = PostgrestStub({"unified_numbers": make_units(args.rows)}, **faults)
+    print(f"{args.kind} stub listening on {stub.url}")
+    try:
+        stub.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()